@@ -7,14 +7,46 @@ from CIME.utils import append_testlog, get_model, safe_copy, get_timestamp, CIME
 from CIME.test_status import *
 from CIME.hist_utils import copy_histfiles, compare_test, generate_teststatus, \
     compare_baseline, get_ts_synopsis, generate_baseline
-from CIME.provenance import save_test_time, get_test_success
+from CIME.provenance import save_test_time, get_test_success, get_perf_samples, save_perf_sample
 from CIME.locked_files import LOCKED_DIR, lock_file, is_locked
+from CIME.coupler_log import read_coupler_log, coupler_log_contains
 import CIME.build as build
 
-import glob, gzip, time, traceback, six, os
+import glob, time, traceback, os
 
 logger = logging.getLogger(__name__)
 
+# With at least this many baseline samples, TPUTCOMP and MEMCOMP compare with a
+# robust confidence bound around their median. The configured tolerance stays
+# the narrowest allowed bound, the spread of the samples can only widen it.
+_PERF_MIN_SAMPLES = 10
+_PERF_MAD_SIGMAS  = 3.0  # Width of the bound in robust standard deviations (1.4826 * MAD)
+
+def _get_perf_bound(samples, tolerance):
+    """
+    Returns (median, allowed deviation from the median) for baseline samples.
+    The allowed deviation is the fraction tolerance of the median, or wider
+    if there are enough samples and they are noisy.
+
+    >>> _get_perf_bound([8.0], 0.25)
+    (8.0, 2.0)
+    >>> _get_perf_bound([5.0] * 10, 0.1)
+    (5.0, 0.5)
+    >>> median, bound = _get_perf_bound([10.0, 10.2, 9.8, 10.1, 30.0, 9.0, 11.0, 10.5, 9.5, 12.0], 0.05)
+    >>> "{:.2f} {:.3f}".format(median, bound)
+    '10.15 2.224'
+    """
+    values = sorted(samples)
+    middle = len(values) // 2
+    median = values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2.0
+    bound = tolerance * median
+    if len(values) < _PERF_MIN_SAMPLES:
+        return median, bound
+
+    deviations = sorted(abs(value - median) for value in values)
+    mad = deviations[middle] if len(values) % 2 else (deviations[middle - 1] + deviations[middle]) / 2.0
+    return median, max(_PERF_MAD_SIGMAS * 1.4826 * mad, bound)
+
 class SystemTestsCommon(object):
 
     def __init__(self, case, expected=None):
@@ -34,6 +66,7 @@ class SystemTestsCommon(object):
         self._init_locked_files(caseroot, expected)
         self._skip_pnl = False
         self._cpllog = "med" if self._case.get_value("COMP_INTERFACE")=="nuopc" else "cpl"
+        self._latest_cpl_logs = (None, None)
         self._ninja     = False
         self._dry_run   = False
         self._user_separate_builds = False
@@ -301,16 +334,17 @@ class SystemTestsCommon(object):
     def _coupler_log_indicates_run_complete(self):
         newestcpllogfiles = self._get_latest_cpl_logs()
         logger.debug("Latest Coupler log file(s) {}" .format(newestcpllogfiles))
-        # Exception is raised if the file is not compressed
+        # The logs are compressed once the run is saved, an uncompressed log means it did not get there
         allgood = len(newestcpllogfiles)
         for cpllog in newestcpllogfiles:
+            if not cpllog.endswith(".gz"):
+                logger.info("{} is not compressed, assuming run failed".format(cpllog))
+                continue
             try:
-                if six.b("SUCCESSFUL TERMINATION") in gzip.open(cpllog, 'rb').read():
+                if coupler_log_contains(cpllog):
                     allgood = allgood - 1
             except Exception as e: # Probably want to be more specific here
-                msg = e.__str__()
-
-                logger.info("{} is not compressed, assuming run failed {}".format(cpllog, msg))
+                logger.info("{} could not be read, assuming run failed {}".format(cpllog, e))
 
         return allgood==0
 
@@ -324,14 +358,16 @@ class SystemTestsCommon(object):
         """
         Return value is not generally checked, but is provided in case a custom
         run case needs indirection based on success.
-        If success_change is True, success requires some files to be different.
+        If success_change is True, success requires some files to be different,
+            so the comparison stops at the first difference.
         If ignore_fieldlist_diffs is True, then: If the two cases differ only in their
             field lists (i.e., all shared fields are bit-for-bit, but one case has some
             diagnostic fields that are missing from the other case), treat the two cases
             as identical.
         """
         success, comments = self._do_compare_test(suffix1, suffix2,
-                                                  ignore_fieldlist_diffs=ignore_fieldlist_diffs)
+                                                  ignore_fieldlist_diffs=ignore_fieldlist_diffs,
+                                                  stop_on_diff=success_change)
         if success_change:
             success = not success
 
@@ -341,13 +377,14 @@ class SystemTestsCommon(object):
             self._test_status.set_status("{}_{}_{}".format(COMPARE_PHASE, suffix1, suffix2), status)
         return success
 
-    def _do_compare_test(self, suffix1, suffix2, ignore_fieldlist_diffs=False):
+    def _do_compare_test(self, suffix1, suffix2, ignore_fieldlist_diffs=False, stop_on_diff=False):
         """
         Wraps the call to compare_test to facilitate replacement in unit
         tests
         """
         return compare_test(self._case, suffix1, suffix2,
-                            ignore_fieldlist_diffs=ignore_fieldlist_diffs)
+                            ignore_fieldlist_diffs=ignore_fieldlist_diffs,
+                            stop_on_diff=stop_on_diff)
 
     def _st_archive_case_test(self):
         result = self._case.test_env_archive()
@@ -363,17 +400,8 @@ class SystemTestsCommon(object):
         increases.
         """
         memlist = []
-        meminfo = re.compile(r".*model date =\s+(\w+).*memory =\s+(\d+\.?\d+).*highwater")
         if cpllog is not None and os.path.isfile(cpllog):
-            if '.gz' == cpllog[-3:]:
-                fopen = gzip.open
-            else:
-                fopen = open
-            with fopen(cpllog, "rb") as f:
-                for line in f:
-                    m = meminfo.match(line.decode('utf-8'))
-                    if m:
-                        memlist.append((float(m.group(1)), float(m.group(2))))
+            memlist = list(read_coupler_log(cpllog).memory)
         # Remove the last mem record, it's sometimes artificially high
         if len(memlist) > 0:
             memlist.pop()
@@ -381,15 +409,11 @@ class SystemTestsCommon(object):
 
     def _get_throughput(self, cpllog):
         """
-        Examine memory usage as recorded in the cpl log file and look for unexpected
-        increases.
+        Returns the throughput (simulated years per day) recorded in the cpl log
+        file, or None
         """
         if cpllog is not None and os.path.isfile(cpllog):
-            with gzip.open(cpllog, "rb") as f:
-                cpltext = f.read().decode('utf-8')
-                m = re.search(r"# simulated years / cmp-day =\s+(\d+\.\d+)\s",cpltext)
-                if m:
-                    return float(m.group(1))
+            return read_coupler_log(cpllog).throughput
         return None
 
     def _phase_modifying_call(self, phase, function):
@@ -464,6 +488,11 @@ class SystemTestsCommon(object):
         find and return the latest cpl log file in the run directory
         """
         coupler_log_path = self._case.get_value("RUNDIR")
+        # The logs only change when files are added to or removed from the run directory
+        key = (coupler_log_path, os.stat(coupler_log_path).st_mtime) if os.path.isdir(coupler_log_path) else None
+        if key is not None and self._latest_cpl_logs[0] == key:
+            return list(self._latest_cpl_logs[1])
+
         cpllogs = glob.glob(os.path.join(coupler_log_path, '{}*.log.*'.format(self._cpllog)))
         lastcpllogs = []
         if cpllogs:
@@ -477,68 +506,98 @@ class SystemTestsCommon(object):
                 if log.endswith(suffix):
                     lastcpllogs.append(log)
 
+        self._latest_cpl_logs = (key, list(lastcpllogs))
         return lastcpllogs
 
+    def _get_baseline_cpl_logs(self, basecmp_dir):
+        """
+        Returns (cpl log, generic name of the log, the log in basecmp_dir) for
+        each of the latest cpl logs
+        """
+        result = []
+        for cpllog in self._get_latest_cpl_logs():
+            m = re.search(r"/({}.*.log).*.gz".format(self._cpllog), cpllog)
+            logname = "{}.log".format(self._cpllog) if m is None else m.group(1)
+            baselog = os.path.join(basecmp_dir, logname)+".gz"
+            if not os.path.isfile(baselog):
+                # for backward compatibility
+                baselog = os.path.join(basecmp_dir, self._cpllog+".log")
+            result.append((cpllog, logname, baselog))
+
+        return result
+
+    def _get_final_mem_usage(self, cpllog):
+        """
+        Returns the last memory highwater recorded in the cpl log file, or None
+        if there are too few records
+        """
+        memlist = self._get_mem_usage(cpllog)
+        return memlist[-1][1] if len(memlist) > 3 else None
+
+    def _compare_perf_samples(self, phase, metric, current, baseline, baselog_value, tolerance, higher_is_better):
+        """
+        Compare current, a sample of metric, with the samples recorded for
+        baseline (or baselog_value, the value in the baseline cpl log, if
+        baseline has no samples yet) and set the status of phase accordingly.
+        Only a passing sample is added to the samples of baseline, so a real
+        change in performance keeps failing until the baseline is generated
+        again, which starts a new set of samples.
+        """
+        baseline_root = self._case.get_value("BASELINE_ROOT")
+        samples = get_perf_samples(baseline_root, baseline, metric)
+        initial = None
+        if not samples:
+            if baselog_value is None:
+                return
+            samples = [baselog_value]
+            initial = baselog_value
+
+        median, bound = _get_perf_bound(samples, tolerance)
+        change = current - median
+        success = (change >= -bound) if higher_is_better else (change <= bound)
+        scale = 0.0 if median == 0 else 100.0 / median
+        comment = "{}: {} {:.3f} vs baseline median {:.3f} of {:d} samples, {:+.1f}% (limit {}{:.1f}%)".format(
+            phase, metric, current, median, len(samples), change * scale, "-" if higher_is_better else "+", bound * scale)
+        append_testlog(comment, self._orig_caseroot)
+
+        if success and self._test_status.get_status(phase) is None:
+            self._test_status.set_status(phase, TEST_PASS_STATUS, comments=comment)
+        elif not success and self._test_status.get_status(phase) != TEST_FAIL_STATUS:
+            self._test_status.set_status(phase, TEST_FAIL_STATUS, comments="Error: " + comment)
+
+        if success:
+            save_perf_sample(baseline_root, baseline, metric, current,
+                             get_current_commit(repo=self._case.get_value("SRCROOT")), initial=initial)
+
     def _compare_memory(self):
         with self._test_status:
             # compare memory usage to baseline
             baseline_name = self._case.get_value("BASECMP_CASE")
             basecmp_dir = os.path.join(self._case.get_value("BASELINE_ROOT"), baseline_name)
-            newestcpllogfiles = self._get_latest_cpl_logs()
-            if len(newestcpllogfiles) > 0:
-                memlist = self._get_mem_usage(newestcpllogfiles[0])
-            for cpllog in newestcpllogfiles:
-                m = re.search(r"/({}.*.log).*.gz".format(self._cpllog),cpllog)
-                if m is not None:
-                    baselog = os.path.join(basecmp_dir, m.group(1))+".gz"
-                if baselog is None or not os.path.isfile(baselog):
-                    # for backward compatibility
-                    baselog = os.path.join(basecmp_dir, self._cpllog+".log")
-                if os.path.isfile(baselog) and len(memlist) > 3:
-                    blmem = self._get_mem_usage(baselog)
-                    blmem = 0 if blmem == [] else blmem[-1][1]
-                    curmem = memlist[-1][1]
-                    diff = 0.0 if blmem == 0 else (curmem-blmem)/blmem
-                    if diff < 0.1 and self._test_status.get_status(MEMCOMP_PHASE) is None:
-                        self._test_status.set_status(MEMCOMP_PHASE, TEST_PASS_STATUS)
-                    elif self._test_status.get_status(MEMCOMP_PHASE) != TEST_FAIL_STATUS:
-                        comment = "Error: Memory usage increase > 10% from baseline"
-                        self._test_status.set_status(MEMCOMP_PHASE, TEST_FAIL_STATUS, comments=comment)
-                        append_testlog(comment, self._orig_caseroot)
+            for cpllog, logname, baselog in self._get_baseline_cpl_logs(basecmp_dir):
+                curmem = self._get_final_mem_usage(cpllog)
+                if curmem is not None:
+                    blmem = self._get_final_mem_usage(baselog) if os.path.isfile(baselog) else None
+                    # memory use, smaller is better
+                    self._compare_perf_samples(MEMCOMP_PHASE, "memory", curmem, os.path.join(baseline_name, logname),
+                                               blmem, 0.1, higher_is_better=False)
 
     def _compare_throughput(self):
         with self._test_status:
-            # compare memory usage to baseline
+            # compare throughput to baseline
             baseline_name = self._case.get_value("BASECMP_CASE")
             basecmp_dir = os.path.join(self._case.get_value("BASELINE_ROOT"), baseline_name)
-            newestcpllogfiles = self._get_latest_cpl_logs()
-            for cpllog in newestcpllogfiles:
-                m = re.search(r"/({}.*.log).*.gz".format(self._cpllog), cpllog)
-                if m is not None:
-                    baselog = os.path.join(basecmp_dir, m.group(1))+".gz"
-                if baselog is None or not os.path.isfile(baselog):
-                    # for backward compatibility
-                    baselog = os.path.join(basecmp_dir, self._cpllog)
-
-                if os.path.isfile(baselog):
-                    # compare throughput to baseline
-                    current = self._get_throughput(cpllog)
-                    baseline = self._get_throughput(baselog)
-                    #comparing ypd so bigger is better
-                    if baseline is not None and current is not None:
-                        diff = (baseline - current)/baseline
-                        tolerance = self._case.get_value("TEST_TPUT_TOLERANCE")
-                        if tolerance is None:
-                            tolerance = 0.1
-                        expect(tolerance > 0.0, "Bad value for throughput tolerance in test")
-                        comment = "TPUTCOMP: Computation time changed by {:.2f}% relative to baseline".format(diff*100)
-                        append_testlog(comment, self._orig_caseroot)
-                        if diff < tolerance and self._test_status.get_status(THROUGHPUT_PHASE) is None:
-                            self._test_status.set_status(THROUGHPUT_PHASE, TEST_PASS_STATUS)
-                        elif self._test_status.get_status(THROUGHPUT_PHASE) != TEST_FAIL_STATUS:
-                            comment = "Error: TPUTCOMP: Computation time increase > {:d}% from baseline".format(int(tolerance*100))
-                            self._test_status.set_status(THROUGHPUT_PHASE, TEST_FAIL_STATUS, comments=comment)
-                            append_testlog(comment, self._orig_caseroot)
+            tolerance = self._case.get_value("TEST_TPUT_TOLERANCE")
+            if tolerance is None:
+                tolerance = 0.1
+            expect(tolerance > 0.0, "Bad value for throughput tolerance in test")
+            for cpllog, logname, baselog in self._get_baseline_cpl_logs(basecmp_dir):
+                current = self._get_throughput(cpllog)
+                if current is not None:
+                    baseline = self._get_throughput(baselog) if os.path.isfile(baselog) else None
+                    # comparing ypd so bigger is better
+                    self._compare_perf_samples(THROUGHPUT_PHASE, "throughput", current, os.path.join(baseline_name, logname),
+                                               baseline, tolerance, higher_is_better=True)
 
     def _compare_baseline(self):
         """
@@ -576,6 +635,16 @@ class SystemTestsCommon(object):
                         safe_copy(cpllog,
                                   os.path.join(basegen_dir,baselog), preserve_meta=False)
 
+            # start the throughput and memory samples of the new baseline
+            baseline_root = self._case.get_value("BASELINE_ROOT")
+            commit = get_current_commit(repo=self._case.get_value("SRCROOT"))
+            for cpllog, logname, _ in self._get_baseline_cpl_logs(basegen_dir):
+                baseline = os.path.join(self._case.get_value("BASEGEN_CASE"), logname)
+                for metric, value in (("throughput", self._get_throughput(cpllog)),
+                                      ("memory", self._get_final_mem_usage(cpllog))):
+                    if value is not None:
+                        save_perf_sample(baseline_root, baseline, metric, value, commit, reset=True)
+
 class FakeTest(SystemTestsCommon):
     """
     Inheriters of the FakeTest Class are intended to test the code.
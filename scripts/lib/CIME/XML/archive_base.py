@@ -3,6 +3,8 @@ Base class for archive files.  This class inherits from generic_xml.py
 """
 from CIME.XML.standard_module_setup import *
 from CIME.XML.generic_xml import GenericXML
+from CIME.date import get_file_date
+from collections import OrderedDict
 
 logger = logging.getLogger(__name__)
 
@@ -62,58 +64,157 @@ class ArchiveBase(GenericXML):
         """
         get the most recent history files in directory from_dir with suffix if provided
         """
-        test_hists = self.get_all_hist_files(casename, model, from_dir, suffix=suffix, ref_case=ref_case)
-        latest_files = {}
-        histlist = []
-        for hist in test_hists:
-            ext = _get_extension(model, hist)
-            latest_files[ext] = hist
+        return ArchiveDirSnapshot(self, from_dir).get_latest_hist_files(casename, model, suffix=suffix,
+                                                                        ref_case=ref_case)
 
-        for key in latest_files.keys():
-            histlist.append(latest_files[key])
-        return histlist
-
-    def get_all_hist_files(self, casename, model, from_dir, suffix="", ref_case=None):
+    def get_all_hist_files(self, casename, model, from_dir, suffix="", ref_case=None, files=None):
         """
         gets all history files in directory from_dir with suffix (if provided)
         ignores files with ref_case in the name if ref_case is provided
+        files, if given, is the listing of from_dir to use instead of reading it
         """
-        dmodel = model
-        if model == "cpl":
-            dmodel = "drv"
-        # remove when component name is changed
-        if model == "fv3gfs":
-            model = "fv3"
-        hist_files = []
-        extensions = self.get_hist_file_extensions(self.get_entry(dmodel))
-        if suffix and len(suffix) > 0:
-            has_suffix = True
+        return ArchiveDirSnapshot(self, from_dir, files=files).get_all_hist_files(casename, model, suffix=suffix,
+                                                                                  ref_case=ref_case)
+
+# Component names in comp_archive_spec whose files are named differently
+_FILE_MODEL_NAMES = {"drv" : "cpl", "fv3gfs" : "fv3"}
+
+class ArchiveDirSnapshot(object):
+    """
+    The files of one directory, classified against an archive spec.
+
+    The directory is listed once, and a single regex built from the component
+    names of every comp_archive_spec picks out the files that can be history
+    files of any component. Queries for a component then only look at those
+    files, with one regex combining all of its history file extensions. Use one
+    snapshot for all the queries about a directory that is not changing.
+    """
+
+    def __init__(self, archive, from_dir, files=None):
+        self._archive = archive
+        self.from_dir = from_dir
+        if files is None:
+            files = os.listdir(from_dir)
+        self._files = sorted(f for f in files if not f.endswith("cprnc.out"))
+
+        self._models = set()
+        for archive_entry in archive.scan_children("comp_archive_spec"):
+            compname = archive.get(archive_entry, "compname")
+            self._models.add(compname)
+            self._models.add(_FILE_MODEL_NAMES.get(compname, compname))
+
+        if self._models:
+            models_regex = re.compile(r"(?:{})\d?_?(?:\d{{4}})?\.".format(
+                "|".join(re.escape(m) for m in sorted(self._models))))
+            self._candidates = [f for f in self._files if models_regex.search(f)]
         else:
-            has_suffix = False
+            self._candidates = self._files
+
+        self._model_files = {}
 
-        # Strip any trailing $ if suffix is present and add it back after the suffix
-        for ext in extensions:
-            if ext.endswith('$') and has_suffix:
-                ext = ext[:-1]
-            string = model+r'\d?_?(\d{4})?\.'+ext
-            if has_suffix:
-                string += '.'+suffix+'$'
+    def _get_model_files(self, model, suffix):
+        """
+        Returns the files matching the history file extensions of model, with suffix
+        """
+        key = (model, suffix)
+        if key not in self._model_files:
+            dmodel = "drv" if model == "cpl" else model
+            # remove when component name is changed
+            if model == "fv3gfs":
+                model = "fv3"
+            extensions = self._archive.get_hist_file_extensions(self._archive.get_entry(dmodel))
+            regex = _compile_hist_file_regex(model, extensions, suffix)
+            if regex is None:
+                files = []
+            elif model in self._models and not any("|" in ext for ext in extensions):
+                # Every match starts with the model name, which the candidates were selected on
+                files = [f for f in self._candidates if model in f and regex.search(f)]
+            else:
+                files = [f for f in self._files if regex.search(f)]
+            self._model_files[key] = files
 
+        return self._model_files[key]
 
-            logger.debug ("Regex is {}".format(string))
-            pfile = re.compile(string)
-            hist_files.extend([f for f in os.listdir(from_dir) if pfile.search(f) and ( (f.startswith(casename) or f.startswith(model)) and not f.endswith("cprnc.out") )])
+    def get_all_hist_files(self, casename, model, suffix="", ref_case=None):
+        """
+        gets all history files of model with suffix (if provided), in name order
+        ignores files with ref_case in the name if ref_case is provided
+        """
+        hist_files = self._get_model_files(model, suffix)
+        # remove when component name is changed
+        file_model = "fv3" if model == "fv3gfs" else model
+        hist_files = [f for f in hist_files if f.startswith(casename) or f.startswith(file_model)]
 
         if ref_case:
             expect(ref_case not in casename,"ERROR: ref_case name {} conflicts with casename {}".format(ref_case,casename))
             hist_files = [h for h in hist_files if not (ref_case in os.path.basename(h))]
 
-        hist_files = list(set(hist_files))
-        hist_files.sort()
         logger.debug("get_all_hist_files returns {} for model {}".format(hist_files, model))
 
         return hist_files
 
+    def get_hist_files_by_extension(self, casename, model, suffix="", ref_case=None):
+        """
+        Returns an OrderedDict from each history file "extension" (see _get_extension)
+        of model to its files, in name order
+        """
+        by_extension = OrderedDict()
+        for hist in self.get_all_hist_files(casename, model, suffix=suffix, ref_case=ref_case):
+            by_extension.setdefault(_get_extension(model, hist), []).append(hist)
+        return by_extension
+
+    def get_latest_hist_files(self, casename, model, suffix="", ref_case=None):
+        """
+        get the most recent history file of model for each extension
+        """
+        return [hists[-1] for hists in self.get_hist_files_by_extension(casename, model, suffix=suffix,
+                                                                         ref_case=ref_case).values()]
+
+    def get_hist_files_by_date(self, casename, model, suffix="", ref_case=None):
+        """
+        Returns a list of (date, files) pairs for the history files of model,
+        in date order, with the files without a date in their name under None first
+        """
+        by_date = {}
+        for hist in self.get_all_hist_files(casename, model, suffix=suffix, ref_case=ref_case):
+            file_date = get_file_date(hist)
+            # CIME dates are not hashable
+            key = None if file_date is None else str(file_date)
+            by_date.setdefault(key, (file_date, []))[1].append(hist)
+
+        undated = [by_date.pop(None)] if None in by_date else []
+        return undated + sorted(by_date.values(), key=lambda item: item[0])
+
+def _compile_hist_file_regex(model, extensions, suffix=""):
+    r"""
+    Returns a regex that finds history files of model with any of the given
+    extensions, and with suffix if provided, or None if there are no extensions
+
+    >>> regex = _compile_hist_file_regex("cam", [r"h\d*.*\.nc$", "i"])
+    >>> [bool(regex.search(f)) for f in ["c.cam.h0.0001-01.nc", "c.cam.i.0001-01.nc", "c.cam.r.0001-01.nc"]]
+    [True, True, False]
+    >>> regex = _compile_hist_file_regex("cam", [r"h\d*.*\.nc$"], suffix="base")
+    >>> [bool(regex.search(f)) for f in ["c.cam.h0.0001-01.nc.base", "c.cam.h0.0001-01.nc"]]
+    [True, False]
+    >>> _compile_hist_file_regex("cam", []) is None
+    True
+    """
+    patterns = []
+    # Strip any trailing $ if suffix is present and add it back after the suffix
+    for ext in extensions:
+        if ext.endswith('$') and suffix:
+            ext = ext[:-1]
+        string = model+r'\d?_?(\d{4})?\.'+ext
+        if suffix:
+            string += '.'+suffix+'$'
+        patterns.append("(?:{})".format(string))
+
+    if not patterns:
+        return None
+
+    logger.debug("Regex is {}".format("|".join(patterns)))
+    return re.compile("|".join(patterns))
+
 def _get_extension(model, filepath):
     r"""
     For a hist file for the given model, return what we call the "extension"
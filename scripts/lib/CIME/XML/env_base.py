@@ -52,6 +52,15 @@ class EnvBase(EntryID):
 
         self.lock()
 
+    def get_entry_ids(self):
+        """
+        Return the ids of all entries in this file
+        """
+        if self._id_map is not None:
+            return list(self._id_map.keys())
+
+        return [self.get(node, "id") for node in self.scan_children("entry")]
+
     def change_file(self, newfile, copy=False):
         self.unlock()
         EntryID.change_file(self, newfile, copy=copy)
@@ -3,18 +3,145 @@ Common interface to XML files, this is an abstract class and is expected to
 be used by other XML interface modules and not directly.
 """
 from CIME.XML.standard_module_setup import *
-from CIME.utils import safe_copy
+from CIME.utils import safe_copy, get_cime_root
 
 import xml.etree.ElementTree as ET
 #pylint: disable=import-error
 from distutils.spawn import find_executable
 import getpass
+import hashlib
+import marshal
+import tempfile
+import weakref
 import six
 from copy import deepcopy
 from collections import namedtuple
 
 logger = logging.getLogger(__name__)
 
+# Patterns used by get_resolved_value
+_REFERENCE_RE = re.compile(r'\${?(\w+)}?')
+_ENV_REF_RE   = re.compile(r'\$ENV\{(\w+)\}')
+_SHELL_REF_RE = re.compile(r'\$SHELL\{([^}]+)\}')
+_MATH_RE      = re.compile(r'\s[+-/*]\s')
+
+# Bump whenever the layout of the on-disk parse cache changes
+_PERSISTENT_CACHE_FORMAT = 2
+
+# The least recently used entries beyond this are removed from the cache
+_PERSISTENT_CACHE_MAX_ENTRIES = 1000
+
+def get_persistent_cache_dir():
+    """
+    Return the directory holding the on-disk parse cache (also used for the
+    compiled namelist definitions), or None if the cache is disabled.
+    CIME_XML_CACHE_DIR overrides the default location, setting it to an empty
+    string disables the cache.
+    """
+    cache_dir = os.environ.get("CIME_XML_CACHE_DIR")
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.expanduser("~"), ".cime", "xml_cache")
+
+    return cache_dir if cache_dir else None
+
+def _get_persistent_cache_path(cache_dir, infile, schema):
+    key = "{}\n{}\n{}".format(os.path.abspath(infile), schema, sys.version_info[:2])
+    return os.path.join(cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest())
+
+def _is_persistent_cache_candidate(infile):
+    """
+    Only the configuration and definition files shipped in CIMEROOT are
+    persisted, case files such as env_*.xml change too often to be worth it
+    """
+    return os.path.abspath(infile).startswith(os.path.join(get_cime_root(), ""))
+
+def _file_hash(path):
+    with open(path, "rb") as fd:
+        return hashlib.sha1(fd.read()).hexdigest()
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return (path, stat.st_mtime, stat.st_size, _file_hash(path))
+
+def _is_current(signature):
+    """
+    True if the file of signature is unchanged. The content hash is only
+    computed if the cheap mtime and size check passes.
+    """
+    path, mtime, size, file_hash = signature
+    stat = os.stat(path)
+    return stat.st_mtime == mtime and stat.st_size == size and _file_hash(path) == file_hash
+
+def load_persistent_cache_entry(cache_path):
+    """
+    Return the data marshalled at cache_path and mark the entry as recently
+    used. Errors are left to the caller, a missing or broken entry is a miss.
+    """
+    with open(cache_path, "rb") as fd:
+        data = marshal.load(fd)
+
+    try:
+        os.utime(cache_path, None)
+    except OSError:
+        # Entries written by other users of a shared cache
+        pass
+
+    return data
+
+def store_persistent_cache_entry(cache_path, data):
+    """
+    Marshal data to cache_path, readable by everyone sharing the cache
+    directory, then trim the cache to _PERSISTENT_CACHE_MAX_ENTRIES
+    """
+    cache_dir = os.path.dirname(cache_path)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+    # Write to a temporary file and rename so that concurrent
+    # readers never see a partially written entry
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix=".tmp")
+    with os.fdopen(fd, "wb") as tmp_fd:
+        marshal.dump(data, tmp_fd)
+    os.chmod(tmp_path, 0o644)
+    os.rename(tmp_path, cache_path)
+
+    _evict_persistent_cache(cache_dir)
+
+def _evict_persistent_cache(cache_dir):
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.startswith("."):
+            path = os.path.join(cache_dir, name)
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except OSError:
+                pass
+
+    entries.sort()
+    for _, path in entries[:max(0, len(entries) - _PERSISTENT_CACHE_MAX_ENTRIES)]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def _encode_element(element):
+    return (element.tag, dict(element.attrib), element.text, element.tail,
+            [_encode_element(child) for child in element])
+
+def _decode_element(data, parent=None):
+    tag, attrib, text, tail, children = data
+    if parent is None:
+        element = ET.Element(tag, attrib)
+    else:
+        element = ET.SubElement(parent, tag, attrib)
+
+    element.text = text
+    element.tail = tail
+    for child in children:
+        _decode_element(child, element)
+
+    return element
+
 class _Element(object): # private class, don't want users constructing directly or calling methods on it
 
     def __init__(self, xml_element):
@@ -37,7 +164,13 @@ class _Element(object): # private class, don't want users constructing directly
 class GenericXML(object):
 
     _FILEMAP = {}
+    # Lazily built scan_children indices, keyed by the root ET element so
+    # that all objects sharing a cached tree also share (and invalidate) its index
+    _INDEXMAP = weakref.WeakKeyDictionary()
+    # Number of modifications made to each tree, keyed like _INDEXMAP
+    _MODCOUNTMAP = weakref.WeakKeyDictionary()
     DISABLE_CACHING = False
+    DISABLE_INDEXING = False
     CacheEntry = namedtuple("CacheEntry", ["tree", "root", "modtime"])
 
     @classmethod
@@ -56,6 +189,7 @@ class GenericXML(object):
         self.read_only = read_only
         self.filename = infile
         self.needsrewrite = False
+        self._read_deps = None
         if infile is None:
             return
 
@@ -94,9 +228,23 @@ class GenericXML(object):
                        "Reading into object marked for rewrite, file {}".format(self.filename))
                 self.tree, self.root, _ = self._FILEMAP[infile]
                 cached_read = True
+                if self._read_deps is not None:
+                    self._read_deps.append(infile)
+
+        # Only complete, read-only trees are worth persisting across processes
+        use_persistent_cache = not cached_read and not self.DISABLE_CACHING and \
+            self.read_only and self.tree is None and _is_persistent_cache_candidate(infile)
+
+        if use_persistent_cache:
+            cached_read = self._read_persistent_cache(infile, schema)
 
         if not cached_read:
             logger.debug("read: {}".format(infile))
+            if use_persistent_cache:
+                self._read_deps = []
+            if self._read_deps is not None:
+                self._read_deps.append(infile)
+
             file_open = (lambda x: open(x, 'r', encoding='utf-8')) if six.PY3 else (lambda x: open(x, 'r'))
             with file_open(infile) as fd:
                 self.read_fd(fd)
@@ -106,8 +254,57 @@ class GenericXML(object):
 
             logger.debug("File version is {}".format(str(self.get_version())))
 
+            if use_persistent_cache:
+                self._write_persistent_cache(infile, schema, self._read_deps)
+                self._read_deps = None
+
+        if not cached_read or use_persistent_cache:
             self._FILEMAP[infile] = self.CacheEntry(self.tree, self.root, os.path.getmtime(infile))
 
+    def _read_persistent_cache(self, infile, schema):
+        """
+        Try to load the fully expanded tree for infile from the on-disk parse
+        cache. Returns True on success. The entry is only used if infile and
+        every file it included still have the mtime, size and content hash
+        they had when the entry was written.
+        """
+        cache_dir = get_persistent_cache_dir()
+        if cache_dir is None:
+            return False
+
+        cache_path = _get_persistent_cache_path(cache_dir, infile, schema)
+        try:
+            version, deps, data = load_persistent_cache_entry(cache_path)
+            if version != _PERSISTENT_CACHE_FORMAT or not all(_is_current(dep) for dep in deps):
+                logger.debug("read (stale persistent cache): {}".format(infile))
+                return False
+
+            root = _decode_element(data)
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return False
+
+        logger.debug("read (persistent cache): {}".format(infile))
+        self.tree = ET.ElementTree(root)
+        self.root = _Element(root)
+        return True
+
+    def _write_persistent_cache(self, infile, schema, deps):
+        """
+        Store the fully expanded tree for infile in the on-disk parse cache.
+        Failures are not fatal, the next reader will simply parse the file.
+        """
+        cache_dir = get_persistent_cache_dir()
+        if cache_dir is None:
+            return
+
+        try:
+            store_persistent_cache_entry(_get_persistent_cache_path(cache_dir, infile, schema),
+                                         (_PERSISTENT_CACHE_FORMAT,
+                                          [_file_signature(dep) for dep in deps],
+                                          _encode_element(self.root.xml_element)))
+        except (IOError, OSError, ValueError) as e:
+            logger.debug("Could not write persistent cache for {}: {}".format(infile, e))
+
     def read_fd(self, fd):
         expect(self.read_only or not self.filename or not self.needsrewrite,
                "Reading into object marked for rewrite, file {}".format(self.filename))
@@ -175,14 +372,14 @@ class GenericXML(object):
             expect(not self.read_only, "read_only: cannot set attrib[{}]={} for node {} in file {}".format(attrib_name, value, self.name(node), self.filename))
             if attrib_name == "id":
                 expect(not self.locked, "locked: cannot set attrib[{}]={} for node {} in file {}".format(attrib_name, value, self.name(node), self.filename))
-            self.needsrewrite = True
+            self._mark_modified(node=node)
             return node.xml_element.set(attrib_name, value)
 
     def pop(self, node, attrib_name):
         expect(not self.read_only, "read_only: cannot pop attrib[{}] for node {} in file {}".format(attrib_name, self.name(node), self.filename))
         if attrib_name == "id":
             expect(not self.locked, "locked: cannot pop attrib[{}] for node {} in file {}".format(attrib_name, self.name(node), self.filename))
-        self.needsrewrite = True
+        self._mark_modified(node=node)
         return node.xml_element.attrib.pop(attrib_name)
 
     def attrib(self, node):
@@ -192,14 +389,14 @@ class GenericXML(object):
     def set_name(self, node, name):
         expect(not self.read_only, "read_only: set node name {} in file {}".format(name, self.filename))
         if node.xml_element.tag != name:
-            self.needsrewrite = True
+            self._mark_modified(node=node)
             node.xml_element.tag = name
 
     def set_text(self, node, text):
         expect(not self.read_only, "read_only: set node text {} for node {} in file {}".format(text, self.name(node), self.filename))
         if node.xml_element.text != text:
             node.xml_element.text = text
-            self.needsrewrite = True
+            self._mark_modified(structural=False)
 
     def name(self, node):
         return node.xml_element.tag
@@ -212,8 +409,8 @@ class GenericXML(object):
         Add element node to self at root
         """
         expect(not self.locked and not self.read_only, "{}: cannot add child {} in file {}".format("read_only" if self.read_only else "locked", self.name(node), self.filename))
-        self.needsrewrite = True
         root = root if root is not None else self.root
+        self._mark_modified(node=root)
         if position is not None:
             root.xml_element.insert(position, node.xml_element)
         else:
@@ -224,14 +421,14 @@ class GenericXML(object):
 
     def remove_child(self, node, root=None):
         expect(not self.locked and not self.read_only, "{}: cannot remove child {} in file {}".format("read_only" if self.read_only else "locked", self.name(node), self.filename))
-        self.needsrewrite = True
         root = root if root is not None else self.root
+        self._mark_modified(node=root)
         root.xml_element.remove(node.xml_element)
 
     def make_child(self, name, attributes=None, root=None, text=None):
         expect(not self.locked and not self.read_only, "{}: cannot make child {} in file {}".format("read_only" if self.read_only else "locked", name, self.filename))
         root = root if root is not None else self.root
-        self.needsrewrite = True
+        self._mark_modified(node=root)
         if attributes is None:
             node = _Element(ET.SubElement(root.xml_element, name))
         else:
@@ -245,7 +442,7 @@ class GenericXML(object):
     def make_child_comment(self, root=None, text=None):
         expect(not self.locked and not self.read_only, "{}: cannot make child {} in file {}".format("read_only" if self.read_only else "locked", text, self.filename))
         root = root if root is not None else self.root
-        self.needsrewrite = True
+        self._mark_modified()
         et_comment = ET.Comment(text)
         node = _Element(et_comment)
         root.xml_element.append(node.xml_element)
@@ -408,6 +605,12 @@ class GenericXML(object):
             root = self.root
         nodes = []
 
+        if not self.DISABLE_INDEXING and root is self.root and nodename and \
+           not any(c in nodename for c in ":/*[.@"):
+            nodes = self._scan_index(nodename, attributes)
+            logger.debug("Returning {} nodes ({})".format(len(nodes), nodes))
+            return [_Element(node) for node in nodes]
+
         namespace = {"xi" : "http://www.w3.org/2001/XInclude"}
 
         xpath = ".//" + (nodename if nodename else "")
@@ -447,6 +650,85 @@ class GenericXML(object):
 
         return [_Element(node) for node in nodes]
 
+    def _mark_modified(self, structural=True, node=None):
+        """
+        Record a modification of the tree. Structural modifications (nodes,
+        names or attributes) also drop the scan_children index, as well as the
+        index of any other tree node, the changed node or parent, belongs to.
+        """
+        self.needsrewrite = True
+        if self.root is not None:
+            root_element = self.root.xml_element
+            self._MODCOUNTMAP[root_element] = self._MODCOUNTMAP.get(root_element, 0) + 1
+            if structural:
+                self._INDEXMAP.pop(root_element, None)
+
+        if structural and node is not None:
+            for root_element, index in list(self._INDEXMAP.items()):
+                if node.xml_element is root_element or node.xml_element in index[None]:
+                    self._INDEXMAP.pop(root_element, None)
+
+    def get_modification_count(self):
+        """
+        Return the number of modifications made so far to the tree this object
+        refers to, through this or any other object sharing the tree.
+        """
+        return 0 if self.root is None else self._MODCOUNTMAP.get(self.root.xml_element, 0)
+
+    def _get_index(self):
+        """
+        Return the index for the tree under self.root, building it if needed.
+
+        The index maps tag -> (nodes, {attrib_name -> {attrib_value -> nodes}}),
+        with every node list in document order. The None attrib_value holds all
+        nodes that have the attribute, whatever its value. The None tag holds
+        the set of all elements below the root. The root itself is left out, a
+        reference to it would keep the weak _INDEXMAP key alive forever.
+        """
+        root_element = self.root.xml_element
+        index = self._INDEXMAP.get(root_element)
+        if index is None:
+            index = {None : set(root_element.iter())}
+            index[None].discard(root_element)
+            for element in root_element.iter():
+                # Skip the root itself (xpath .// only matches descendants) and comments
+                if element is root_element or not isinstance(element.tag, six.string_types):
+                    continue
+
+                tag_nodes, tag_attribs = index.setdefault(element.tag, ([], {}))
+                tag_nodes.append(element)
+                for key, value in element.attrib.items():
+                    values = tag_attribs.setdefault(key, {})
+                    values.setdefault(None, []).append(element)
+                    values.setdefault(value, []).append(element)
+
+            self._INDEXMAP[root_element] = index
+
+        return index
+
+    def _scan_index(self, nodename, attributes):
+        """
+        Index-backed equivalent of the xpath search in scan_children. Candidates
+        come from the most selective attribute, the others are checked directly.
+        """
+        tag_nodes, tag_attribs = self._get_index().get(nodename, ([], {}))
+        if not attributes:
+            return list(tag_nodes)
+
+        attributes = dict((key, value if value is None or isinstance(value, six.string_types) else str(value))
+                          for key, value in attributes.items())
+        candidates = None
+        for key, value in attributes.items():
+            key_nodes = tag_attribs.get(key, {}).get(value, [])
+            if candidates is None or len(key_nodes) < len(candidates):
+                candidates = key_nodes
+            if not candidates:
+                return []
+
+        return [node for node in candidates
+                if all(node.get(key) is not None if value is None else node.get(key) == value
+                       for key, value in attributes.items())]
+
     def get_value(self, item, attribute=None, resolved=True, subgroup=None): # pylint: disable=unused-argument
         """
         get_value is expected to be defined by the derived classes, if you get here
@@ -488,10 +770,6 @@ class GenericXML(object):
         True
         """
         logger.debug("raw_value {}".format(raw_value))
-        reference_re = re.compile(r'\${?(\w+)}?')
-        env_ref_re   = re.compile(r'\$ENV\{(\w+)\}')
-        shell_ref_re = re.compile(r'\$SHELL\{([^}]+)\}')
-        math_re = re.compile(r'\s[+-/*]\s')
         item_data = raw_value
 
         if item_data is None:
@@ -500,7 +778,7 @@ class GenericXML(object):
         if not isinstance(item_data, six.string_types):
             return item_data
 
-        for m in env_ref_re.finditer(item_data):
+        for m in _ENV_REF_RE.finditer(item_data):
             logger.debug("look for {} in env".format(item_data))
             env_var = m.groups()[0]
             env_var_exists = env_var in os.environ
@@ -509,12 +787,12 @@ class GenericXML(object):
             if env_var_exists:
                 item_data = item_data.replace(m.group(), os.environ[env_var])
 
-        for s in shell_ref_re.finditer(item_data):
+        for s in _SHELL_REF_RE.finditer(item_data):
             logger.debug("execute {} in shell".format(item_data))
             shell_cmd = s.groups()[0]
             item_data = item_data.replace(s.group(), run_cmd_no_fail(shell_cmd))
 
-        for m in reference_re.finditer(item_data):
+        for m in _REFERENCE_RE.finditer(item_data):
             var = m.groups()[0]
             logger.debug("find: {}".format(var))
             # The overridden versions of this method do not simply return None
@@ -533,7 +811,7 @@ class GenericXML(object):
             elif var == "USER":
                 item_data = item_data.replace(m.group(), getpass.getuser())
 
-        if math_re.search(item_data):
+        if _MATH_RE.search(item_data):
             try:
                 tmp = eval(item_data)
             except Exception:
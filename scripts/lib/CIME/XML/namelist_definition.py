@@ -12,6 +12,7 @@ This module contains only one class, `NamelistDefinition`, inheriting from
 
 import re
 import collections
+import hashlib
 
 from CIME.namelist import fortran_namelist_base_value, \
     is_valid_fortran_namelist_literal, character_literal_to_string, \
@@ -20,11 +21,149 @@ from CIME.namelist import fortran_namelist_base_value, \
 from CIME.XML.standard_module_setup import *
 from CIME.XML.entry_id import EntryID
 from CIME.XML.files import Files
+from CIME.XML.generic_xml import get_persistent_cache_dir, load_persistent_cache_entry, store_persistent_cache_entry
+from CIME.utils import CIMEError
 
 logger = logging.getLogger(__name__)
 
 _array_size_re = re.compile(r'^(?P<type>[^(]+)\((?P<size>[^)]+)\)$')
 
+# Bump whenever NamelistEntry or the way it is compiled changes
+_SCHEMA_CACHE_FORMAT = 2
+
+# Compiled schemas, keyed by (path, mtime, size) of the definition file, so
+# that every NamelistDefinition of the same file in a process shares one
+_SCHEMAS = {}
+
+# Stands in for an attribute the caller did not give in default value lookup keys
+_MISSING = object()
+
+# The compiled form of one entry of a namelist definition file:
+# id                       - the variable name
+# type_string              - the type as written in the file, e.g. "char*256(10)"
+# type_info                - (type, max length, size) as returned by
+#                            split_type_string, or None if type_string is invalid
+# group                    - the namelist group
+# valid_values             - tuple of the valid values, or None
+# input_pathname           - the input_pathname setting, or None
+# skip_default_entry       - whether init_defaults should skip the variable
+# per_stream_entry         - whether the variable is set per data model stream
+# modify_via_xml           - the xml variable that sets the variable, or None
+# cannot_modify_by_user_nl - why users cannot set the variable, or None
+# match_type               - "first" or "last", which of equally good default
+#                            values wins
+# values                   - the default value candidates, a tuple of
+#                            (attributes, text) where attributes is a tuple of
+#                            (name, value) pairs
+# attribute_names          - the names of all attributes the candidates use
+# ranked_values            - values, best match first (see _rank_values)
+NamelistEntry = collections.namedtuple("NamelistEntry",
+                                       ["id", "type_string", "type_info", "group", "valid_values",
+                                        "input_pathname", "skip_default_entry", "per_stream_entry",
+                                        "modify_via_xml", "cannot_modify_by_user_nl", "match_type", "values",
+                                        "attribute_names", "ranked_values"])
+
+# A compiled namelist definition file: the variable names in file order and
+# a dict of their NamelistEntry
+NamelistSchema = collections.namedtuple("NamelistSchema", ["ids", "entries"])
+
+def _split_type_string(name, type_string):
+    """Split a type string into its type, maximum length and array size.
+
+    >>> _split_type_string("foo", "char*256(10)")
+    ('character', 256, 10)
+    >>> _split_type_string("foo", "real")
+    ('real', None, 1)
+    """
+    # 'char' is frequently used as an abbreviation of 'character'.
+    type_string = type_string.replace('char', 'character')
+
+    # Separate into a size and the rest of the type.
+    size_match = _array_size_re.search(type_string)
+    if size_match:
+        type_string = size_match.group('type')
+        size_string = size_match.group('size')
+        try:
+            size = int(size_string)
+        except ValueError:
+            expect(False,
+                   "In namelist definition, variable {} had the non-integer string {!r} specified as an array size.".format(name, size_string))
+    else:
+        size = 1
+
+    # Separate into a type and an optional length.
+    type_, star, length = type_string.partition('*')
+    if star == '*':
+        # Length allowed only for character variables.
+        expect(type_ == 'character',
+               "In namelist definition, length specified for non-character "
+               "variable {}.".format(name))
+        # Check that the length is actually an integer, to make the error
+        # message a bit cleaner if the xml input is bad.
+        try:
+            max_len = int(length)
+        except ValueError:
+            expect(False,
+                   "In namelist definition, character variable {} had the non-integer string {!r} specified as a length.".format(name, length))
+    else:
+        max_len = None
+    return type_, max_len, size
+
+def _rank_values(values, match_type):
+    """Order default value candidates so that the first one whose attributes
+    all match is the one EntryID._get_value_match picks: candidates with more
+    attributes first, and among those with as many, the first or last in the
+    file as match_type says.
+
+    >>> values = (((), "1"), ((("ocn", "pop"),), "2"), ((("ocn", "pop2"),), "3"))
+    >>> [text for _, text in _rank_values(values, "first")]
+    ['2', '3', '1']
+    >>> [text for _, text in _rank_values(values, "last")]
+    ['3', '2', '1']
+    """
+    sign = -1 if match_type == "last" else 1
+    order = sorted(range(len(values)), key=lambda idx: (-len(values[idx][0]), sign * idx))
+    return tuple(values[idx] for idx in order)
+
+def _match_default_value(entry, attributes, exact_match):
+    """Return the text of the default value of `entry` that best matches
+    `attributes`, or None. This follows EntryID._get_value_match: every
+    attribute of a candidate must match, and the candidate with the most
+    attributes wins. The candidates are tried in the order of ranked_values.
+
+    >>> values = (((), "1"), ((("ocn", "pop"),), "2"), ((("ocn", "pop"), ("atm", "cam")), "3"))
+    >>> entry = NamelistEntry("foo", "integer", ("integer", None, 1), "g", None, None, False, False, None, None,
+    ...                       "first", values, ("atm", "ocn"), _rank_values(values, "first"))
+    >>> _match_default_value(entry, {"ocn" : "pop"}, True)
+    '2'
+    >>> _match_default_value(entry, {"ocn" : "pop", "atm" : "cam"}, True)
+    '3'
+    >>> _match_default_value(entry, {"ocn" : "pop2"}, False)
+    '2'
+    >>> _match_default_value(entry, {"ocn" : "pop2"}, True)
+    '1'
+    >>> _match_default_value(entry, {}, True)
+    '1'
+    """
+    if not entry.values:
+        return None
+
+    if not attributes:
+        # Without attributes to match, every candidate is as good as any other
+        candidate = entry.values[-1] if entry.match_type == "last" else entry.values[0]
+    else:
+        for candidate in entry.ranked_values:
+            if all(attribute in attributes and
+                   (attributes[attribute] == pattern if exact_match else re.search(pattern, attributes[attribute]))
+                   for attribute, pattern in candidate[0]):
+                break
+        else:
+            return None
+
+    expect(entry.match_type in ("first", "last"),
+           "match attribute can only have a value of 'last' or 'first', value is %s" %entry.match_type)
+    return candidate[1]
+
 class CaseInsensitiveDict(dict):
 
     """Basic case insensitive dict with strings only keys.
@@ -83,42 +222,119 @@ class NamelistDefinition(EntryID):
 
         self._attributes = {}
         self._entry_nodes = []
-        self._entry_ids = []
-        self._valid_values = {}
-        self._entry_types = {}
+        self._entry_ids = set()
         self._group_names = CaseInsensitiveDict({})
         self._nodes = {}
+        self._default_values = {}
+        self._schema = self._get_schema()
+
+    def _get_schema(self):
+        """
+        Returns the NamelistSchema of this file, compiling it only if neither
+        this process nor the on-disk cache has it already
+        """
+        stat = os.stat(self.filename)
+        key = (os.path.abspath(self.filename), stat.st_mtime, stat.st_size)
+        if not self.DISABLE_CACHING and key in _SCHEMAS:
+            return _SCHEMAS[key]
+
+        cache_path = None
+        cache_dir = None if self.DISABLE_CACHING else get_persistent_cache_dir()
+        if cache_dir is not None:
+            with open(self.filename, "rb") as fd:
+                file_hash = hashlib.sha1(fd.read()).hexdigest()
+            cache_path = os.path.join(cache_dir, "nmldef-{}-{}-{}".format(file_hash, _SCHEMA_CACHE_FORMAT,
+                                                                          "".join(str(v) for v in sys.version_info[:2])))
+
+        schema = self._read_schema_cache(cache_path) if cache_path else None
+        if schema is None:
+            schema = self._compile_schema()
+            if cache_path:
+                self._write_schema_cache(cache_path, schema)
+
+        _SCHEMAS[key] = schema
+        return schema
+
+    def _compile_schema(self):
+        """
+        Returns the NamelistSchema of the entries of this file
+        """
+        entries = []
+        for node in self.get_children("entry"):
+            name = self.get(node, "id")
+            type_string = self._get_type(node)
+            try:
+                type_info = _split_type_string(name, type_string)
+            except CIMEError:
+                # Only report a bad type if the variable is used
+                type_info = None
+
+            valid_values = self._get_valid_values(node)
+            values_node = self.get_optional_child("values", root=node)
+            if values_node is not None:
+                match_type = self.get(values_node, "match", default="first")
+            else:
+                match_type = "first"
+            values = tuple((tuple(self.attrib(vnode).items()), self.text(vnode))
+                           for vnode in self.get_children("value", root=node if values_node is None else values_node))
+            attribute_names = tuple(sorted(set(attribute for attributes, _ in values for attribute, _ in attributes)))
+
+            entries.append(NamelistEntry(name, type_string, type_info, self.get_group_name(node),
+                                         None if valid_values is None else tuple(valid_values),
+                                         self._get_input_pathname(node),
+                                         self.get(node, "skip_default_entry") == "true",
+                                         self.get(node, "per_stream_entry") == "true",
+                                         self.get(node, "modify_via_xml"), self.get(node, "cannot_modify_by_user_nl"),
+                                         match_type, values, attribute_names, _rank_values(values, match_type)))
+
+        return NamelistSchema(tuple(entry.id for entry in entries), dict((entry.id, entry) for entry in entries))
+
+    @staticmethod
+    def _read_schema_cache(cache_path):
+        """
+        Returns the NamelistSchema stored at cache_path, or None
+        """
+        try:
+            entries = [NamelistEntry(*entry) for entry in load_persistent_cache_entry(cache_path)]
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return None
+
+        logger.debug("read (compiled namelist definition): {}".format(cache_path))
+        return NamelistSchema(tuple(entry.id for entry in entries), dict((entry.id, entry) for entry in entries))
+
+    @staticmethod
+    def _write_schema_cache(cache_path, schema):
+        """
+        Stores schema at cache_path. Failures are not fatal, the next reader
+        will simply compile the definition again.
+        """
+        try:
+            store_persistent_cache_entry(cache_path, tuple(tuple(schema.entries[name]) for name in schema.ids))
+        except (IOError, OSError, ValueError) as e:
+            logger.debug("Could not write compiled namelist definition {}: {}".format(cache_path, e))
 
     def set_nodes(self, skip_groups=None):
         """
         populates the object data types for all nodes that are not part of the skip_groups array
         returns nodes that do not have attributes of `skip_default_entry` or `per_stream_entry`
         """
+        self._entry_nodes = []
+        self._entry_ids = set()
+        self._group_names = CaseInsensitiveDict({})
+        self._nodes = {}
         default_nodes = []
         for node in self.get_children("entry"):
             name = self.get(node, "id")
-            skip_default_entry = self.get(node, "skip_default_entry") == "true"
-            per_stream_entry = self.get(node, "per_stream_entry") == "true"
-            set_node_values = False
-            if skip_groups:
-                group_name = self.get_group_name(node)
-                if not group_name in skip_groups:
-                    self._entry_nodes.append(node)
-                    set_node_values = True
-                    if not skip_default_entry and not per_stream_entry:
-                        default_nodes.append(node)
-            else:
-                self._entry_nodes.append(node)
-                set_node_values = True
-                if not skip_default_entry and not per_stream_entry:
-                    default_nodes.append(node)
-            if set_node_values:
-                self._entry_nodes.append(node)
-                self._entry_ids.append(name)
-                self._nodes[name] = node
-                self._entry_types[name] = self._get_type(node)
-                self._valid_values[name] = self._get_valid_values(node)
-                self._group_names[name] = self.get_group_name(node)
+            entry = self._schema.entries[name]
+            if skip_groups and entry.group in skip_groups:
+                continue
+
+            self._entry_nodes.append(node)
+            self._entry_ids.add(name)
+            self._nodes[name] = node
+            self._group_names[name] = entry.group
+            if not entry.skip_default_entry and not entry.per_stream_entry:
+                default_nodes.append(node)
         return default_nodes
 
     def get_group_name(self, node=None):
@@ -160,13 +376,7 @@ class NamelistDefinition(EntryID):
         return self._entry_nodes
 
     def get_per_stream_entries(self):
-        entries = []
-        nodes = self.get_children("entry")
-        for node in nodes:
-            per_stream_entry = self.get(node, "per_stream_entry") == "true"
-            if per_stream_entry:
-                entries.append(self.get(node, "id"))
-        return entries
+        return [name for name in self._schema.ids if self._schema.entries[name].per_stream_entry]
 
     # Currently we don't use this object to construct new files, and it's no
     # good for that purpose anyway, so stop this function from being called.
@@ -182,16 +392,35 @@ class NamelistDefinition(EntryID):
         there is no default value in the file, this returns `None`.
         """
         # Merge internal attributes with those passed in.
-        all_attributes = {}
-        if self._attributes is not None:
-            all_attributes.update(self._attributes)
-        if attributes is not None:
-            all_attributes.update(attributes)
+        if attributes is None and self._attributes is not None:
+            all_attributes = self._attributes
+        else:
+            all_attributes = {}
+            if self._attributes is not None:
+                all_attributes.update(self._attributes)
+            if attributes is not None:
+                all_attributes.update(attributes)
 
         if entry_node is None:
-            entry_node = self._nodes[vid]
-        value = super(NamelistDefinition, self).get_value_match(vid.lower(),attributes=all_attributes, exact_match=exact_match,
-                                                                entry_node=entry_node)
+            # Only the attributes the candidates use can change the answer, so
+            # lookups with the same values of those share one result
+            entry = self._schema.entries[vid]
+            key = (vid, bool(exact_match), bool(all_attributes)) + \
+                tuple(all_attributes.get(attribute, _MISSING) for attribute in entry.attribute_names)
+            try:
+                value = self._default_values.get(key)
+            except TypeError:
+                key = None
+                value = None
+            if value is None:
+                value = _match_default_value(entry, all_attributes, exact_match)
+                value = '' if value is None else self._split_defaults_text(value)
+                if key is not None:
+                    self._default_values[key] = value
+            return list(value) if isinstance(value, list) else value
+        else:
+            value = super(NamelistDefinition, self).get_value_match(vid.lower(),attributes=all_attributes, exact_match=exact_match,
+                                                                    entry_node=entry_node)
         if value is None:
             value = ''
         else:
@@ -236,41 +465,11 @@ class NamelistDefinition(EntryID):
         (which is an integer for character variables, otherwise `None`), and the
         size of the array (which is 1 for scalar variables).
         """
-        type_string = self._entry_types[name]
-
-        # 'char' is frequently used as an abbreviation of 'character'.
-        type_string = type_string.replace('char', 'character')
-
-        # Separate into a size and the rest of the type.
-        size_match = _array_size_re.search(type_string)
-        if size_match:
-            type_string = size_match.group('type')
-            size_string = size_match.group('size')
-            try:
-                size = int(size_string)
-            except ValueError:
-                expect(False,
-                       "In namelist definition, variable {} had the non-integer string {!r} specified as an array size.".format(name, size_string))
-        else:
-            size = 1
-
-        # Separate into a type and an optional length.
-        type_, star, length = type_string.partition('*')
-        if star == '*':
-            # Length allowed only for character variables.
-            expect(type_ == 'character',
-                   "In namelist definition, length specified for non-character "
-                   "variable {}.".format(name))
-            # Check that the length is actually an integer, to make the error
-            # message a bit cleaner if the xml input is bad.
-            try:
-                max_len = int(length)
-            except ValueError:
-                expect(False,
-                       "In namelist definition, character variable {} had the non-integer string {!r} specified as a length.".format(name, length))
-        else:
-            max_len = None
-        return type_, max_len, size
+        entry = self._schema.entries[name]
+        if entry.type_info is None:
+            # Raises the error for the invalid type
+            return _split_type_string(name, entry.type_string)
+        return entry.type_info
 
     @staticmethod
     def _canonicalize_value(type_, value):
@@ -315,7 +514,7 @@ class NamelistDefinition(EntryID):
                     return False
 
         # Check valid value constraints (if applicable).
-        valid_values = self._valid_values[name]
+        valid_values = self._schema.entries[name].valid_values
         if valid_values is not None:
             expect(type_ in ('integer', 'character'),
                    "Found valid_values attribute for variable {} with type {}, but valid_values only allowed for character and integer variables.".format(name, type_))
@@ -344,12 +543,12 @@ class NamelistDefinition(EntryID):
 
     def _user_modifiable_in_variable_definition(self, name):
         # Is name user modifiable?
-        node = self.get_optional_child("entry", attributes={'id': name})
-        user_modifiable_only_by_xml = self.get(node, 'modify_via_xml')
+        entry = self._schema.entries[name]
+        user_modifiable_only_by_xml = entry.modify_via_xml
         if user_modifiable_only_by_xml is not None:
             expect(False,
                    "Cannot change {} in user_nl file: set via xml variable {}".format(name, user_modifiable_only_by_xml))
-        user_cannot_modify = self.get(node, 'cannot_modify_by_user_nl')
+        user_cannot_modify = entry.cannot_modify_by_user_nl
         if user_cannot_modify is not None:
             expect(False,
                    "Cannot change {} in user_nl file: {}".format(name, user_cannot_modify))
@@ -422,7 +621,9 @@ class NamelistDefinition(EntryID):
         return Namelist(groups)
 
     def get_input_pathname(self, name):
-        node = self._nodes[name]
+        return self._schema.entries[name].input_pathname
+
+    def _get_input_pathname(self, node):
         if self.get_version() == 1.0:
             input_pathname = self.get(node, 'input_pathname')
         elif self.get_version() >= 2.0:
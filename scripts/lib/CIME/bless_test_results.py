@@ -42,7 +42,9 @@ def bless_history(test_name, case, baseline_name, baseline_root, report_only, fo
 
         baseline_full_dir = os.path.join(baseline_root, baseline_name, case.get_value("CASEBASEID"))
 
-        cmp_result, cmp_comments = compare_baseline(case, baseline_dir=baseline_full_dir, outfile_suffix=None)
+        # A forced bless only needs to know whether anything differs
+        cmp_result, cmp_comments = compare_baseline(case, baseline_dir=baseline_full_dir, outfile_suffix=None,
+                                                     stop_on_diff=force and not report_only)
         if cmp_result:
             logger.info("Diff appears to have been already resolved.")
             return True, None
@@ -78,14 +80,18 @@ def bless_test_results(baseline_name, baseline_root, test_root, compiler, test_i
     most_recent = sorted(timestamps)[-1]
     logger.info("Matched test batch is {}".format(most_recent))
 
-    broken_blesses = []
+    selected_status_files = []
     for test_status_file in test_status_files:
         if not most_recent in test_status_file:
             logger.info("Skipping {}".format(test_status_file))
-            continue
+        else:
+            selected_status_files.append(test_status_file)
 
-        test_dir = os.path.dirname(test_status_file)
-        ts = TestStatus(test_dir=test_dir)
+    # Read the statuses of the whole batch at once, from the test status index if there is one
+    test_dirs = [os.path.dirname(test_status_file) for test_status_file in selected_status_files]
+
+    broken_blesses = []
+    for test_status_file, test_dir, ts in zip(selected_status_files, test_dirs, get_test_statuses(test_dirs)):
         test_name = ts.get_name()
         if test_name is None:
             case_dir = os.path.basename(test_dir)
@@ -278,6 +278,95 @@ def _build_model_cmake(exeroot, complist, lid, cimeroot, buildlist,
 
     return logs
 
+###############################################################################
+def _get_sharedpath(compiler, mpilib, debug, build_threaded, comp_interface):
+###############################################################################
+    """
+    Return the path, relative to SHAREDLIBROOT (and EXEROOT), of the shared
+    libraries for this build configuration
+
+    >>> _get_sharedpath("gnu", "mpich", True, False, "mct")
+    'gnu/mpich/debug/nothreads/mct'
+    """
+    debugdir = "debug" if debug else "nodebug"
+    threaddir = "threads" if build_threaded else "nothreads"
+    logger.debug("compiler={} mpilib={} debugdir={} threaddir={}"
+                 .format(compiler,mpilib,debugdir,threaddir))
+
+    return os.path.join(compiler, mpilib, debugdir, threaddir, comp_interface)
+
+###############################################################################
+def get_sharedlib_build_dirs(case):
+###############################################################################
+    """
+    Return (sharedlib_dir, cprnc_dir) for the directories a sharedlib-only build
+    of case will build into. Cases with the same sharedlib_dir build the same
+    libraries in the same place, so only one of them should build at a time and
+    the others can reuse its objects. cprnc_dir is None unless the build will
+    also need to build cprnc, which is shared by all cases with the same compiler.
+    """
+    comp_interface = case.get_value("COMP_INTERFACE")
+    build_threaded = _get_build_threaded(case.get_build_threaded(), _get_complist(case, comp_interface))
+    compiler = case.get_value("COMPILER")
+    sharedlibroot = os.path.abspath(case.get_value("SHAREDLIBROOT"))
+    sharedpath = _get_sharedpath(compiler, case.get_value("MPILIB"), case.get_value("DEBUG"),
+                                 build_threaded, comp_interface)
+
+    cprnc_dir = None
+    if case.get_value("TEST"):
+        cprnc_loc = case.get_value("CCSM_CPRNC")
+        if not cprnc_loc or not os.path.exists(cprnc_loc):
+            cprnc_dir = os.path.join(sharedlibroot, compiler, "cprnc")
+
+    return os.path.join(sharedlibroot, sharedpath), cprnc_dir
+
+###############################################################################
+def _get_complist(case, comp_interface):
+###############################################################################
+    """
+    Return (comp class in lower case, comp, nthrds, ninst, config dir) for
+    each component of case that is built, nuopc stub components are not
+    """
+    multi_driver = case.get_value("MULTI_DRIVER")
+    complist = []
+    ninst = 1
+    for comp_class in case.get_values("COMP_CLASSES"):
+        if comp_class == "CPL":
+            config_dir = None
+            if multi_driver:
+                ninst = case.get_value("NINST_MAX")
+        else:
+            config_dir = os.path.dirname(case.get_value("CONFIG_{}_FILE".format(comp_class)))
+            if multi_driver:
+                ninst = 1
+            else:
+                ninst = case.get_value("NINST_{}".format(comp_class))
+
+        comp = case.get_value("COMP_{}".format(comp_class))
+        if comp_interface == 'nuopc' and comp in ('satm', 'slnd', 'sesp', 'sglc', 'srof', 'sice', 'socn', 'swav', 'siac'):
+            continue
+        thrds =  case.get_value("NTHRDS_{}".format(comp_class))
+        expect(ninst is not None,"Failed to get ninst for comp_class {}".format(comp_class))
+        complist.append((comp_class.lower(), comp, thrds, ninst, config_dir ))
+
+    return complist
+
+###############################################################################
+def _get_build_threaded(build_threaded, complist):
+###############################################################################
+    """
+    Return whether the shared libraries are built with threading: if the case
+    asks for it (build_threaded) or any component in complist uses threads
+
+    >>> _get_build_threaded(False, [("cpl", "cpl", 1, 1, None), ("atm", "datm", 1, 1, "")])
+    False
+    >>> _get_build_threaded(False, [("cpl", "cpl", 1, 1, None), ("atm", "datm", 2, 1, "")])
+    True
+    >>> _get_build_threaded(True, [])
+    True
+    """
+    return build_threaded or any(nthrds > 1 for _, _, nthrds, _, _ in complist)
+
 ###############################################################################
 def _build_checks(case, build_threaded, comp_interface,
                   debug, compiler, mpilib, complist, ninst_build, smp_value,
@@ -293,10 +382,8 @@ def _build_checks(case, build_threaded, comp_interface,
            "Only supporting mct nuopc, or moab comp_interfaces at this time, found {}".format(comp_interface))
     smpstr = ""
     ninst_value = ""
-    for model, _, nthrds, ninst, _ in complist:
-        if nthrds > 1:
-            build_threaded = True
-        if build_threaded:
+    for idx, (model, _, _, ninst, _) in enumerate(complist):
+        if _get_build_threaded(build_threaded, complist[:idx + 1]):
             smpstr += "{}1".format(model[0])
         else:
             smpstr += "{}0".format(model[0])
@@ -305,12 +392,7 @@ def _build_checks(case, build_threaded, comp_interface,
     case.set_value("SMP_VALUE", smpstr)
     case.set_value("NINST_VALUE", ninst_value)
 
-    debugdir = "debug" if debug else "nodebug"
-    threaddir = "threads" if build_threaded else "nothreads"
-    sharedpath = os.path.join(compiler, mpilib, debugdir, threaddir, comp_interface)
-
-    logger.debug("compiler={} mpilib={} debugdir={} threaddir={}"
-                 .format(compiler,mpilib,debugdir,threaddir))
+    sharedpath = _get_sharedpath(compiler, mpilib, debug, _get_build_threaded(build_threaded, complist), comp_interface)
 
     expect(ninst_build == ninst_value or ninst_build == "0",
             """
@@ -623,8 +705,6 @@ def _case_build_impl(caseroot, case, sharedlib_only, model_only, buildlist,
 
     cimeroot = case.get_value("CIMEROOT")
 
-    comp_classes = case.get_values("COMP_CLASSES")
-
     case.check_lockedfiles(skip="env_batch")
 
     # Retrieve relevant case data
@@ -636,29 +716,10 @@ def _case_build_impl(caseroot, case, sharedlib_only, model_only, buildlist,
     exeroot             = os.path.abspath(case.get_value("EXEROOT"))
     incroot             = os.path.abspath(case.get_value("INCROOT"))
     libroot             = os.path.abspath(case.get_value("LIBROOT"))
-    multi_driver = case.get_value("MULTI_DRIVER")
-    complist = []
-    ninst = 1
     comp_interface      = case.get_value("COMP_INTERFACE")
-    for comp_class in comp_classes:
-        if comp_class == "CPL":
-            config_dir = None
-            if multi_driver:
-                ninst = case.get_value("NINST_MAX")
-        else:
-            config_dir = os.path.dirname(case.get_value("CONFIG_{}_FILE".format(comp_class)))
-            if multi_driver:
-                ninst = 1
-            else:
-                ninst = case.get_value("NINST_{}".format(comp_class))
-
-        comp = case.get_value("COMP_{}".format(comp_class))
-        if comp_interface == 'nuopc' and comp in ('satm', 'slnd', 'sesp', 'sglc', 'srof', 'sice', 'socn', 'swav', 'siac'):
-            continue
-        thrds =  case.get_value("NTHRDS_{}".format(comp_class))
-        expect(ninst is not None,"Failed to get ninst for comp_class {}".format(comp_class))
-        complist.append((comp_class.lower(), comp, thrds, ninst, config_dir ))
-        os.environ["COMP_{}".format(comp_class)] = comp
+    complist = _get_complist(case, comp_interface)
+    for model, comp, _, _, _ in complist:
+        os.environ["COMP_{}".format(model.upper())] = comp
 
     compiler            = case.get_value("COMPILER")
     mpilib              = case.get_value("MPILIB")
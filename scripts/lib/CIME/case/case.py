@@ -40,6 +40,10 @@ from CIME.aprun import get_aprun_cmd_for_case
 
 logger = logging.getLogger(__name__)
 
+# Variable and environment references, as understood by GenericXML.get_resolved_value
+_REFERENCE_RE = re.compile(r'\${?(\w+)}?')
+_ENV_REF_RE   = re.compile(r'\$ENV\{(\w+)\}')
+
 class Case(object):
     """
     https://github.com/ESMCI/cime/wiki/Developers-Introduction
@@ -73,7 +77,8 @@ class Case(object):
     from CIME.case.case_test  import case_test
     from CIME.case.case_submit import check_DA_settings, check_case, submit
     from CIME.case.case_st_archive import case_st_archive, restore_from_archive, \
-        archive_last_restarts, test_st_archive, test_env_archive
+        archive_last_restarts, test_st_archive, test_env_archive, \
+        start_background_archive, finish_background_archive
     from CIME.case.case_run import case_run
     from CIME.case.case_cmpgen_namelists import case_cmpgen_namelists
     from CIME.case.check_lockedfiles import check_lockedfile, check_lockedfiles, check_pelayouts_require_rebuild
@@ -95,6 +100,14 @@ class Case(object):
         self._files = []
         self._comp_interface = None
 
+        # Maps variable ids to the env object that owns them, see _build_env_index
+        self._env_index = {}
+
+        # Memoized get_resolved_value results, see _get_memoized_resolved_value
+        self._resolved_values = {}
+        self._resolved_dependents = {}
+        self._resolved_stamp = None
+
         self.read_xml()
 
         # Hold arbitary values. In create_newcase we may set values
@@ -226,6 +239,21 @@ class Case(object):
                                                        comp_interface=self._comp_interface))
         self._env_generic_files.append(EnvArchive(self._caseroot, read_only=self._force_read_only))
         self._files = self._env_entryid_files + self._env_generic_files
+        self._build_env_index()
+        self._clear_resolved_values()
+
+    def _build_env_index(self):
+        """
+        Map every entry id to the first env object defining it, so that
+        get_value and friends go straight to the right file. Variables not
+        found in the index (component variables like NTASKS_ATM, entries
+        added later) are found by probing all files and then added.
+        """
+        self._env_index = {}
+        for env_file in self._env_entryid_files:
+            for vid in env_file.get_entry_ids():
+                if vid not in self._env_index:
+                    self._env_index[vid] = env_file
 
     def get_case_root(self):
         """Returns the root directory for this case."""
@@ -281,11 +309,21 @@ class Case(object):
         for env_file in self._files:
             env_file.write(force_write=flushall)
 
+    def _get_env_files(self, item, env_files=None):
+        """
+        Return the env objects to search for item: the indexed owner of item
+        first, then all of env_files (default all files) in their usual order.
+        """
+        env_files = self._files if env_files is None else env_files
+        owner = self._env_index.get(item)
+        return env_files if owner is None else [owner] + env_files
+
     def get_values(self, item, attribute=None, resolved=True, subgroup=None):
-        for env_file in self._files:
+        for env_file in self._get_env_files(item):
             # Wait and resolve in self rather than in env_file
             results = env_file.get_values(item, attribute, resolved=False, subgroup=subgroup)
             if len(results) > 0:
+                self._env_index.setdefault(item, env_file)
                 new_results = []
                 if resolved:
                     for result in results:
@@ -310,11 +348,12 @@ class Case(object):
 
     def get_value(self, item, attribute=None, resolved=True, subgroup=None):
         result = None
-        for env_file in self._files:
+        for env_file in self._get_env_files(item):
             # Wait and resolve in self rather than in env_file
             result = env_file.get_value(item, attribute, resolved=False, subgroup=subgroup)
 
             if result is not None:
+                self._env_index.setdefault(item, env_file)
                 if resolved and isinstance(result, six.string_types):
                     result = self.get_resolved_value(result)
                     vtype = env_file.get_type_info(item)
@@ -326,6 +365,41 @@ class Case(object):
         # Return empty result
         return result
 
+    def get_values_dict(self, items, attribute=None, resolved=True, subgroup=None):
+        """
+        Return a dict mapping each variable in items to its value, as
+        get_value would return it. Variables not found map to None.
+        The variables are grouped by the env file owning them, each env file
+        is queried once for its whole group and the values are then resolved
+        together. Variables missing from the index go through get_value.
+        """
+        by_owner = {}
+        result = {}
+        for item in items:
+            owner = self._env_index.get(item)
+            if owner is None:
+                result[item] = self.get_value(item, attribute=attribute, resolved=resolved, subgroup=subgroup)
+            else:
+                by_owner.setdefault(owner, []).append(item)
+
+        for env_file, group in by_owner.items():
+            raw_values = [(item, env_file.get_value(item, attribute, resolved=False, subgroup=subgroup))
+                          for item in group]
+            for item, value in raw_values:
+                if value is None:
+                    # Not in its owner for this attribute or subgroup, probe the other files
+                    result[item] = self.get_value(item, attribute=attribute, resolved=resolved, subgroup=subgroup)
+                elif resolved and isinstance(value, six.string_types):
+                    value = self.get_resolved_value(value)
+                    vtype = env_file.get_type_info(item)
+                    if vtype is not None and vtype != "char":
+                        value = convert_to_type(value, vtype, item)
+                    result[item] = value
+                else:
+                    result[item] = value
+
+        return result
+
     def get_record_fields(self, variable, field):
         """ get_record_fields gets individual requested field from an entry_id file
         this routine is used only by xmlquery """
@@ -374,7 +448,7 @@ class Case(object):
 
     def get_type_info(self, item):
         result = None
-        for env_file in self._env_entryid_files:
+        for env_file in self._get_env_files(item, self._env_entryid_files):
             result = env_file.get_type_info(item)
             if result is not None:
                 return result
@@ -382,6 +456,85 @@ class Case(object):
         return result
 
     def get_resolved_value(self, item, recurse=0, allow_unresolved_envvars=False):
+        if recurse == 0 and item and "$" in item:
+            return self._get_memoized_resolved_value(item, allow_unresolved_envvars)
+
+        return self._resolve_value(item, recurse=recurse, allow_unresolved_envvars=allow_unresolved_envvars)
+
+    def _get_env_stamp(self):
+        return tuple((id(env_file.root), env_file.get_modification_count()) for env_file in self._files)
+
+    def _clear_resolved_values(self):
+        self._resolved_values = {}
+        self._resolved_dependents = {}
+        self._resolved_stamp = self._get_env_stamp()
+
+    def _get_memoized_resolved_value(self, item, allow_unresolved_envvars):
+        """
+        Resolve item, reusing earlier results. Each result records the
+        variables it was (transitively) resolved from, so that set_value only
+        drops the results depending on the variable it changes. Changes made
+        to the env files behind the back of the case drop all results.
+        Values involving $SHELL{} are resolved every time, since the output of
+        the command may change.
+        """
+        if self._resolved_stamp != self._get_env_stamp():
+            self._clear_resolved_values()
+
+        key = (item, allow_unresolved_envvars)
+        if key in self._resolved_values:
+            value, envvars = self._resolved_values[key]
+            if all(os.environ.get(envvar) == envval for envvar, envval in envvars.items()):
+                return value
+
+        value = self._resolve_value(item, allow_unresolved_envvars=allow_unresolved_envvars)
+
+        deps, envvars, has_shell = self._get_resolved_value_deps(item)
+        if has_shell:
+            return value
+
+        self._resolved_values[key] = (value, envvars)
+        for dep in deps:
+            self._resolved_dependents.setdefault(dep, set()).add(key)
+
+        return value
+
+    def _get_resolved_value_deps(self, item):
+        """
+        Return the names of the case variables item refers to, directly or
+        through the values of other variables, the values of the environment
+        variables involved and whether a $SHELL{} command is involved.
+        """
+        deps = set()
+        envvars = {}
+        has_shell = False
+        pending = [item]
+        while pending:
+            value = pending.pop()
+            has_shell = has_shell or "$SHELL{" in value
+            for m in _ENV_REF_RE.finditer(value):
+                envvars[m.group(1)] = os.environ.get(m.group(1))
+
+            for m in _REFERENCE_RE.finditer(value):
+                var = m.group(1)
+                if var in deps:
+                    continue
+
+                deps.add(var)
+                # Setting NTASKS changes NTASKS_ATM and vice versa
+                deps.add(self.check_if_comp_var(var)[0])
+                raw_value = self.get_value(var, resolved=False)
+                if isinstance(raw_value, six.string_types) and "$" in raw_value:
+                    pending.append(raw_value)
+
+        return deps, envvars, has_shell
+
+    def _invalidate_resolved_values(self, item):
+        for var in set([item, self.check_if_comp_var(item)[0]]):
+            for key in self._resolved_dependents.pop(var, ()):
+                self._resolved_values.pop(key, None)
+
+    def _resolve_value(self, item, recurse=0, allow_unresolved_envvars=False):
         num_unresolved = item.count("$") if item else 0
         recurse_limit = 10
         if (num_unresolved > 0 and recurse < recurse_limit ):
@@ -391,8 +544,8 @@ class Case(object):
             if ("$" not in item):
                 return item
             else:
-                item = self.get_resolved_value(item, recurse=recurse+1,
-                                               allow_unresolved_envvars=allow_unresolved_envvars)
+                item = self._resolve_value(item, recurse=recurse+1,
+                                           allow_unresolved_envvars=allow_unresolved_envvars)
 
         return item
 
@@ -410,10 +563,16 @@ class Case(object):
             self._caseroot = value
         result = None
 
-        for env_file in self._files:
+        if self._resolved_stamp != self._get_env_stamp():
+            self._clear_resolved_values()
+
+        for env_file in self._get_env_files(item):
             result = env_file.set_value(item, value, subgroup, ignore_type)
             if (result is not None):
                 logger.debug("Will rewrite file {} {}".format(env_file.filename, item))
+                self._env_index.setdefault(item, env_file)
+                self._invalidate_resolved_values(item)
+                self._resolved_stamp = self._get_env_stamp()
                 return (result, env_file.filename) if return_file else result
 
         if len(self._files) == 1:
@@ -1596,6 +1755,8 @@ directory, NOT in this subdirectory."""
 
         expect(new_env_file is not None, "No match found for file type {}".format(ftype))
         self._files = [new_env_file]
+        self._build_env_index()
+        self._clear_resolved_values()
 
     def update_env(self, new_object, env_file, blow_away=False):
         """
@@ -1614,6 +1775,8 @@ directory, NOT in this subdirectory."""
             self._env_generic_files.append(new_object)
         self._files.remove(old_object)
         self._files.append(new_object)
+        self._build_env_index()
+        self._clear_resolved_values()
 
     def get_latest_cpl_log(self, coupler_log_path=None, cplname="cpl"):
         """
@@ -10,8 +10,9 @@ from CIME.simple_compare import compare_files, compare_runconfigfiles
 from CIME.utils import append_status, safe_copy, SharedArea
 from CIME.test_status import *
 
-import os, shutil, traceback, stat, glob
+import os, shutil, traceback, stat, glob, multiprocessing
 from distutils import dir_util
+from multiprocessing.pool import ThreadPool
 
 logger = logging.getLogger(__name__)
 
@@ -32,27 +33,42 @@ def _do_full_nl_comp(case, test, compare_name, baseline_root=None):
                             and not item.endswith("prescribed")\
                             and not os.path.basename(item).startswith(".")]
 
-    comments = "NLCOMP\n"
-    for item in all_items_to_compare:
+    def compare_one(item):
         baseline_counterpart = os.path.join(baseline_casedocs \
                                             if os.path.dirname(item).endswith("CaseDocs") \
                                             else baseline_dir,os.path.basename(item))
         if not os.path.exists(baseline_counterpart):
-            comments += "Missing baseline namelist '{}'\n".format(baseline_counterpart)
-            all_match = False
+            return False, "Missing baseline namelist '{}'\n".format(baseline_counterpart)
+
+        if item.endswith("runconfig") or item.endswith("runseq"):
+            success, current_comments = compare_runconfigfiles(baseline_counterpart, item, test)
+        elif is_namelist_file(item):
+            success, current_comments = compare_namelist_files(baseline_counterpart, item, test)
         else:
-            if item.endswith("runconfig") or item.endswith("runseq"):
-                success, current_comments = compare_runconfigfiles(baseline_counterpart, item, test)
-            elif is_namelist_file(item):
-                success, current_comments = compare_namelist_files(baseline_counterpart, item, test)
-            else:
-                success, current_comments = compare_files(baseline_counterpart, item, test)
-
-            all_match &= success
-            if not success:
-                comments += "Comparison failed between '{}' with '{}'\n".format(item, baseline_counterpart)
-
-            comments += current_comments
+            success, current_comments = compare_files(baseline_counterpart, item, test)
+
+        if not success:
+            current_comments = "Comparison failed between '{}' with '{}'\n".format(item, baseline_counterpart) + current_comments
+
+        return success, current_comments
+
+    # Cases with many components and instances have dozens of files, often
+    # with the baselines on a shared file system, so read them a few at a time
+    num_workers = min(4, multiprocessing.cpu_count(), len(all_items_to_compare))
+    if num_workers > 1:
+        pool = ThreadPool(num_workers)
+        try:
+            results = pool.map(compare_one, all_items_to_compare)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [compare_one(item) for item in all_items_to_compare]
+
+    comments = "NLCOMP\n"
+    for success, current_comments in results:
+        all_match &= success
+        comments += current_comments
 
     logging.info(comments)
     return all_match, comments
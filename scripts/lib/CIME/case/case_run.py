@@ -6,6 +6,8 @@ from CIME.utils                     import gzip_existing_file, new_lid, run_and_
 from CIME.utils                     import run_sub_or_cmd, append_status, safe_copy, model_log, CIMEError
 from CIME.utils                     import get_model
 from CIME.get_timing                import get_timing
+from CIME.perf_history              import save_run_performance
+from CIME.coupler_log               import coupler_log_contains, COMPLETION_MARKER
 from CIME.provenance                import save_prerun_provenance, save_postrun_provenance
 
 import shutil, time, sys, os, glob
@@ -112,11 +114,14 @@ def _run_model_impl(case, lid, skip_pnl=False, da_cycle=0):
         model_log("e3sm", logger, "{} MODEL EXECUTION BEGINS HERE".format(time.strftime("%Y-%m-%d %H:%M:%S")))
         run_func = lambda: run_cmd_no_fail(cmd, from_dir=rundir)
         case.flush()
+        # Overlap archiving the earlier segments' history files with this one
+        archiver = case.start_background_archive()
         try:
             run_and_log_case_status(run_func, "model execution", caseroot=case.get_value("CASEROOT"))
             cmd_success = True
         except CIMEError:
             cmd_success = False
+        case.finish_background_archive(archiver)
 
         # The run will potentially take a very long time. We need to
         # allow the user to xmlchange things in their case.
@@ -227,11 +232,8 @@ def _post_run_check(case, lid):
         for cpl_logfile in cpl_logs:
             if not os.path.isfile(cpl_logfile):
                 break
-            with open(cpl_logfile, 'r') as fd:
-                if fv3_standalone and 'HAS ENDED' in fd.read():
-                    count_ok += 1
-                elif not fv3_standalone and 'SUCCESSFUL TERMINATION' in fd.read():
-                    count_ok += 1
+            if coupler_log_contains(cpl_logfile, marker="HAS ENDED" if fv3_standalone else COMPLETION_MARKER):
+                count_ok += 1
         if count_ok != cpl_ninst:
             expect(False, "Model did not complete - see {} \n " .format(cpl_logfile))
 
@@ -337,7 +339,8 @@ def case_run(self, skip_pnl=False, set_continue_run=False, submit_resubmits=Fals
 
         if self.get_value("CHECK_TIMING") or self.get_value("SAVE_TIMING"):
             model_log("e3sm", logger, "{} GET_TIMING BEGINS HERE".format(time.strftime("%Y-%m-%d %H:%M:%S")))
-            get_timing(self, lid)     # Run the getTiming script
+            summaries = get_timing(self, lid)     # Run the getTiming script
+            save_run_performance(self, summaries)
             model_log("e3sm", logger, "{} GET_TIMING HAS FINISHED".format(time.strftime("%Y-%m-%d %H:%M:%S")))
 
 
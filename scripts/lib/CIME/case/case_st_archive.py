@@ -4,48 +4,235 @@ case_st_archive, restore_from_archive, archive_last_restarts
 are members of class Case from file case.py
 """
 
-import shutil, glob, re, os
+from __future__ import print_function
+import shutil, glob, re, os, errno, fnmatch, threading
 
 from CIME.XML.standard_module_setup import *
 from CIME.utils                     import run_and_log_case_status, ls_sorted_by_mtime, symlink_force, safe_copy, find_files
 from CIME.date                      import get_file_date
 from CIME.XML.archive       import Archive
+from CIME.XML.archive_base  import ArchiveDirSnapshot
 from CIME.XML.files            import Files
+from collections                    import OrderedDict
+from multiprocessing.pool           import ThreadPool
 from os.path                        import isdir, join
 
 logger = logging.getLogger(__name__)
 
+# Default number of threads moving and copying files
+ST_ARCHIVE_WORKERS = 8
+
+###############################################################################
+def _copy_file_data(in_fd, out_fd, size):
+###############################################################################
+    """
+    Copy size bytes between two open files without passing the data through
+    python, using copy_file_range where the kernel supports it between these
+    two files and sendfile otherwise.
+    """
+    use_copy_range = hasattr(os, "copy_file_range")
+    offset = 0
+    while offset < size:
+        if use_copy_range:
+            try:
+                copied = os.copy_file_range(in_fd, out_fd, size - offset, offset, offset) # pylint: disable=no-member
+            except OSError as e:
+                # Older kernels and some parallel filesystems do not support it across mounts
+                if e.errno not in [errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP]:
+                    raise
+                use_copy_range = False
+                continue
+        else:
+            os.lseek(out_fd, offset, os.SEEK_SET)
+            copied = os.sendfile(out_fd, in_fd, offset, size - offset) # pylint: disable=no-member
+
+        if copied == 0:
+            # The file was truncated while we copied it
+            break
+        offset += copied
+
+###############################################################################
+def _copy_file(src, dest):
+###############################################################################
+    """
+    Copy src to dest keeping its permissions and times, like safe_copy. Existing
+    targets go through safe_copy, which deals with read-only and foreign-owned files.
+    """
+    if os.path.exists(dest) or not hasattr(os, "sendfile"):
+        safe_copy(src, dest)
+        return
+
+    with open(src, "rb") as fsrc, open(dest, "wb") as fdest:
+        _copy_file_data(fsrc.fileno(), fdest.fileno(), os.fstat(fsrc.fileno()).st_size)
+    shutil.copystat(src, dest)
+
 ###############################################################################
-def _get_archive_fn_desc(archive_fn):
+def _move_file(src, dest):
 ###############################################################################
-    return "moving" if archive_fn is shutil.move else "copying"
+    """
+    Rename src to dest, or copy it and remove src if dest is on another filesystem
+    """
+    try:
+        os.rename(src, dest)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        _copy_file(src, dest)
+        os.remove(src)
 
 ###############################################################################
-def _get_archive_file_fn(copy_only):
+class _ArchivePlan(object):
+###############################################################################
+    """
+    The file operations of one short term archiving pass.
+
+    The run directory is listed once and archiving decisions are made against
+    that listing, which is kept up to date with the moves and removals planned
+    so far. The operations are carried out at the end by a pool of threads.
+    Operations on the same file run in the order they were planned, so a history
+    file needed for restarts is copied to the restart directory before it is
+    moved to the history directory.
+    """
+
+    def __init__(self, rundir):
+        expect(isdir(rundir), 'Cannot open directory {} '.format(rundir))
+        self.rundir = rundir
+        self._files = set(os.listdir(rundir))
+        self._dirs = []
+        # Operations grouped by the file they act on, in planning order
+        self._ops = OrderedDict()
+
+    def listdir(self):
+        """
+        Returns the sorted names of the files that will remain in the run directory
+        """
+        return sorted(self._files)
+
+    def glob(self, pattern):
+        """
+        Returns the sorted paths of the files in the run directory that match pattern
+        """
+        return [join(self.rundir, f) for f in fnmatch.filter(self.listdir(), pattern)]
+
+    def isfile(self, path):
+        """
+        Whether path will be a file, answered from the listing for the run directory
+        """
+        if os.path.dirname(os.path.abspath(path)) == os.path.abspath(self.rundir):
+            return os.path.basename(path) in self._files and os.path.isfile(path)
+        return os.path.isfile(path)
+
+    def makedirs(self, path):
+        if not os.path.exists(path) and path not in self._dirs:
+            self._dirs.append(path)
+
+    def move(self, src, dest):
+        self._add(src, "moving", src, dest)
+        self._files.discard(os.path.basename(src))
+
+    def copy(self, src, dest):
+        self._add(src, "copying", src, dest)
+
+    def link(self, src, dest):
+        self._add(src, "linking", src, dest)
+
+    def remove(self, path):
+        self._add(path, "removing", path, None)
+        self._files.discard(os.path.basename(path))
+
+    def write(self, path, contents):
+        self._add(path, "writing", contents, path)
+
+    def _add(self, key, action, src, dest):
+        self._ops.setdefault(key, []).append((action, src, dest))
+
+    def describe(self):
+        """
+        Returns the planned operations as lines of text
+        """
+        lines = ["creating directory {}".format(path) for path in self._dirs]
+        for ops in self._ops.values():
+            for action, src, dest in ops:
+                if action == "removing":
+                    lines.append("removing {}".format(src))
+                elif action == "writing":
+                    lines.append("writing {}".format(dest))
+                else:
+                    lines.append("{} {} to {}".format(action, src, dest))
+        return lines
+
+    def execute(self, num_workers=None):
+        """
+        Create the directories, then carry out the planned file operations
+        """
+        for path in self._dirs:
+            if not os.path.exists(path):
+                os.makedirs(path)
+                logger.debug("created directory {}".format(path))
+
+        groups = list(self._ops.values())
+        num_workers = min(ST_ARCHIVE_WORKERS if num_workers is None else num_workers, len(groups))
+        if num_workers > 1:
+            pool = ThreadPool(num_workers)
+            try:
+                pool.map(_run_archive_ops, groups, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for ops in groups:
+                _run_archive_ops(ops)
+
+        self._dirs = []
+        self._ops = OrderedDict()
+
+###############################################################################
+def _run_archive_ops(ops):
+###############################################################################
+    for action, src, dest in ops:
+        if action == "removing":
+            logger.info("removing {}".format(src))
+            try:
+                os.remove(src)
+            except OSError:
+                logger.warning("unable to remove {}".format(src))
+        elif action == "writing":
+            logger.info("writing {}".format(dest))
+            with open(dest, "w") as fd:
+                fd.write(src)
+        else:
+            logger.info("{} {} to {}".format(action, src, dest))
+            if action == "moving":
+                _move_file(src, dest)
+            elif action == "copying":
+                _copy_file(src, dest)
+            else:
+                symlink_force(src, dest)
+
+###############################################################################
+def _get_archive_file_fn(plan, copy_only):
 ###############################################################################
     """
     Returns the function to use for archiving some files
     """
-    return safe_copy if copy_only else shutil.move
+    return plan.copy if copy_only else plan.move
 
 ###############################################################################
-def _get_datenames(casename, rundir):
+def _get_datenames(casename, plan):
 ###############################################################################
     """
     Returns the date objects specifying the times of each file
     Note we are assuming that the coupler restart files exist and are consistent with other component datenames
     Not doc-testable due to filesystem dependence
     """
-    expect(isdir(rundir), 'Cannot open directory {} '.format(rundir))
-
-    files = sorted(glob.glob(os.path.join(rundir, casename +      '.cpl.r.*.nc')))
+    files = plan.glob(casename + '.cpl.r.*.nc')
     if not files:
-        files = sorted(glob.glob(os.path.join(rundir, casename + '.cpl_0001.r.*.nc')))
+        files = plan.glob(casename + '.cpl_0001.r.*.nc')
 
     logger.debug("  cpl files : {} ".format(files))
 
     if not files:
-        logger.warning('Cannot find a {}.cpl*.r.*.nc file in directory {} '.format(casename, rundir))
+        logger.warning('Cannot find a {}.cpl*.r.*.nc file in directory {} '.format(casename, plan.rundir))
 
     datenames = []
     for filename in files:
@@ -128,15 +315,15 @@ def _get_component_archive_entries(components, archive):
 
 
 ###############################################################################
-def _archive_rpointer_files(casename, ninst_strings, rundir, save_interim_restart_files, archive,
+def _archive_rpointer_files(casename, ninst_strings, plan, save_interim_restart_files, archive,
                             archive_entry, archive_restdir, datename, datename_is_last):
 ###############################################################################
 
     if datename_is_last:
         # Copy of all rpointer files for latest restart date
-        rpointers = glob.glob(os.path.join(rundir, 'rpointer.*'))
+        rpointers = plan.glob('rpointer.*')
         for rpointer in rpointers:
-            safe_copy(rpointer, os.path.join(archive_restdir, os.path.basename(rpointer)))
+            plan.copy(rpointer, os.path.join(archive_restdir, os.path.basename(rpointer)))
     else:
         # Generate rpointer file(s) for interim restarts for the one datename and each
         # possible value of ninst_strings
@@ -171,16 +358,13 @@ def _archive_rpointer_files(casename, ninst_strings, rundir, save_interim_restar
 
                         # write out the respective files with the correct contents
                         rpointer_file = os.path.join(archive_restdir, rpointer_file)
-                        logger.info("writing rpointer_file {}".format(rpointer_file))
-                        f = open(rpointer_file, 'w')
-                        for output in rpointer_content.split(','):
-                            f.write("{} \n".format(output))
-                        f.close()
+                        plan.write(rpointer_file, "".join("{} \n".format(output)
+                                                          for output in rpointer_content.split(',')))
                 else:
                     logger.info("rpointer_content unset, not creating rpointer file {}".format(rpointer_file))
 
 ###############################################################################
-def _archive_log_files(dout_s_root, rundir, archive_incomplete, archive_file_fn):
+def _archive_log_files(dout_s_root, plan, archive_incomplete, archive_file_fn):
 ###############################################################################
     """
     Find all completed log files, or all log files if archive_incomplete is True, and archive them.
@@ -188,91 +372,84 @@ def _archive_log_files(dout_s_root, rundir, archive_incomplete, archive_file_fn)
     Not doc-testable due to file system dependence
     """
     archive_logdir = os.path.join(dout_s_root, 'logs')
-    if not os.path.exists(archive_logdir):
-        os.makedirs(archive_logdir)
-        logger.debug("created directory {} ".format(archive_logdir))
+    plan.makedirs(archive_logdir)
 
     if archive_incomplete == False:
         log_search = '*.log.*.gz'
     else:
         log_search = '*.log.*'
 
-    logfiles = glob.glob(os.path.join(rundir, log_search))
+    logfiles = plan.glob(log_search)
     for logfile in logfiles:
-        srcfile = join(rundir, os.path.basename(logfile))
+        srcfile = join(plan.rundir, os.path.basename(logfile))
         destfile = join(archive_logdir, os.path.basename(logfile))
-        logger.info("{} {} to {}".format(_get_archive_fn_desc(archive_file_fn), srcfile, destfile))
         archive_file_fn(srcfile, destfile)
 
 ###############################################################################
-def _archive_history_files(archive, compclass, compname, histfiles_savein_rundir,
-                           last_date, archive_file_fn, dout_s_root, casename, rundir):
+def _archive_history_files(snapshot, compclass, compname, histfiles_savein_rundir,
+                           last_date, archive_file_fn, dout_s_root, casename, plan):
 ###############################################################################
     """
     perform short term archiving on history files in rundir
 
+    snapshot is an ArchiveDirSnapshot of rundir, taken after archiving the restarts
+
     Not doc-testable due to case and file system dependence
     """
+    rundir = plan.rundir
 
     # determine history archive directory (create if it does not exist)
 
     archive_histdir = os.path.join(dout_s_root, compclass, 'hist')
-    if not os.path.exists(archive_histdir):
-        os.makedirs(archive_histdir)
-        logger.debug("created directory {}".format(archive_histdir))
+    plan.makedirs(archive_histdir)
     # the compname is drv but the files are named cpl
     if compname == 'drv':
         compname = 'cpl'
 
     if compname == 'nemo':
         archive_rblddir = os.path.join(dout_s_root, compclass, 'rebuild')
-        if not os.path.exists(archive_rblddir):
-            os.makedirs(archive_rblddir)
-            logger.debug("created directory {}".format(archive_rblddir))
+        plan.makedirs(archive_rblddir)
 
         sfxrbld = r'mesh_mask_' + r'[0-9]*'
         pfile = re.compile(sfxrbld)
-        rbldfiles = [f for f in os.listdir(rundir) if pfile.search(f)]
+        rbldfiles = [f for f in plan.listdir() if pfile.search(f)]
         logger.debug("rbldfiles = {} ".format(rbldfiles))
 
         if rbldfiles:
             for rbldfile in rbldfiles:
                 srcfile = join(rundir, rbldfile)
                 destfile = join(archive_rblddir, rbldfile)
-                logger.info("{} {} to {} ".format(_get_archive_fn_desc(archive_file_fn), srcfile, destfile))
                 archive_file_fn(srcfile, destfile)
 
         sfxhst = casename + r'_[0-9][mdy]_' + r'[0-9]*'
         pfile = re.compile(sfxhst)
-        hstfiles = [f for f in os.listdir(rundir) if pfile.search(f)]
+        hstfiles = [f for f in plan.listdir() if pfile.search(f)]
         logger.debug("hstfiles = {} ".format(hstfiles))
 
         if hstfiles:
             for hstfile in hstfiles:
                 srcfile = join(rundir, hstfile)
                 destfile = join(archive_histdir, hstfile)
-                logger.info("{} {} to {} ".format(_get_archive_fn_desc(archive_file_fn), srcfile, destfile))
                 archive_file_fn(srcfile, destfile)
 
     # determine ninst and ninst_string
 
     # archive history files - the only history files that kept in the
     # run directory are those that are needed for restarts
-    histfiles = archive.get_all_hist_files(casename, compname, rundir)
+    remaining = set(plan.listdir())
+    histfiles = [f for f in snapshot.get_all_hist_files(casename, compname) if f in remaining]
 
     if histfiles:
         for histfile in histfiles:
             file_date = get_file_date(os.path.basename(histfile))
             if last_date is None or file_date is None or file_date <= last_date:
                 srcfile = join(rundir, histfile)
-                expect(os.path.isfile(srcfile),
+                expect(plan.isfile(srcfile),
                        "history file {} does not exist ".format(srcfile))
                 destfile = join(archive_histdir, histfile)
                 if histfile in histfiles_savein_rundir:
-                    logger.info("copying {} to {} ".format(srcfile, destfile))
-                    safe_copy(srcfile, destfile)
+                    plan.copy(srcfile, destfile)
                 else:
-                    logger.info("{} {} to {} ".format(_get_archive_fn_desc(archive_file_fn), srcfile, destfile))
                     archive_file_fn(srcfile, destfile)
 
 ###############################################################################
@@ -318,7 +495,7 @@ def get_histfiles_for_restarts(rundir, archive, archive_entry, restfile, testonl
     return histfiles
 
 ###############################################################################
-def _archive_restarts_date(case, casename, rundir, archive,
+def _archive_restarts_date(case, casename, plan, archive,
                            datename, datename_is_last, last_date,
                            archive_restdir, archive_file_fn, components=None,
                            link_to_last_restart_files=False, testonly=False):
@@ -349,7 +526,7 @@ def _archive_restarts_date(case, casename, rundir, archive,
             logger.info('Archiving restarts for {} ({})'.format(compname, compclass))
 
             # archive restarts
-            histfiles_savein_rundir = _archive_restarts_date_comp(case, casename, rundir,
+            histfiles_savein_rundir = _archive_restarts_date_comp(case, casename, plan,
                                                                   archive, archive_entry,
                                                                   compclass, compname,
                                                                   datename, datename_is_last,
@@ -363,7 +540,35 @@ def _archive_restarts_date(case, casename, rundir, archive,
     return histfiles_savein_rundir_by_compname
 
 ###############################################################################
-def _archive_restarts_date_comp(case, casename, rundir, archive, archive_entry,
+def _get_restart_files(plan, casename, compname, suffix, datename):
+###############################################################################
+    """
+    Returns the names of the restart files in the run directory for one
+    component (named as in its files), rest_file_extension and date
+
+    Not doc-testable due to file system dependence
+    """
+    datename_str = _datetime_str(datename)
+    if compname.find('mpas') == 0 or compname == 'mali':
+        pattern = compname + r'\.' + suffix + r'\.' + '_'.join(datename_str.rsplit('-', 1))
+        pfile = re.compile(pattern)
+        restfiles = [f for f in plan.listdir() if pfile.search(f)]
+    elif compname == 'nemo':
+        pattern = r'_*_' + suffix + r'[0-9]*'
+        pfile = re.compile(pattern)
+        restfiles = [f for f in plan.listdir() if pfile.search(f)]
+    else:
+        pattern = r"^{}\.{}[\d_]*\.".format(casename, compname)
+        pfile = re.compile(pattern)
+        files = [f for f in plan.listdir() if pfile.search(f)]
+        pattern =  r'_?' + r'\d*' + r'\.' + suffix + r'\.' + r'[^\.]*' + r'\.?' + datename_str
+        pfile = re.compile(pattern)
+        restfiles = [f for f in files if pfile.search(f)]
+        logger.debug("pattern is {} restfiles {}".format(pattern, restfiles))
+    return restfiles
+
+###############################################################################
+def _archive_restarts_date_comp(case, casename, plan, archive, archive_entry,
                                 compclass, compname, datename, datename_is_last,
                                 last_date, archive_restdir, archive_file_fn,
                                 link_to_last_restart_files=False, testonly=False):
@@ -376,14 +581,13 @@ def _archive_restarts_date_comp(case, casename, rundir, archive, archive_entry,
     True); if False (the default), copy them. (This has no effect on the
     history files that are associated with these restart files.)
     """
-    datename_str = _datetime_str(datename)
+    rundir = plan.rundir
 
     if datename_is_last or case.get_value('DOUT_S_SAVE_INTERIM_RESTART_FILES'):
-        if not os.path.exists(archive_restdir):
-            os.makedirs(archive_restdir)
+        plan.makedirs(archive_restdir)
 
     # archive the rpointer file(s) for this datename and all possible ninst_strings
-    _archive_rpointer_files(casename, _get_ninst_info(case, compclass)[1], rundir,
+    _archive_rpointer_files(casename, _get_ninst_info(case, compclass)[1], plan,
                             case.get_value('DOUT_S_SAVE_INTERIM_RESTART_FILES'),
                             archive, archive_entry, archive_restdir, datename, datename_is_last)
 
@@ -393,11 +597,9 @@ def _archive_restarts_date_comp(case, casename, rundir, archive, archive_entry,
 
     # determine function to use for last set of restart files
     if link_to_last_restart_files:
-        last_restart_file_fn = symlink_force
-        last_restart_file_fn_msg = "linking"
+        last_restart_file_fn = plan.link
     else:
-        last_restart_file_fn = safe_copy
-        last_restart_file_fn_msg = "copying"
+        last_restart_file_fn = plan.copy
 
     # the compname is drv but the files are named cpl
     if compname == 'drv':
@@ -406,23 +608,7 @@ def _archive_restarts_date_comp(case, casename, rundir, archive, archive_entry,
     # get file_extension suffixes
     for suffix in archive.get_rest_file_extensions(archive_entry):
 #        logger.debug("suffix is {} ninst {}".format(suffix, ninst))
-        restfiles = ""
-        if compname.find('mpas') == 0 or compname == 'mali':
-            pattern = compname + r'\.' + suffix + r'\.' + '_'.join(datename_str.rsplit('-', 1))
-            pfile = re.compile(pattern)
-            restfiles = [f for f in os.listdir(rundir) if pfile.search(f)]
-        elif compname == 'nemo':
-            pattern = r'_*_' + suffix + r'[0-9]*'
-            pfile = re.compile(pattern)
-            restfiles = [f for f in os.listdir(rundir) if pfile.search(f)]
-        else:
-            pattern = r"^{}\.{}[\d_]*\.".format(casename, compname)
-            pfile = re.compile(pattern)
-            files = [f for f in os.listdir(rundir) if pfile.search(f)]
-            pattern =  r'_?' + r'\d*' + r'\.' + suffix + r'\.' + r'[^\.]*' + r'\.?' + datename_str
-            pfile = re.compile(pattern)
-            restfiles = [f for f in files if pfile.search(f)]
-            logger.debug("pattern is {} restfiles {}".format(pattern, restfiles))
+        restfiles = _get_restart_files(plan, casename, compname, suffix, datename)
         for rfile in restfiles:
             rfile = os.path.basename(rfile)
 
@@ -431,8 +617,7 @@ def _archive_restarts_date_comp(case, casename, rundir, archive, archive_entry,
                 # Skip this file
                 continue
 
-            if not os.path.exists(archive_restdir):
-                os.makedirs(archive_restdir)
+            plan.makedirs(archive_restdir)
 
             # obtain array of history files for restarts
             # need to do this before archiving restart files
@@ -451,23 +636,19 @@ def _archive_restarts_date_comp(case, casename, rundir, archive, archive_entry,
                 srcfile = os.path.join(rundir, rfile)
                 destfile = os.path.join(archive_restdir, rfile)
                 last_restart_file_fn(srcfile, destfile)
-                logger.info("{} file {} to {}".format(last_restart_file_fn_msg, srcfile, destfile))
                 for histfile in histfiles_for_restart:
                     srcfile = os.path.join(rundir, histfile)
                     destfile = os.path.join(archive_restdir, histfile)
-                    expect(os.path.isfile(srcfile),
+                    expect(plan.isfile(srcfile),
                            "history restart file {} for last date does not exist ".format(srcfile))
-                    logger.info("Copying {} to {}".format(srcfile, destfile))
-                    safe_copy(srcfile, destfile)
-                    logger.debug("datename_is_last + histfiles_for_restart copying \n  {} to \n  {}".format(srcfile, destfile))
+                    plan.copy(srcfile, destfile)
             else:
                 # Only archive intermediate restarts if requested - otherwise remove them
                 if case.get_value('DOUT_S_SAVE_INTERIM_RESTART_FILES'):
                     srcfile = os.path.join(rundir, rfile)
                     destfile = os.path.join(archive_restdir, rfile)
-                    expect(os.path.isfile(srcfile),
+                    expect(plan.isfile(srcfile),
                            "restart file {} does not exist ".format(srcfile))
-                    logger.info("{} file {} to {}".format(_get_archive_fn_desc(archive_file_fn), srcfile, destfile))
                     archive_file_fn(srcfile, destfile)
 
                     # need to copy the history files needed for interim restarts - since
@@ -475,16 +656,15 @@ def _archive_restarts_date_comp(case, casename, rundir, archive, archive_entry,
                     for histfile in histfiles_for_restart:
                         srcfile = os.path.join(rundir, histfile)
                         destfile = os.path.join(archive_restdir, histfile)
-                        expect(os.path.isfile(srcfile),
+                        expect(plan.isfile(srcfile),
                                "hist file {} does not exist ".format(srcfile))
-                        logger.info("copying {} to {}".format(srcfile, destfile))
-                        safe_copy(srcfile, destfile)
+                        plan.copy(srcfile, destfile)
                 else:
                     if compname == 'nemo':
-                        flist = glob.glob(rundir + "/" + casename + "_*_restart*.nc")
+                        flist = plan.glob(casename + "_*_restart*.nc")
                         logger.debug("nemo restart file {}".format(flist))
                         if len(flist) > 2:
-                            flist0 = glob.glob(rundir + "/" + casename + "_*_restart_0000.nc")
+                            flist0 = plan.glob(casename + "_*_restart_0000.nc")
                             if len(flist0) > 1:
                                 rstfl01 = flist0[0]
                                 rstfl01spl = rstfl01.split("/")
@@ -503,23 +683,19 @@ def _archive_restarts_date_comp(case, casename, rundir, archive, archive_entry,
                                 rsttm02 = rstfl02nmspl[-3]
 
                                 if int(rsttm01) > int(rsttm02):
-                                    restlist = glob.glob(rundir + "/" + casename + "_" + rsttm02  + "_restart_*.nc")
+                                    restlist = plan.glob(casename + "_" + rsttm02  + "_restart_*.nc")
                                 else:
-                                    restlist = glob.glob(rundir + "/" + casename + "_" + rsttm01  + "_restart_*.nc")
+                                    restlist = plan.glob(casename + "_" + rsttm01  + "_restart_*.nc")
                                 logger.debug("nemo restart list {}".format(restlist))
                                 if restlist:
                                     for _restfile in restlist:
                                         srcfile = os.path.join(rundir, _restfile)
-                                        logger.info("removing interim restart file {}".format(srcfile))
-                                        if (os.path.isfile(srcfile)):
-                                            try:
-                                                os.remove(srcfile)
-                                            except OSError:
-                                                logger.warning("unable to remove interim restart file {}".format(srcfile))
+                                        if plan.isfile(srcfile):
+                                            plan.remove(srcfile)
                                         else:
                                             logger.warning("interim restart file {} does not exist".format(srcfile))
                         elif len(flist) == 2:
-                            flist0 = glob.glob(rundir + "/" + casename + "_*_restart.nc")
+                            flist0 = plan.glob(casename + "_*_restart.nc")
                             if len(flist0) > 1:
                                 rstfl01 = flist0[0]
                                 rstfl01spl = rstfl01.split("/")
@@ -538,19 +714,15 @@ def _archive_restarts_date_comp(case, casename, rundir, archive, archive_entry,
                                 rsttm02 = rstfl02nmspl[-2]
 
                                 if int(rsttm01) > int(rsttm02):
-                                    restlist = glob.glob(rundir + "/" + casename + "_" + rsttm02  + "_restart_*.nc")
+                                    restlist = plan.glob(casename + "_" + rsttm02  + "_restart_*.nc")
                                 else:
-                                    restlist = glob.glob(rundir + "/" + casename + "_" + rsttm01  + "_restart_*.nc")
+                                    restlist = plan.glob(casename + "_" + rsttm01  + "_restart_*.nc")
                                 logger.debug("nemo restart list {}".format(restlist))
                                 if restlist:
                                     for _rfile in restlist:
                                         srcfile = os.path.join(rundir, _rfile)
-                                        logger.info("removing interim restart file {}".format(srcfile))
-                                        if (os.path.isfile(srcfile)):
-                                            try:
-                                                os.remove(srcfile)
-                                            except OSError:
-                                                logger.warning("unable to remove interim restart file {}".format(srcfile))
+                                        if plan.isfile(srcfile):
+                                            plan.remove(srcfile)
                                         else:
                                             logger.warning("interim restart file {} does not exist".format(srcfile))
                         else:
@@ -559,12 +731,8 @@ def _archive_restarts_date_comp(case, casename, rundir, archive, archive_entry,
 
                     else:
                         srcfile = os.path.join(rundir, rfile)
-                        logger.info("removing interim restart file {}".format(srcfile))
-                        if (os.path.isfile(srcfile)):
-                            try:
-                                os.remove(srcfile)
-                            except OSError:
-                                logger.warning("unable to remove interim restart file {}".format(srcfile))
+                        if plan.isfile(srcfile):
+                            plan.remove(srcfile)
                         else:
                             logger.warning("interim restart file {} does not exist".format(srcfile))
 
@@ -572,10 +740,14 @@ def _archive_restarts_date_comp(case, casename, rundir, archive, archive_entry,
 
 ###############################################################################
 def _archive_process(case, archive, last_date, archive_incomplete_logs, copy_only,
-                     components=None,dout_s_root=None, casename=None, rundir=None, testonly=False):
+                     components=None,dout_s_root=None, casename=None, rundir=None, testonly=False,
+                     dry_run=False, num_workers=None):
 ###############################################################################
     """
     Parse config_archive.xml and perform short term archiving
+
+    The archiving is planned from a single listing of rundir and then carried
+    out by num_workers threads. If dry_run is True, the plan is printed instead.
     """
 
     logger.debug('In archive_process...')
@@ -591,14 +763,15 @@ def _archive_process(case, archive, last_date, archive_incomplete_logs, copy_onl
         components.append('drv')
         components.append('dart')
 
-    archive_file_fn = _get_archive_file_fn(copy_only)
+    plan = _ArchivePlan(rundir)
+    archive_file_fn = _get_archive_file_fn(plan, copy_only)
 
     # archive log files
-    _archive_log_files(dout_s_root, rundir,
+    _archive_log_files(dout_s_root, plan,
                        archive_incomplete_logs, archive_file_fn)
 
     # archive restarts and all necessary associated files (e.g. rpointer files)
-    datenames = _get_datenames(casename, rundir)
+    datenames = _get_datenames(casename, plan)
     logger.debug("datenames {} ".format(datenames))
     histfiles_savein_rundir_by_compname = {}
     for datename in datenames:
@@ -611,22 +784,145 @@ def _archive_process(case, archive, last_date, archive_incomplete_logs, copy_onl
             archive_restdir = join(dout_s_root, 'rest', _datetime_str(datename))
 
             histfiles_savein_rundir_by_compname_this_date = _archive_restarts_date(
-                case, casename, rundir, archive, datename, datename_is_last,
+                case, casename, plan, archive, datename, datename_is_last,
                 last_date, archive_restdir, archive_file_fn, components, testonly=testonly)
             if datename_is_last:
                 histfiles_savein_rundir_by_compname = histfiles_savein_rundir_by_compname_this_date
 
     # archive history files
 
+    snapshot = ArchiveDirSnapshot(archive, rundir, files=plan.listdir())
     for (_, compname, compclass) in _get_component_archive_entries(components, archive):
         if compclass:
             logger.info('Archiving history files for {} ({})'.format(compname, compclass))
             histfiles_savein_rundir = histfiles_savein_rundir_by_compname.get(compname, [])
             logger.debug("_archive_process: histfiles_savein_rundir {} ".format(histfiles_savein_rundir))
-            _archive_history_files(archive,
+            _archive_history_files(snapshot,
                                    compclass, compname, histfiles_savein_rundir,
                                    last_date, archive_file_fn,
-                                   dout_s_root, casename, rundir)
+                                   dout_s_root, casename, plan)
+
+    if dry_run:
+        for line in plan.describe():
+            print(line)
+    else:
+        plan.execute(num_workers)
+
+###############################################################################
+def _archive_completed_history(archive, components, casename, rundir, dout_s_root,
+                               num_workers=None, testonly=False):
+###############################################################################
+    """
+    Move the history files of completed run segments to the archive, leaving
+    everything that the next segment or a later case.st_archive needs.
+
+    A history file is complete if its date is before the last set of restart
+    files and no set of restart files refers to it. Returns the number of
+    files moved.
+    """
+    plan = _ArchivePlan(rundir)
+    datenames = _get_datenames(casename, plan)
+    if not datenames:
+        return 0
+
+    snapshot = ArchiveDirSnapshot(archive, rundir, files=plan.listdir())
+    num_moved = 0
+    for (archive_entry, compname, compclass) in _get_component_archive_entries(components, archive):
+        if not compclass:
+            continue
+
+        # the compname is drv but the files are named cpl
+        file_compname = 'cpl' if compname == 'drv' else compname
+
+        # history files the model reopens on restart, or that case.st_archive
+        # saves with an interim set of restart files
+        histfiles_for_restarts = set()
+        for suffix in archive.get_rest_file_extensions(archive_entry):
+            for datename in datenames:
+                for rfile in _get_restart_files(plan, casename, file_compname, suffix, datename):
+                    histfiles_for_restarts.update(get_histfiles_for_restarts(rundir, archive, archive_entry,
+                                                                             rfile, testonly=testonly))
+
+        archive_histdir = os.path.join(dout_s_root, compclass, 'hist')
+        for file_date, histfiles in snapshot.get_hist_files_by_date(casename, file_compname):
+            if file_date is None or not file_date < datenames[-1]:
+                continue
+            for histfile in histfiles:
+                if histfile not in histfiles_for_restarts:
+                    plan.makedirs(archive_histdir)
+                    plan.move(join(rundir, histfile), join(archive_histdir, histfile))
+                    num_moved += 1
+
+    plan.execute(num_workers)
+    return num_moved
+
+###############################################################################
+class _BackgroundArchive(threading.Thread):
+###############################################################################
+    """
+    Runs _archive_completed_history in a thread, keeping any error for the caller
+    """
+
+    def __init__(self, caseroot, *args):
+        super(_BackgroundArchive, self).__init__(name="st_archive_background")
+        self.daemon = True
+        self._caseroot = caseroot
+        self._args = args
+        self.error = None
+
+    def run(self):
+        functor = lambda: _archive_completed_history(*self._args)
+        try:
+            run_and_log_case_status(functor, "st_archive background", caseroot=self._caseroot,
+                                    custom_success_msg_functor=lambda num_moved:
+                                    "{:d} history files archived".format(num_moved))
+        except Exception as e: # pylint: disable=broad-except
+            self.error = e
+
+###############################################################################
+def start_background_archive(self):
+###############################################################################
+    """
+    If DOUT_S_BACKGROUND is set, start moving the history files of completed
+    run segments to the archive while the next segment runs. Only continue
+    runs are archived this way, so the model never writes files with the
+    names of the ones being moved. Restart, rpointer and log files, and the
+    history files the run needs, are left for case.st_archive.
+
+    Returns the thread doing the work, for finish_background_archive, or None.
+    """
+    if not self.get_value("DOUT_S") or not self.get_value("DOUT_S_BACKGROUND") or \
+       not self.get_value("CONTINUE_RUN"):
+        return None
+
+    dout_s_root = self.get_value("DOUT_S_ROOT")
+    if dout_s_root is None or dout_s_root == 'UNSET':
+        return None
+
+    components = self.get_compset_components()
+    components.append('drv')
+    components.append('dart')
+
+    thread = _BackgroundArchive(self.get_value("CASEROOT"), self.get_env('archive'), components,
+                                self.get_value("CASE"), self.get_value("RUNDIR"), dout_s_root)
+    logger.info("Archiving history files of completed run segments in the background")
+    thread.start()
+    return thread
+
+###############################################################################
+def finish_background_archive(self, thread): # pylint: disable=unused-argument
+###############################################################################
+    """
+    Wait for archiving started by start_background_archive. Errors are only
+    reported, since case.st_archive archives whatever was left behind.
+    """
+    if thread is None:
+        return
+
+    thread.join()
+    if thread.error is not None:
+        logger.warning("Background short term archiving failed, case.st_archive will archive the "
+                       "remaining files: {}".format(thread.error))
 
 ###############################################################################
 def restore_from_archive(self, rest_dir=None, dout_s_root=None, rundir=None, test=False):
@@ -681,17 +977,18 @@ def archive_last_restarts(self, archive_restdir, rundir, last_date=None, link_to
     """
     archive = self.get_env('archive')
     casename = self.get_value("CASE")
-    datenames = _get_datenames(casename, rundir)
+    plan = _ArchivePlan(rundir)
+    datenames = _get_datenames(casename, plan)
     expect(len(datenames) >= 1, "No restart dates found")
     last_datename = datenames[-1]
 
     # Not currently used for anything if we're only archiving the last
     # set of restart files, but needed to satisfy the following interface
-    archive_file_fn = _get_archive_file_fn(copy_only=False)
+    archive_file_fn = _get_archive_file_fn(plan, copy_only=False)
 
     _ = _archive_restarts_date(case=self,
                                casename=casename,
-                               rundir=rundir,
+                               plan=plan,
                                archive=archive,
                                datename=last_datename,
                                datename_is_last=True,
@@ -699,12 +996,16 @@ def archive_last_restarts(self, archive_restdir, rundir, last_date=None, link_to
                                archive_restdir=archive_restdir,
                                archive_file_fn=archive_file_fn,
                                link_to_last_restart_files=link_to_restart_files)
+    plan.execute()
 
 ###############################################################################
-def case_st_archive(self, last_date_str=None, archive_incomplete_logs=True, copy_only=False, resubmit=True):
+def case_st_archive(self, last_date_str=None, archive_incomplete_logs=True, copy_only=False, resubmit=True,
+                    dry_run=False, num_workers=None):
 ###############################################################################
     """
     Create archive object and perform short term archiving
+
+    If dry_run is True, print what would be archived without changing anything.
     """
     logger.debug("resubmit {}".format(resubmit))
     caseroot = self.get_value("CASEROOT")
@@ -721,7 +1022,7 @@ def case_st_archive(self, last_date_str=None, archive_incomplete_logs=True, copy
     if dout_s_root is None or dout_s_root == 'UNSET':
         expect(False,
                'XML variable DOUT_S_ROOT is required for short-term achiver')
-    if not isdir(dout_s_root):
+    if not isdir(dout_s_root) and not dry_run:
         os.makedirs(dout_s_root)
 
     dout_s_save_interim = self.get_value('DOUT_S_SAVE_INTERIM_RESTART_FILES')
@@ -735,7 +1036,12 @@ def case_st_archive(self, last_date_str=None, archive_incomplete_logs=True, copy
     logger.info("st_archive starting")
 
     archive = self.get_env('archive')
-    functor = lambda: _archive_process(self, archive, last_date, archive_incomplete_logs, copy_only)
+    if dry_run:
+        _archive_process(self, archive, last_date, archive_incomplete_logs, copy_only, dry_run=True)
+        return True
+
+    functor = lambda: _archive_process(self, archive, last_date, archive_incomplete_logs, copy_only,
+                                       num_workers=num_workers)
     run_and_log_case_status(functor, "st_archive", caseroot=caseroot)
 
     logger.info("st_archive completed")
@@ -1,9 +1,21 @@
-import os, re, logging, six
+import os, re, logging, six, threading
 
 from collections import OrderedDict
+from CIME.namelist import parse, character_literal_to_string, is_valid_fortran_namelist_literal
 from CIME.utils  import expect, CIMEError
 logger=logging.getLogger(__name__)
 
+_dict_entry_re = re.compile(r"^'(\S+)\s*->\s*(\S+)\s*'")
+_logical_re = re.compile(r"^[.]?(t|f|true|false)[.]?$", re.IGNORECASE)
+
+# Reals are the same if they differ by less than this fraction, which only
+# allows for how many digits they were written with
+_REAL_TOLERANCE = 1e-12
+
+# Parsed namelist files, keyed by path, as (stat key, namelists)
+_CACHE = {}
+_CACHE_LOCK = threading.Lock()
+
 # pragma pylint: disable=unsubscriptable-object
 
 ###############################################################################
@@ -52,7 +64,6 @@ def _normalize_lists(value_str):
 def _interpret_value(value_str, filename):
 ###############################################################################
     comma_re = re.compile(r'\s*,\s*')
-    dict_re = re.compile(r"^'(\S+)\s*->\s*(\S+)\s*'")
 
     value_str = _normalize_lists(value_str)
 
@@ -61,7 +72,7 @@ def _interpret_value(value_str, filename):
         # dict
         rv = OrderedDict()
         for token in tokens:
-            m = dict_re.match(token)
+            m = _dict_entry_re.match(token)
             expect(m is not None, "In file '{}', Dict entry '{}' does not match expected format".format(filename, token))
             k, v = m.groups()
             rv[k] = _interpret_value(v, filename)
@@ -290,6 +301,125 @@ def _parse_namelists(namelist_lines, filename):
 
     return rv
 
+###############################################################################
+def _interpret_literals(literals, filename):
+###############################################################################
+    """
+    Return the value of a variable the namelist parser read as `literals` in the
+    form _parse_namelists gives it. Character values are put in single quotes
+    and null values are left out.
+
+    >>> _interpret_literals(['1'], 'foo')
+    '1'
+    >>> _interpret_literals(['"a b"', "'x'", ''], 'foo')
+    ["'a b'", "'x'"]
+    >>> _interpret_literals(["'one -> two'", '"three->four"'], 'foo')
+    OrderedDict([('one', 'two'), ('three', 'four')])
+    """
+    values = []
+    for literal in literals:
+        literal = literal.strip()
+        if literal.startswith(("'", '"')):
+            literal = "'{}'".format(character_literal_to_string(literal).replace("'", "''"))
+        if literal != "":
+            values.append(literal)
+
+    if any("->" in value for value in values):
+        rv = OrderedDict()
+        for value in values:
+            m = _dict_entry_re.match(value)
+            expect(m is not None, "In file '{}', Dict entry '{}' does not match expected format".format(filename, value))
+            k, v = m.groups()
+            rv[k] = v
+
+        return rv
+    elif len(values) == 1:
+        return values[0]
+    else:
+        return values
+
+###############################################################################
+def _parse_namelist_file(filename):
+###############################################################################
+    """
+    Return the namelists in `filename` in the form _parse_namelists gives.
+
+    Fortran namelist files are read with the namelist parser used to write
+    them (CIME.namelist); other files, like seq_maps.rc or files with '#'
+    comments, with _parse_namelists. The result is kept until the file changes,
+    since the same files are compared again and again by NLCOMP.
+    """
+    stat = os.stat(filename)
+    key = (stat.st_mtime, stat.st_size, stat.st_ino)
+    with _CACHE_LOCK:
+        cached = _CACHE.get(filename)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    with open(filename, "r") as fd:
+        text = fd.read()
+
+    try:
+        nml = parse(text=text)
+    except CIMEError:
+        namelists = _parse_namelists(text.splitlines(), filename)
+    else:
+        namelists = OrderedDict()
+        for group in nml.get_group_names():
+            # Group names are not case sensitive, and the parser keeps their case
+            names = namelists[group.lower()] = OrderedDict()
+            for name in nml.get_variable_names(group):
+                names[name] = _interpret_literals(nml.get_variable_value(group, name), filename)
+
+    with _CACHE_LOCK:
+        _CACHE[filename] = (key, namelists)
+
+    return namelists
+
+###############################################################################
+def _to_number(value):
+###############################################################################
+    """
+    Return the Python value of a Fortran numeric or logical literal, or None if
+    value is neither.
+
+    >>> _to_number('1.5D-3')
+    0.0015
+    >>> _to_number('.TRUE.')
+    True
+    >>> _to_number("'1'") is None, _to_number('turnip') is None
+    (True, True)
+    """
+    if is_valid_fortran_namelist_literal("real", value):
+        try:
+            return float(value.lower().replace("d", "e"))
+        except ValueError:
+            return None
+    elif _logical_re.match(value):
+        return value.strip(".")[0] in "tT"
+    else:
+        return None
+
+###############################################################################
+def _same_value(gold_value, comp_value):
+###############################################################################
+    """
+    Return whether two namelist values that are written differently hold the
+    same number or logical.
+
+    >>> _same_value('1', '1.0d0'), _same_value('0.1', '1.e-1'), _same_value('.true.', 'T')
+    (True, True, True)
+    >>> _same_value('0.1', '0.1000001'), _same_value('1', '.true.'), _same_value("'1'", '1')
+    (False, False, False)
+    """
+    gold_number = _to_number(gold_value)
+    comp_number = _to_number(comp_value)
+    if gold_number is None or comp_number is None or \
+       isinstance(gold_number, bool) != isinstance(comp_number, bool):
+        return False
+
+    return abs(gold_number - comp_number) <= _REAL_TOLERANCE * max(abs(gold_number), abs(comp_number))
+
 ###############################################################################
 def _normalize_string_value(name, value, case):
 ###############################################################################
@@ -365,7 +495,7 @@ def _compare_values(name, gold_value, comp_value, case):
         norm_gold_value = _normalize_string_value(name, gold_value, case)
         norm_comp_value = _normalize_string_value(name, comp_value, case)
 
-        if (norm_gold_value != norm_comp_value):
+        if (norm_gold_value != norm_comp_value and not _same_value(norm_gold_value, norm_comp_value)):
             comments += "  BASE: {} = {}\n".format(name, norm_gold_value)
             comments += "  COMP: {} = {}\n".format(name, norm_comp_value)
 
@@ -530,8 +660,8 @@ def compare_namelist_files(gold_file, compare_file, case=None):
     expect(os.path.exists(gold_file), "File not found: {}".format(gold_file))
     expect(os.path.exists(compare_file), "File not found: {}".format(compare_file))
 
-    gold_namelists = _parse_namelists(open(gold_file, "r").readlines(), gold_file)
-    comp_namelists = _parse_namelists(open(compare_file, "r").readlines(), compare_file)
+    gold_namelists = _parse_namelist_file(gold_file)
+    comp_namelists = _parse_namelist_file(compare_file)
     comments = _compare_namelists(gold_namelists, comp_namelists, case)
     return comments == "", comments
 
@@ -539,7 +669,7 @@ def compare_namelist_files(gold_file, compare_file, case=None):
 def is_namelist_file(file_path):
 ###############################################################################
     try:
-        compare_namelist_files(file_path, file_path)
+        _parse_namelist_file(file_path)
     except CIMEError as e:
         assert "does not appear to be a namelist file" in str(e), str(e)
         return False
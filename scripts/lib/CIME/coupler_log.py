@@ -0,0 +1,121 @@
+"""
+Reading of coupler (cpl or med) log files, which can be hundreds of MB for long
+runs. read_coupler_log extracts everything the system tests use from a log in
+a single streaming pass and keeps the result until the file changes.
+coupler_log_contains only looks for a marker, starting at the end of the log.
+"""
+
+from CIME.XML.standard_module_setup import *
+
+import gzip, threading
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+COMPLETION_MARKER = "SUCCESSFUL TERMINATION"
+
+_READ_SIZE = 1024 * 1024
+_TAIL_SIZE = 64 * 1024
+
+_MEMORY_LINE = re.compile(br".*model date =\s+(\w+).*memory =\s+(\d+\.?\d+).*highwater")
+_MODEL_DATE = re.compile(br"model date =\s+(\w+)")
+_THROUGHPUT_LINE = re.compile(br"# simulated years / cmp-day =\s+(\d+\.\d+)\s")
+
+# memory      - list of (model date, memory highwater) from the memory lines
+# throughput  - simulated years per day, from the first throughput line, or None
+# completed   - whether the log has the completion marker
+# model_dates - the model dates the log reports, in order, without repeats
+# compressed  - whether the log is gzipped, as it is once the run is saved
+CouplerLogSummary = namedtuple("CouplerLogSummary", ["memory", "throughput", "completed", "model_dates", "compressed"])
+
+_CACHE = {}
+_CACHE_LOCK = threading.Lock()
+
+def _get_cache_key(path):
+    stat = os.stat(path)
+    return (stat.st_mtime, stat.st_size, stat.st_ino)
+
+def _open_log(path):
+    return gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+
+def read_coupler_log(path):
+    """
+    Returns the CouplerLogSummary of the coupler log at path, which may be gzipped
+    """
+    key = _get_cache_key(path)
+    with _CACHE_LOCK:
+        cached = _CACHE.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    memory = []
+    model_dates = []
+    throughput = None
+    completed = False
+    marker = COMPLETION_MARKER.encode("utf-8")
+    with _open_log(path) as fd:
+        for line in fd:
+            if b"model date" in line:
+                m = _MODEL_DATE.search(line)
+                if m:
+                    model_date = m.group(1).decode("utf-8")
+                    if not model_dates or model_dates[-1] != model_date:
+                        model_dates.append(model_date)
+                if b"highwater" in line:
+                    m = _MEMORY_LINE.match(line)
+                    if m:
+                        memory.append((float(m.group(1)), float(m.group(2))))
+            elif throughput is None and b"simulated years" in line:
+                m = _THROUGHPUT_LINE.search(line)
+                if m:
+                    throughput = float(m.group(1))
+            if not completed and marker in line:
+                completed = True
+
+    summary = CouplerLogSummary(memory, throughput, completed, model_dates, path.endswith(".gz"))
+    with _CACHE_LOCK:
+        _CACHE[path] = (key, summary)
+
+    return summary
+
+def _stream_contains(fd, marker):
+    """
+    Returns whether the bytes read from fd contain marker, reading in chunks
+    """
+    # Carry over enough of the previous read to find a marker split between reads
+    tail = b""
+    while True:
+        chunk = fd.read(_READ_SIZE)
+        if not chunk:
+            return False
+        data = tail + chunk
+        if marker in data:
+            return True
+        tail = data[-(len(marker) - 1):] if len(marker) > 1 else b""
+
+def coupler_log_contains(path, marker=COMPLETION_MARKER):
+    """
+    Returns whether the coupler log at path, which may be gzipped, contains
+    marker. Markers like the completion marker are near the end of the log: an
+    uncompressed log is checked from its last 64 kB before being read in full,
+    and a gzipped one is scanned without splitting it into lines.
+    """
+    if marker == COMPLETION_MARKER:
+        with _CACHE_LOCK:
+            cached = _CACHE.get(path)
+        if cached is not None and cached[0] == _get_cache_key(path):
+            return cached[1].completed
+
+    marker = marker.encode("utf-8")
+    if path.endswith(".gz"):
+        with gzip.open(path, "rb") as fd:
+            return _stream_contains(fd, marker)
+
+    with open(path, "rb") as fd:
+        size = os.fstat(fd.fileno()).st_size
+        if size > _TAIL_SIZE:
+            fd.seek(size - _TAIL_SIZE)
+            if marker in fd.read():
+                return True
+            fd.seek(0)
+        return _stream_contains(fd, marker)
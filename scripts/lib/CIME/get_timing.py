@@ -8,10 +8,109 @@ information from a run.
 from CIME.XML.standard_module_setup import *
 from CIME.utils import safe_copy
 
-import datetime, re
+import csv, datetime, json, re
+from collections import namedtuple
 
 logger = logging.getLogger(__name__)
 
+# Machine-readable formats get_timing can write next to the text summary
+TIMING_FORMATS = ("json", "csv")
+
+# One timer of a timing file. For mct (GPTL) files pets is the number of
+# processes, count is the total number of calls and mean is the total wall
+# time divided by pets. For nuopc (ESMF) files phase and instance are those
+# of the ESM run phase the region was timed in, if any.
+TimingRecord = namedtuple("TimingRecord", ["heading", "phase", "instance", "pets", "count",
+                                           "mean", "min", "max"])
+
+#   "name"  on  processes  threads  count  walltotal  wallmax (proc thrd)  wallmin (proc thrd)
+_MCT_TIMER_LINE = re.compile(r'\s*"([^"]+)"\s+\S\s+(\d+)\s+\d+\s+(\S+)\s+(\S+)\s+(\d*\.\d+)\s*\([^)]*\)\s*(\d*\.\d+)\s*\(')
+#   "name"  on  count ...
+_MCT_COUNT_LINE = re.compile(r'\s*"([^"]+)"\s+\S\s+(\d+)\s')
+#   Region  PETs  Count  Mean (s)  Min (s)  Min PET  Max (s)  Max PET
+_NUOPC_REGION_LINE = re.compile(r'\s*(\S.*?)\s+(\d+)\s+(\d+)\s+(\d*\.\d+)(?:\s+(\d*\.\d+)\s+\d+\s+(\d*\.\d+)\s+\d+)?')
+_NUOPC_ESM_PHASE = re.compile(r'\[ESM(\w+)\] (RunPhase1|Finalize)')
+
+class _TimingTable(object):
+    """
+    The timers of a timing file, read in a single pass over its lines.
+    Lookups return the first record for a heading, as the timing file
+    lists the outermost timer first.
+    """
+
+    def __init__(self, lines, driver):
+        self.records = []
+        self._by_heading = {}
+        if driver == 'mct':
+            self._read_mct(lines)
+        elif driver == 'nuopc':
+            self._read_nuopc(lines)
+
+        for record in self.records:
+            self._by_heading.setdefault(record.heading, []).append(record)
+
+    def _read_mct(self, lines):
+        for line in lines:
+            m = _MCT_TIMER_LINE.match(line)
+            if m:
+                heading, pets, count, walltotal, maxval, minval = m.groups()
+                pets = int(pets)
+                try:
+                    mean = float(walltotal) / pets if pets > 0 else 0.0
+                except ValueError:
+                    mean = None
+                self.records.append(TimingRecord(heading, None, None, pets, int(float(count)),
+                                                 mean, float(minval), float(maxval)))
+            else:
+                m = _MCT_COUNT_LINE.match(line)
+                if m:
+                    self.records.append(TimingRecord(m.group(1), None, None, 1, int(m.group(2)),
+                                                     None, None, None))
+
+    def _read_nuopc(self, lines):
+        phase = None
+        instance = None
+        for line in lines:
+            # Track the ESM phase the regions below a line belong to
+            if "[ensemble] Init 1" in line:
+                phase, instance = "init", None
+            else:
+                m = _NUOPC_ESM_PHASE.search(line)
+                if m and m.group(2) == "RunPhase1":
+                    phase, instance = "run", m.group(1)
+                elif m:
+                    # Finalizing one ESM does not end the run phase of another
+                    if phase != "run" or instance == m.group(1):
+                        phase, instance = "finalize", m.group(1)
+                elif "[ESM" in line and "RunPhase1" in line:
+                    phase, instance = "other", None
+
+            m = _NUOPC_REGION_LINE.match(line)
+            if m:
+                heading, pets, count, mean, minval, maxval = m.groups()
+                self.records.append(TimingRecord(heading, phase, instance, int(pets), int(count), float(mean),
+                                                 None if minval is None else float(minval),
+                                                 None if maxval is None else float(maxval)))
+
+    def get(self, heading, phase=None, instance=None):
+        """
+        Returns the first record for heading, in phase and instance if given, or None
+        """
+        for record in self._by_heading.get(heading, []):
+            if (phase is None or record.phase == phase) and \
+               (instance is None or record.instance == instance):
+                return record
+        return None
+
+    def select(self, heading_regex, phase=None, instance=None):
+        """
+        Returns the records whose heading matches heading_regex, in phase and instance if given
+        """
+        return [record for record in self.records
+                if heading_regex.match(record.heading) and
+                (phase is None or record.phase == phase) and
+                (instance is None or record.instance == instance)]
+
 class _GetTimingInfo:
     def __init__(self, name):
         self.name = name
@@ -20,17 +119,19 @@ class _GetTimingInfo:
         self.adays = 0
 
 class _TimingParser:
-    def __init__(self, case, lid="999999-999999"):
+    def __init__(self, case, lid="999999-999999", formats=None):
         self.case = case
         self.caseroot = case.get_value("CASEROOT")
         self.lid = lid
-        self.finlines = None
+        self.table = None
         self.fout = None
         self.adays=0
         self._driver = case.get_value("COMP_INTERFACE")
         self.models = {}
         self.ncount = 0
         self.nprocs = 0
+        self.formats = [] if formats is None else formats
+        self.summaries = []
 
     def write(self, text):
         self.fout.write(text)
@@ -69,35 +170,19 @@ class _TimingParser:
             return self._gettime2_nuopc()
 
     def _gettime2_mct(self, heading_padded):
-        nprocs = 0
-        ncount = 0
-
-        heading = '"' + heading_padded.strip() + '"'
-        for line in self.finlines:
-            m = re.match(r'\s*{}\s+\S\s+(\d+)\s*\d+\s*(\S+)'.format(heading), line)
-            if m:
-                nprocs = int(float(m.groups()[0]))
-                ncount = int(float(m.groups()[1]))
-                return (nprocs, ncount)
-            else:
-                m = re.match(r'\s*{}\s+\S\s+(\d+)\s'.format(heading), line)
-                if m:
-                    nprocs = 1
-                    ncount = int(float(m.groups()[0]))
-                    return (nprocs, ncount)
+        record = self.table.get(heading_padded.strip())
+        if record is not None:
+            return (record.pets, record.count)
         return (0, 0)
 
     def _gettime2_nuopc(self):
         self.nprocs = 0
         self.ncount = 0
-        expression = re.compile(r'\s*\MED:\s*\(med_phases_profile\)\s+(\d+)\s+(\d+)')
-
-        for line in self.finlines:
-            match = expression.match(line)
-            if match:
-                self.nprocs = int(match.group(1))
-                self.ncount = int(match.group(2))
-                return (self.nprocs, self.ncount)
+        record = self.table.get("MED: (med_phases_profile)")
+        if record is not None:
+            self.nprocs = record.pets
+            self.ncount = record.count
+            return (self.nprocs, self.ncount)
 
         return (0, 0)
 
@@ -107,102 +192,48 @@ class _TimingParser:
         elif self._driver == 'nuopc':
             return self._gettime_nuopc(heading_padded)
 
-
     def _gettime_mct(self, heading_padded):
-        found = False
-        heading = '"' + heading_padded.strip() + '"'
-        minval = 0
-        maxval = 0
-
-        for line in self.finlines:
-            m = re.match(r'\s*{}\s+\S\s+\d+\s*\d+\s*\S+\s*\S+\s*(\d*\.\d+)\s*\(.*\)\s*(\d*\.\d+)\s*\(.*\)'.format(heading), line)
-            if m:
-                maxval = float(m.groups()[0])
-                minval = float(m.groups()[1])
-                found = True
-                return (minval, maxval, found)
+        record = self.table.get(heading_padded.strip())
+        if record is not None and record.max is not None:
+            return (record.min, record.max, True)
         return (0, 0, False)
 
     def _gettime_nuopc(self, heading, instance='0001'):
         if instance == '':
             instance = '0001'
-        minval = 0
-        maxval = 0
-        m = None
-        #  PETs   Count    Mean (s)    Min (s)     Min PET Max (s)     Max PET
-        timeline = re.compile(r'\s*{}\s+\d+\s+\d+\s+(\d*\.\d+)\s+(\d*\.\d+)\s+\d+\s+(\d*\.\d+)\s+\d+'.format(re.escape(heading)))
-        phase = None
-        for line in self.finlines:
-            phase = self._get_nuopc_phase(line, instance, phase)
-            if phase != "run" and not "[ensemble]" in heading:
-                continue
-            if heading in line:
-                m = timeline.match(line)
-                if m:
-                    minval = float(m.group(2))
-                    maxval = float(m.group(3))
-                    return (minval, maxval, True)
+        heading = heading.strip()
+        if "[ensemble]" in heading:
+            record = self.table.get(heading)
+        else:
+            record = self.table.get(heading, phase="run", instance=instance)
+        if record is not None and record.max is not None:
+            return (record.min, record.max, True)
 
         return (0, 0, False)
 
-    @staticmethod
-    def _get_nuopc_phase(line, instance, phase):
-        if "[ensemble] Init 1" in line:
-            phase = "init"
-        elif "[ESM"+instance+"] RunPhase1" in line:
-            phase = "run"
-        elif "[ESM"+instance+"] Finalize" in line:
-            phase = "finalize"
-        elif "[ESM" in line and "RunPhase1" in line:
-            phase = "other"
-        return phase
-
     def getMEDtime(self, instance):
         if instance == '':
             instance = '0001'
-        med_phase_line = re.compile(r'\s*(\[MED\] med_phases\S+)\s+\d+\s+\d+\s+(\d*\.\d+)\s+')
-        med_connector_line = re.compile(r'\s*(\[MED\] med_connectors\S+)\s+\d+\s+\d+\s+(\d*\.\d+)\s+')
-        med_fraction_line = re.compile(r'\s*(\[MED\] med_fraction\S+)\s+\d+\s+\d+\s+(\d*\.\d+)\s+')
+        med_heading = re.compile(r'\[MED\] med_(phases|connectors|fraction)\S+$')
 
-        m = None
         minval = 0
         maxval = 0
-        phase = None
-        for line in self.finlines:
-            phase = self._get_nuopc_phase(line, instance, phase)
-            if phase != "run":
-                continue
-            m = med_phase_line.match(line)
-            if not m:
-                m = med_connector_line.match(line)
-            if not m:
-                m = med_fraction_line.match(line)
-            if m:
-                minval += float(m.group(2))
-                maxval += float(m.group(2))
+        for record in self.table.select(med_heading, phase="run", instance=instance):
+            minval += record.mean
+            maxval += record.mean
 
         return(minval, maxval)
 
     def getCOMMtime(self, instance):
         if instance == '':
             instance = '0001'
-        comm_line = re.compile(r'\s*(\[\S+-TO-\S+\] RunPhase1)\s+\d+\s+\d+\s+(\d*\.\d+)\s+')
-        m = None
+        comm_heading = re.compile(r'\[\S+-TO-\S+\] RunPhase1$')
         maxval = 0
-        phase = None
-        for line in self.finlines:
-            phase = self._get_nuopc_phase(line, instance, phase)
-            if phase != "run":
-                continue
-            m = comm_line.match(line)
-            if m:
-                heading = m.group(1)
-                maxv = float(m.group(2))
-                maxval += maxv
-                logger.debug("{} time={} sum={}".format(heading, maxv, maxval))
+        for record in self.table.select(comm_heading, phase="run", instance=instance):
+            maxval += record.mean
+            logger.debug("{} time={} sum={}".format(record.heading, record.mean, maxval))
         return maxval
 
-
     def getTiming(self):
         ninst = 1
         multi_driver = self.case.get_value("MULTI_DRIVER")
@@ -325,9 +356,8 @@ class _TimingParser:
 
         os.chdir(self.caseroot)
         try:
-            fin = open(finfilename, "r")
-            self.finlines = fin.readlines()
-            fin.close()
+            with open(finfilename, "r") as fin:
+                self.table = _TimingTable(fin, self._driver)
         except Exception as e:
             logger.critical("Unable to open file {}".format(finfilename))
             raise e
@@ -754,6 +784,72 @@ class _TimingParser:
 
         self.fout.close()
 
-def get_timing(case, lid):
-    parser = _TimingParser(case, lid)
+        summary = {"case"         : caseid,
+                   "caseroot"     : self.caseroot,
+                   "lid"          : self.lid,
+                   "instance"     : inst,
+                   "model"        : cime_model,
+                   "driver"       : self._driver,
+                   "machine"      : mach,
+                   "compiler"     : self.case.get_value("COMPILER"),
+                   "mpilib"       : self.case.get_value("MPILIB"),
+                   "user"         : user,
+                   "grid"         : grid,
+                   "compset"      : compset,
+                   "run_type"     : run_type,
+                   "continue_run" : bool(continue_run),
+                   "stop_option"  : stop_option,
+                   "stop_n"       : stop_n,
+                   "model_days"   : adays,
+                   "ocean_days"   : odays,
+                   "total_pes"    : totalpes*maxthrds*smt_factor,
+                   "cost_pes"     : pecost,
+                   "cost"         : (tmax*365.0*pecost)/(3600.0*adays) if adays > 0 else None,
+                   "throughput"   : (86400.0*adays)/(tmax*365.0) if tmax > 0 else None,
+                   "init_time"    : nmax,
+                   "run_time"     : tmax,
+                   "final_time"   : fmax,
+                   "comm_time"    : xmax,
+                   "components"   : {}}
+        for m in self.models.values():
+            summary["components"][m.name] = {"comp"    : m.comp,
+                                             "ntasks"  : m.ntasks,
+                                             "nthrds"  : m.nthrds,
+                                             "rootpe"  : m.rootpe,
+                                             "pstrid"  : m.pstrid,
+                                             "ninst"   : m.ninst,
+                                             "min_time": m.tmin,
+                                             "run_time": m.tmax}
+        self.summaries.append(summary)
+
+        for output_format in self.formats:
+            _write_timing_table(output_format, "{}.{}".format(foutfilename, output_format),
+                                summary, self.table)
+
+def _write_timing_table(output_format, filename, summary, table):
+    """
+    Writes the summary of a run and all the timers of its timing file to filename,
+    as json, or the timers alone as csv
+    """
+    expect(output_format in TIMING_FORMATS, "Unknown timing output format '{}'".format(output_format))
+    with open(filename, "w") as fd:
+        if output_format == "json":
+            contents = dict(summary)
+            contents["timers"] = [dict(zip(TimingRecord._fields, record)) for record in table.records]
+            json.dump(contents, fd, indent=2, sort_keys=True)
+            fd.write("\n")
+        else:
+            writer = csv.writer(fd)
+            writer.writerow(TimingRecord._fields)
+            for record in table.records:
+                writer.writerow(["" if value is None else value for value in record])
+
+def get_timing(case, lid, formats=None):
+    """
+    Writes the timing summary of the run with lid to $CASEROOT/timing, along with
+    a copy of it in each of formats (see TIMING_FORMATS), and returns a summary
+    dict of the run for each instance
+    """
+    parser = _TimingParser(case, lid, formats=formats)
     parser.getTiming()
+    return parser.summaries
@@ -3,9 +3,14 @@ Functions for actions pertaining to history files.
 """
 from CIME.XML.standard_module_setup import *
 from CIME.test_status import TEST_NO_BASELINES_COMMENT, TEST_STATUS_FILENAME
-from CIME.utils import get_current_commit, get_timestamp, get_model, safe_copy, SharedArea, parse_test_name
+from CIME.utils import get_current_commit, get_timestamp, get_model, safe_copy, SharedArea, parse_test_name, \
+    get_cime_config
+from CIME.XML.archive_base import ArchiveDirSnapshot
 
-import logging, os, re, filecmp
+from multiprocessing.pool import ThreadPool
+
+import logging, os, re, filecmp, multiprocessing, threading, signal, subprocess
+import six
 logger = logging.getLogger(__name__)
 
 BLESS_LOG_NAME = "bless_log"
@@ -15,6 +20,13 @@ BLESS_LOG_NAME = "bless_log"
 # ------------------------------------------------------------------------
 
 CPRNC_FIELDLISTS_DIFFER = "files differ only in their field lists"
+CPRNC_STOPPED           = "cprnc stopped at the first difference"
+
+# Summary strings at the end of cprnc output
+_CPRNC_SUMMARIES = ("the two files seem to be DIFFERENT",
+                    "the two files DIFFER only in their field lists",
+                    "files seem to be IDENTICAL",
+                    " 0 had non-zero differences")
 
 # ------------------------------------------------------------------------
 # Strings used in the comments generated by _compare_hists
@@ -24,6 +36,7 @@ NO_COMPARE        = "had no compare counterpart"
 NO_ORIGINAL       = "had no original counterpart"
 FIELDLISTS_DIFFER = "had a different field list from"
 DIFF_COMMENT      = "did NOT match"
+NOT_COMPARED      = "was not compared, after an earlier difference, with"
 # COMPARISON_COMMENT_OPTIONS should include all of the above: these are any of the special
 # comment strings that describe the reason for a comparison failure
 COMPARISON_COMMENT_OPTIONS = set([NO_COMPARE,
@@ -54,11 +67,12 @@ def copy_histfiles(case, suffix):
     casename = case.get_value("CASE")
     # Loop over models
     archive = case.get_env("archive")
+    snapshot = ArchiveDirSnapshot(archive, rundir)
     comments = "Copying hist files to suffix '{}'\n".format(suffix)
     num_copied = 0
     for model in _iter_model_file_substrs(case):
         comments += "  Copying hist files for model '{}'\n".format(model)
-        test_hists = archive.get_latest_hist_files(casename, model, rundir, ref_case=ref_case)
+        test_hists = snapshot.get_latest_hist_files(casename, model, ref_case=ref_case)
         num_copied += len(test_hists)
         for test_hist in test_hists:
             test_hist = os.path.join(rundir,test_hist)
@@ -99,8 +113,10 @@ def rename_all_hist_files(case, suffix):
     ref_case = case.get_value("RUN_REFCASE")
     # Loop over models
     archive = case.get_env("archive")
+    snapshot = ArchiveDirSnapshot(archive, rundir)
     comments = "Renaming hist files by adding suffix '{}'\n".format(suffix)
     num_renamed = 0
+    renamed = set()
     for model in _iter_model_file_substrs(case):
         comments += "  Renaming hist files for model '{}'\n".format(model)
 
@@ -108,8 +124,10 @@ def rename_all_hist_files(case, suffix):
             mname = 'drv'
         else:
             mname = model
-        test_hists = archive.get_all_hist_files(case.get_value("CASE"), mname, rundir, ref_case=ref_case)
+        test_hists = [hist for hist in snapshot.get_all_hist_files(case.get_value("CASE"), mname, ref_case=ref_case)
+                      if hist not in renamed]
         num_renamed += len(test_hists)
+        renamed.update(test_hists)
         for test_hist in test_hists:
             test_hist = os.path.join(rundir, test_hist)
             new_file = "{}.{}".format(test_hist, suffix)
@@ -208,55 +226,122 @@ def _hists_match(model, hists1, hists2, suffix1="", suffix2=""):
 
     return one_not_two, two_not_one, match_ups
 
+def _get_cprnc_workers():
+    """
+    Return how many cprnc comparisons _compare_hists may run at once. Set with
+    CIME_CPRNC_WORKERS in the environment or in the main section of
+    $HOME/.cime/config. The default is up to 4, depending on the cores available.
+    """
+    workers = os.environ.get("CIME_CPRNC_WORKERS")
+    if workers is None:
+        cime_config = get_cime_config()
+        if cime_config.has_option("main", "CIME_CPRNC_WORKERS"):
+            workers = cime_config.get("main", "CIME_CPRNC_WORKERS")
+
+    if workers is None:
+        return min(4, multiprocessing.cpu_count())
+
+    expect(workers.isdigit() and int(workers) > 0, "Invalid CIME_CPRNC_WORKERS '{}'".format(workers))
+    return int(workers)
+
 def _compare_hists(case, from_dir1, from_dir2, suffix1="", suffix2="", outfile_suffix="",
-                   ignore_fieldlist_diffs=False):
+                   ignore_fieldlist_diffs=False, stop_on_diff=False, num_workers=None):
     if from_dir1 == from_dir2:
         expect(suffix1 != suffix2, "Comparing files to themselves?")
 
     casename = case.get_value("CASE")
     testcase = case.get_value("TESTCASE")
     casedir = case.get_value("CASEROOT")
+    cprnc_exe = case.get_value("CCSM_CPRNC")
     all_success = True
     num_compared = 0
     comments = "Comparing hists for case '{}' dir1='{}', suffix1='{}',  dir2='{}' suffix2='{}'\n".format(casename, from_dir1, suffix1, from_dir2, suffix2)
     multiinst_driver_compare = False
     archive = case.get_env('archive')
     ref_case = case.get_value("RUN_REFCASE")
+    snapshot1 = ArchiveDirSnapshot(archive, from_dir1)
+    snapshot2 = snapshot1 if from_dir2 == from_dir1 else ArchiveDirSnapshot(archive, from_dir2)
+
+    # First find everything that needs comparing. Each section is the comments
+    # for a model followed by its file pairs, which are all compared at once below.
+    sections = []
     for model in _iter_model_file_substrs(case):
         if model == 'cpl' and suffix2 == 'multiinst':
             multiinst_driver_compare = True
-        comments += "  comparing model '{}'\n".format(model)
-        hists1 = archive.get_latest_hist_files(casename, model, from_dir1, suffix=suffix1, ref_case=ref_case)
-        hists2 = archive.get_latest_hist_files(casename, model, from_dir2, suffix=suffix2, ref_case=ref_case)
+        model_comments = "  comparing model '{}'\n".format(model)
+        hists1 = snapshot1.get_latest_hist_files(casename, model, suffix=suffix1, ref_case=ref_case)
+        hists2 = snapshot2.get_latest_hist_files(casename, model, suffix=suffix2, ref_case=ref_case)
 
         if len(hists1) == 0 and len(hists2) == 0:
-            comments += "    no hist files found for model {}\n".format(model)
+            model_comments += "    no hist files found for model {}\n".format(model)
+            sections.append((model_comments, []))
             continue
 
         one_not_two, two_not_one, match_ups = _hists_match(model, hists1, hists2, suffix1, suffix2)
         for item in one_not_two:
             if 'initial' in item:
                 continue
-            comments += "    File '{}' {} in '{}' with suffix '{}'\n".format(item, NO_COMPARE, from_dir2, suffix2)
+            model_comments += "    File '{}' {} in '{}' with suffix '{}'\n".format(item, NO_COMPARE, from_dir2, suffix2)
             all_success = False
 
         for item in two_not_one:
             if 'initial' in item:
                 continue
-            comments += "    File '{}' {} in '{}' with suffix '{}'\n".format(item, NO_ORIGINAL, from_dir1, suffix1)
+            model_comments += "    File '{}' {} in '{}' with suffix '{}'\n".format(item, NO_ORIGINAL, from_dir1, suffix1)
             all_success = False
 
         num_compared += len(match_ups)
 
+        jobs = []
         for hist1, hist2 in match_ups:
             if not '.nc' in hist1:
                 logger.info("Ignoring non-netcdf file {}".format(hist1))
                 continue
-            success, cprnc_log_file, cprnc_comment = cprnc(model, os.path.join(from_dir1,hist1),
-                                                           os.path.join(from_dir2,hist2), case, from_dir1,
-                                                           multiinst_driver_compare=multiinst_driver_compare,
-                                                           outfile_suffix=outfile_suffix,
-                                                           ignore_fieldlist_diffs=ignore_fieldlist_diffs)
+            jobs.append((model, hist1, hist2, multiinst_driver_compare))
+
+        sections.append((model_comments, jobs))
+
+    # Any failure so far means the overall result is already known
+    stop_event = threading.Event()
+    if stop_on_diff and not all_success:
+        stop_event.set()
+
+    def compare_one(job):
+        model, hist1, hist2, multiinst = job
+        if stop_event.is_set():
+            return None
+
+        result = cprnc(model, os.path.join(from_dir1,hist1), os.path.join(from_dir2,hist2), case, from_dir1,
+                       multiinst_driver_compare=multiinst, outfile_suffix=outfile_suffix,
+                       ignore_fieldlist_diffs=ignore_fieldlist_diffs, cprnc_exe=cprnc_exe,
+                       stop_on_diff=stop_on_diff)
+        if stop_on_diff and not result[0]:
+            stop_event.set()
+
+        return result
+
+    all_jobs = [job for _, jobs in sections for job in jobs]
+    num_workers = min(_get_cprnc_workers() if num_workers is None else num_workers, len(all_jobs))
+    if num_workers > 1:
+        pool = ThreadPool(num_workers)
+        try:
+            results = pool.map(compare_one, all_jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [compare_one(job) for job in all_jobs]
+
+    results = iter(results)
+    for model_comments, jobs in sections:
+        comments += model_comments
+        for _, hist1, hist2, _ in jobs:
+            result = next(results)
+            if result is None:
+                comments += "    {} {} {}\n".format(hist1, NOT_COMPARED, hist2)
+                continue
+
+            success, cprnc_log_file, cprnc_comment = result
             if success:
                 comments += "    {} matched {}\n".format(hist1, hist2)
             else:
@@ -273,6 +358,7 @@ def _compare_hists(case, from_dir1, from_dir2, suffix1="", suffix2="", outfile_s
                         logger.warning("Could not copy {} to {}".format(cprnc_log_file, casedir))
 
                 all_success = False
+
     # PFS test may not have any history files to compare.
     if num_compared == 0 and testcase != "PFS":
         all_success = False
@@ -282,7 +368,7 @@ def _compare_hists(case, from_dir1, from_dir2, suffix1="", suffix2="", outfile_s
 
     return all_success, comments
 
-def compare_test(case, suffix1, suffix2, ignore_fieldlist_diffs=False):
+def compare_test(case, suffix1, suffix2, ignore_fieldlist_diffs=False, stop_on_diff=False):
     """
     Compares two sets of component history files in the testcase directory
 
@@ -293,16 +379,62 @@ def compare_test(case, suffix1, suffix2, ignore_fieldlist_diffs=False):
         field lists (i.e., all shared fields are bit-for-bit, but one case has some
         diagnostic fields that are missing from the other case), treat the two cases as
         identical.
+    stop_on_diff (bool): If True, stop comparing at the first difference, for when
+        only pass/fail matters; the comments then only describe the files compared up
+        to that point.
 
     returns (SUCCESS, comments)
     """
     rundir   = case.get_value("RUNDIR")
 
     return _compare_hists(case, rundir, rundir, suffix1, suffix2,
-                          ignore_fieldlist_diffs=ignore_fieldlist_diffs)
+                          ignore_fieldlist_diffs=ignore_fieldlist_diffs, stop_on_diff=stop_on_diff)
+
+def _run_cprnc(cprnc_exe, file1, file2, output_filename, diff_markers):
+    """
+    Run cprnc on two files, streaming its output into output_filename (if not
+    None) and scanning it for the cprnc summary strings as it arrives. If
+    diff_markers is not empty, cprnc is stopped as soon as an output line
+    starts with one of them.
+
+    returns (exit status, summary strings found, the last lines of output, stopped early?)
+    """
+    # cprnc_exe may carry a wrapper or arguments, so it goes through the shell.
+    # The shell gets a process group of its own, stopping cprnc stops the group.
+    new_group = {"start_new_session" : True} if six.PY3 else {"preexec_fn" : os.setsid}
+    try:
+        proc = subprocess.Popen("{} -m {} {}".format(cprnc_exe, file1, file2), shell=True, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT, universal_newlines=True, **new_group)
+    except OSError as e:
+        return 1, set(), str(e), False
+
+    summaries = set()
+    tail = []
+    stopped = False
+    fd = None if output_filename is None else open(output_filename, "w")
+    try:
+        for line in iter(proc.stdout.readline, ""):
+            if fd is not None:
+                fd.write(line)
+
+            tail = tail[-49:] + [line]
+            summaries.update(summary for summary in _CPRNC_SUMMARIES if summary in line)
+            if diff_markers and line.startswith(diff_markers):
+                stopped = True
+                os.killpg(proc.pid, signal.SIGKILL)
+                break
+
+        if stopped and fd is not None:
+            fd.write("\n{}\n".format(CPRNC_STOPPED))
+    finally:
+        proc.stdout.close()
+        if fd is not None:
+            fd.close()
+
+    return proc.wait(), summaries, "".join(tail), stopped
 
 def cprnc(model, file1, file2, case, rundir, multiinst_driver_compare=False, outfile_suffix="",
-          ignore_fieldlist_diffs=False, cprnc_exe=None):
+          ignore_fieldlist_diffs=False, cprnc_exe=None, stop_on_diff=False):
     """
     Run cprnc to compare two individual nc files
 
@@ -317,6 +449,8 @@ def cprnc(model, file1, file2, case, rundir, multiinst_driver_compare=False, out
         field lists (i.e., all shared fields are bit-for-bit, but one case has some
         diagnostic fields that are missing from the other case), treat the two cases as
         identical.
+    stop_on_diff (bool): If True, stop cprnc at the first field difference it reports,
+        for when only pass/fail matters. The cprnc output is then incomplete.
 
     returns (True if the files matched, log_name, comment)
         where 'comment' is either an empty string or one of the module-level constants
@@ -343,36 +477,41 @@ def cprnc(model, file1, file2, case, rundir, multiinst_driver_compare=False, out
     if outfile_suffix:
         output_filename += ".{}".format(outfile_suffix)
 
-    if outfile_suffix is None:
-        cpr_stat, out, _ = run_cmd("{} -m {} {}".format(cprnc_exe, file1, file2), combine_output=True)
-    else:
+    # A field with differences gets an RMS line. Fill value and dimension
+    # differences do not fail multiinstance driver compares.
+    diff_markers = ()
+    if stop_on_diff:
+        diff_markers = (" RMS ",) if multiinst_driver_compare else (" RMS ", " FILLDIFF ", " DIMSIZEDIFF ")
+
+    if outfile_suffix is not None and os.path.exists(output_filename):
         # Remove existing output file if it exists
-        if os.path.exists(output_filename):
-            os.remove(output_filename)
+        os.remove(output_filename)
 
-        cpr_stat = run_cmd("{} -m {} {}".format(cprnc_exe, file1, file2), combine_output=True, arg_stdout=output_filename)[0]
-        with open(output_filename, "r") as fd:
-            out = fd.read()
+    cpr_stat, summaries, out, stopped = _run_cprnc(cprnc_exe, file1, file2,
+                                                   None if outfile_suffix is None else output_filename,
+                                                   diff_markers)
 
     comment = ''
-    if cpr_stat == 0:
+    if stopped:
+        files_match = False
+    elif cpr_stat == 0:
         # Successful exit from cprnc
         if multiinst_driver_compare:
             #  In a multiinstance test the cpl hist file will have a different number of
             # dimensions and so cprnc will indicate that the files seem to be DIFFERENT
             # in this case we only want to check that the fields we are able to compare
             # have no differences.
-            files_match = " 0 had non-zero differences" in out
+            files_match = " 0 had non-zero differences" in summaries
         else:
-            if "the two files seem to be DIFFERENT" in out:
+            if "the two files seem to be DIFFERENT" in summaries:
                 files_match = False
-            elif "the two files DIFFER only in their field lists" in out:
+            elif "the two files DIFFER only in their field lists" in summaries:
                 if ignore_fieldlist_diffs:
                     files_match = True
                 else:
                     files_match = False
                     comment = CPRNC_FIELDLISTS_DIFFER
-            elif "files seem to be IDENTICAL" in out:
+            elif "files seem to be IDENTICAL" in summaries:
                 files_match = True
             else:
                 expect(False, "Did not find an expected summary string in cprnc output:\n{}".format(out))
@@ -382,7 +521,7 @@ def cprnc(model, file1, file2, case, rundir, multiinst_driver_compare=False, out
 
     return (files_match, output_filename, comment)
 
-def compare_baseline(case, baseline_dir=None, outfile_suffix=""):
+def compare_baseline(case, baseline_dir=None, outfile_suffix="", stop_on_diff=False):
     """
     compare the current test output to a baseline result
 
@@ -390,6 +529,8 @@ def compare_baseline(case, baseline_dir=None, outfile_suffix=""):
     baseline_dir - Optionally, specify a specific baseline dir, otherwise it will be computed from case config
     outfile_suffix - if non-blank, then the cprnc output file name ends with
         this suffix (with a '.' added before the given suffix). if None, no output file saved.
+    stop_on_diff - if True, stop comparing at the first difference; the comments
+        then only describe the files compared up to that point.
 
     returns (SUCCESS, comments)
     SUCCESS means all hist files matched their corresponding baseline
@@ -407,7 +548,8 @@ def compare_baseline(case, baseline_dir=None, outfile_suffix=""):
         if not os.path.isdir(bdir):
             return False, "ERROR {} baseline directory '{}' does not exist".format(TEST_NO_BASELINES_COMMENT,bdir)
 
-    success, comments = _compare_hists(case, rundir, basecmp_dir, outfile_suffix=outfile_suffix)
+    success, comments = _compare_hists(case, rundir, basecmp_dir, outfile_suffix=outfile_suffix,
+                                       stop_on_diff=stop_on_diff)
     if get_model() == "e3sm":
         bless_log = os.path.join(basecmp_dir, BLESS_LOG_NAME)
         if os.path.exists(bless_log):
@@ -462,10 +604,11 @@ def _generate_baseline_impl(case, baseline_dir=None, allow_baseline_overwrite=Fa
 
     comments = "Generating baselines into '{}'\n".format(basegen_dir)
     num_gen = 0
+    snapshot = ArchiveDirSnapshot(archive, rundir)
     for model in _iter_model_file_substrs(case):
         comments += "  generating for model '{}'\n".format(model)
 
-        hists =  archive.get_latest_hist_files(testcase, model, rundir, ref_case=ref_case)
+        hists =  snapshot.get_latest_hist_files(testcase, model, ref_case=ref_case)
         logger.debug("latest_files: {}".format(hists))
         num_gen += len(hists)
         for hist in hists:
@@ -81,6 +81,15 @@ groups are separated by (optional) whitespace and comments, and nothing else.
 # column numbers for error-reporting purposes. The `_settings` attribute
 # holds the final output, i.e. the variable name-value pairs.
 #
+# `_NamelistParser` moves through the text one character at a time, which is
+# simple but slow for large files. `_FastNamelistParser`, which is what `parse`
+# uses, overrides the low-level methods that scan the text (`_advance`,
+# `_advance_to`, `_eat_whitespace`, `_find_literal_end`, etc.) to skip over a
+# whole token with one regex match, and computes line and column numbers from
+# `_pos` only when an error is reported. The grammar itself is implemented once,
+# in the `_parse_*` methods they share, so both give the same results; the unit
+# tests check this on the namelists in the repository.
+#
 # Parsing errors are signaled by one of two exceptions. The first is
 # `_NamelistParseError`, which always signals an unrecoverable error. This is
 # caught and translated to a user-visible error in `parse`. The second is
@@ -840,11 +849,12 @@ def parse(in_file=None, text=None, groupless=False, convert_tab_to_space=True):
         text = in_file.read()
     if convert_tab_to_space:
         text = text.replace('\t', ' ')
+    parser = _FastNamelistParser(text, groupless)
     try:
-        namelist_dict = _NamelistParser(text, groupless).parse_namelist()
+        namelist_dict = parser.parse_namelist()
     except (_NamelistEOF, _NamelistParseError) as error:
         # Deal with unexpected EOF or other parsing errors.
-        expect(False, str(error))
+        expect(False, "{} at {}".format(error, parser._line_col_string()))
     if groupless:
         return namelist_dict
     else:
@@ -949,11 +959,13 @@ class Namelist(object):
         >>> parse(text='&foo bar=1,2 /').get_variable_value('foO', 'Bar')
         ['1', '2']
         """
-        gn = string_in_list(group_name,self._groups)
+        # Names are unique ignoring case, so an exact match is the only match
+        gn = group_name if group_name in self._groups else string_in_list(group_name,self._groups)
         if gn:
-            vn = string_in_list(variable_name,self._groups[gn])
+            group = self._groups[gn]
+            vn = variable_name if variable_name in group else string_in_list(variable_name,group)
             if vn:
-                return self._groups[gn][vn]
+                return group[vn]
         return ['']
 
     def get_value(self, variable_name):
@@ -1436,6 +1448,24 @@ class _NamelistParser(object): # pylint:disable=too-few-public-methods
         elif end_of_file:
             raise _NamelistEOF(message=None)
 
+    def _advance_to(self, chars):
+        r"""Advance until the current character is one of `chars`.
+
+        Like `_advance`, this raises an exception at the end of file.
+
+        >>> x = _NamelistParser('abc def')
+        >>> x._advance_to(' \n')
+        >>> x._pos
+        3
+        >>> x._advance_to(' \n')
+        >>> x._pos
+        3
+        >>> shouldRaise(_NamelistEOF, x._advance_to, '!')
+
+        """
+        while self._curr() not in chars:
+            self._advance()
+
     def _eat_whitespace(self, allow_initial_comment=False):
         r"""Advance until the next non-whitespace character.
 
@@ -1612,9 +1642,7 @@ class _NamelistParser(object): # pylint:disable=too-few-public-methods
         'foo'
         """
         old_pos = self._pos
-        separators = (' ', '\n', '=', '+') if allow_equals else (' ', '\n')
-        while self._curr() not in separators:
-            self._advance()
+        self._advance_to(" \n=+" if allow_equals else " \n")
         text = self._text[old_pos:self._pos]
         if '(' in text:
             expect(')' in text,"Parsing error ")
@@ -1664,8 +1692,7 @@ class _NamelistParser(object): # pylint:disable=too-few-public-methods
         old_pos = self._pos
         self._advance()
         while True:
-            while self._curr() != delimiter:
-                self._advance()
+            self._advance_to(delimiter)
             # Avoid end-of-file condition.
             if self._pos == self._len - 1:
                 break
@@ -1693,8 +1720,7 @@ class _NamelistParser(object): # pylint:disable=too-few-public-methods
 
         """
         old_pos = self._pos
-        while self._curr() != ')':
-            self._advance()
+        self._advance_to(')')
         text = self._text[old_pos:self._pos+1]
         if not is_valid_fortran_namelist_literal("complex", text):
             raise _NamelistParseError("{!r} is not a valid complex literal".format(str(text)))
@@ -1746,6 +1772,54 @@ class _NamelistParser(object): # pylint:disable=too-few-public-methods
                     break
         return False
 
+    def _at_repeat_prefix(self):
+        """Return whether the text at the current position starts with 'r*'.
+
+        >>> _NamelistParser('6*5 ')._at_repeat_prefix()
+        True
+        >>> _NamelistParser('6.*5 ')._at_repeat_prefix()
+        False
+        """
+        return FORTRAN_REPEAT_PREFIX_REGEX.search(self._text[self._pos:]) is not None
+
+    def _find_literal_end(self, separators):
+        r"""Return the position of the end of a non-delimited literal.
+
+        This is the position of the first character in `separators` after the
+        current position, or the end of the file. Commas inside parentheses do
+        not end the literal.
+
+        >>> _NamelistParser('5, 6')._find_literal_end(' \n,/')
+        1
+        >>> _NamelistParser('nan(1,2) ')._find_literal_end(' \n,/')
+        8
+        >>> _NamelistParser('foo=')._find_literal_end(' \n,/=+')
+        3
+        >>> _NamelistParser('5')._find_literal_end(' \n,/')
+        1
+        """
+        new_pos = self._pos
+        separators = list(separators)
+        while new_pos != self._len and self._text[new_pos] not in separators:
+            # allow commas if they are inside ()
+            if self._text[new_pos] == '(':
+                separators.remove(',')
+            elif self._text[new_pos] == ')':
+                separators.append(',')
+            new_pos += 1
+        return new_pos
+
+    def _is_valid_value(self, text):
+        """Return whether `text` is a valid non-delimited literal.
+
+        >>> _NamelistParser('')._is_valid_value('6*.true.')
+        True
+        >>> _NamelistParser('')._is_valid_value('hamburger')
+        False
+        """
+        return any(is_valid_fortran_namelist_literal(type_, text)
+                   for type_ in ("integer", "logical", "real"))
+
     def _parse_literal(self, allow_name=False, allow_eof_end=False):
         r"""Parse and return a variable value at the current position.
 
@@ -1843,10 +1917,9 @@ class _NamelistParser(object): # pylint:disable=too-few-public-methods
             return ''
         # Deal with a repeated value prefix.
         old_pos = self._pos
-        if FORTRAN_REPEAT_PREFIX_REGEX.search(self._text[self._pos:]):
+        if self._at_repeat_prefix():
             allow_name = False
-            while self._curr() != '*':
-                self._advance()
+            self._advance_to('*')
             if self._advance(check_eof=allow_eof_end):
                 # In case the file ends with the 'r*' form of null value.
                 return self._text[old_pos:]
@@ -1861,19 +1934,7 @@ class _NamelistParser(object): # pylint:disable=too-few-public-methods
             self._advance(check_eof=allow_eof_end)
             return prefix + literal
         # Deal with non-delimited literals.
-        new_pos = self._pos
-        separators = [' ', '\n', ',', '/']
-        if allow_name:
-            separators.append('=')
-            separators.append('+')
-        while new_pos != self._len and self._text[new_pos] not in separators:
-            # allow commas if they are inside ()
-            if self._text[new_pos] == '(':
-                separators.remove(',')
-            elif self._text[new_pos] == ')':
-                separators.append(',')
-            new_pos += 1
-
+        new_pos = self._find_literal_end(" \n,/=+" if allow_name else " \n,/")
         if not allow_eof_end and new_pos == self._len:
             # At the end of the file, give up by throwing an EOF.
             self._advance(self._len)
@@ -1886,8 +1947,7 @@ class _NamelistParser(object): # pylint:disable=too-few-public-methods
 
         self._advance(new_pos - self._pos, check_eof=allow_eof_end)
         text = self._text[old_pos:self._pos]
-        if not any(is_valid_fortran_namelist_literal(type_, text)
-                   for type_ in ("integer", "logical", "real")):
+        if not self._is_valid_value(text):
             raise _NamelistParseError("expected literal value, but got {!r}".format(str(text)))
         return text
 
@@ -2237,3 +2297,150 @@ class _NamelistParser(object): # pylint:disable=too-few-public-methods
                 self._eat_whitespace(allow_initial_comment=True)
             except _NamelistEOF:
                 return self._settings
+
+
+# Regular expressions used by `_FastNamelistParser` to move over whole tokens.
+_WHITESPACE_REGEX = re.compile(r"[ \n]*")
+# `FORTRAN_REPEAT_PREFIX_REGEX` without the anchor, for use with `match(text, pos)`.
+_REPEAT_PREFIX_REGEX = re.compile(r"[0-9]*[1-9]+[0-9]*\*")
+_SCAN_REGEXES = {}
+# The types of non-delimited literals.
+_VALUE_REGEXES = tuple(FORTRAN_LITERAL_REGEXES[type_] for type_ in ("integer", "logical", "real"))
+
+def _get_scan_regex(chars):
+    r"""Return a compiled regex matching a run of characters not in `chars`.
+
+    >>> _get_scan_regex(' \n').match('abc def').end()
+    3
+    """
+    regex = _SCAN_REGEXES.get(chars)
+    if regex is None:
+        regex = re.compile("[^{}]*".format("".join(re.escape(char) for char in chars)))
+        _SCAN_REGEXES[chars] = regex
+    return regex
+
+
+class _FastNamelistParser(_NamelistParser): # pylint:disable=too-few-public-methods
+
+    r"""Namelist parser that moves over whole tokens at a time.
+
+    `_NamelistParser` steps through the text one character at a time and keeps
+    track of the line and column as it goes. This class parses the same
+    grammar, with the same results and errors, but finds the end of each run of
+    whitespace, comment, name or literal with a single regex match or string
+    search, and only works out the line and column when asked for them (i.e.
+    when reporting an error). `parse` uses this class; `_NamelistParser`
+    remains the reference implementation.
+
+    >>> _FastNamelistParser("&group1\n foo='bar','bazz'\n,, foo2=2*5\n / &group2 /").parse_namelist()
+    OrderedDict([('group1', {'foo': ["'bar'", "'bazz'", ''], 'foo2': ['5', '5']}), ('group2', {})])
+    >>> _FastNamelistParser("!blah \n foo='bar', 'bazz'\n foo+='ban'", groupless=True).parse_namelist()
+    OrderedDict([('foo', ["'bar'", "'bazz'", "'ban'"])])
+    """
+
+    def _line_col_string(self):
+        r"""Return a string specifying the current line and column number.
+
+        >>> x = _FastNamelistParser('abc\nd\nef')
+        >>> x._advance(5)
+        >>> x._line_col_string()
+        'line 2, column 1'
+        """
+        line = self._text.count('\n', 0, self._pos) + 1
+        col = self._pos - (self._text.rfind('\n', 0, self._pos) + 1)
+        return "line {}, column {}".format(line, col)
+
+    def _advance(self, nchars=1, check_eof=False):
+        """Advance the current position by `nchars` characters.
+
+        This behaves as `_NamelistParser._advance`, without tracking the line
+        and column.
+
+        >>> x = _FastNamelistParser('ab')
+        >>> x._advance(check_eof=True)
+        False
+        >>> x._advance(check_eof=True)
+        True
+        >>> shouldRaise(_NamelistEOF, _FastNamelistParser('ab')._advance, 2)
+
+        """
+        assert nchars >= 0, \
+            "_NamelistParser attempted to 'advance' backwards"
+        self._pos = min(self._pos + nchars, self._len)
+        end_of_file = self._pos == self._len
+        if check_eof:
+            return end_of_file
+        elif end_of_file:
+            raise _NamelistEOF(message=None)
+
+    def _advance_to(self, chars):
+        """Advance until the current character is one of `chars`."""
+        self._advance(_get_scan_regex(chars).match(self._text, self._pos).end() - self._pos)
+
+    def _eat_whitespace(self, allow_initial_comment=False):
+        r"""Advance until the next non-whitespace character.
+
+        >>> x = _FastNamelistParser(' \n! blah\n ! blah\n a')
+        >>> x._eat_whitespace()
+        True
+        >>> x._curr()
+        'a'
+        >>> x = _FastNamelistParser(' ! blah\n a')
+        >>> x._eat_whitespace()
+        True
+        >>> x._curr()
+        '!'
+        """
+        eaten = False
+        comment_allowed = allow_initial_comment
+        while True:
+            end = _WHITESPACE_REGEX.match(self._text, self._pos).end()
+            if end > self._pos:
+                comment_allowed |= self._text.find('\n', self._pos, end) != -1
+                eaten = True
+                self._advance(end - self._pos)
+            # Note the reliance on short-circuit `and` here.
+            if not (comment_allowed and self._eat_comment()):
+                break
+        return eaten
+
+    def _eat_comment(self):
+        """If currently positioned at a '!', advance past the comment's end."""
+        if self._curr() != '!':
+            return False
+        newline_pos = self._text.find('\n', self._pos)
+        if newline_pos == -1:
+            # This is the last line.
+            self._advance(self._len - self._pos)
+        else:
+            # Advance to the first character of the next line.
+            self._advance(newline_pos + 1 - self._pos)
+        return True
+
+    def _look_ahead_for_equals(self, pos):
+        """Look ahead to see if the next non-whitespace character is '='."""
+        pos = _WHITESPACE_REGEX.match(self._text, pos).end()
+        return self._text.startswith('=', pos)
+
+    def _look_ahead_for_plusequals(self, pos):
+        """Look ahead to see if the next two non-whitespace characters are '+='."""
+        pos = _WHITESPACE_REGEX.match(self._text, pos).end()
+        return self._text.startswith('+', pos) and self._look_ahead_for_equals(pos + 1)
+
+    def _at_repeat_prefix(self):
+        """Return whether the text at the current position starts with 'r*'."""
+        return _REPEAT_PREFIX_REGEX.match(self._text, self._pos) is not None
+
+    def _find_literal_end(self, separators):
+        """Return the position of the end of a non-delimited literal."""
+        new_pos = _get_scan_regex(separators + '(').match(self._text, self._pos).end()
+        # Parentheses change which separators apply, which only the
+        # character-by-character search deals with.
+        if self._text.startswith('(', new_pos):
+            return super(_FastNamelistParser, self)._find_literal_end(separators)
+        return new_pos
+
+    def _is_valid_value(self, text):
+        """Return whether `text` is a valid non-delimited literal."""
+        string = fortran_namelist_base_value(text)
+        return string == '' or any(regex.search(string) is not None for regex in _VALUE_REGEXES)
@@ -6,7 +6,6 @@
 # Disable these because this is our standard setup
 # pylint: disable=wildcard-import,unused-wildcard-import
 
-import datetime
 import re
 import hashlib
 
@@ -24,6 +23,15 @@ _var_ref_re = re.compile(r"\$(\{)?(?P<name>\w+)(?(1)\})")
 
 _ymd_re = re.compile(r"%(?P<digits>[1-9][0-9]*)?y(?P<month>m(?P<day>d)?)?")
 
+# What follows the year in the dates %ym and %ymd expand to, in order, for a
+# no-leap year
+_month_suffixes = tuple("-{:02d}".format(month) for month in range(1, 13))
+_day_suffixes = tuple("-{:02d}-{:02d}".format(month, day)
+                      for month, days in enumerate((31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31), 1)
+                      for day in range(1, days+1))
+
+_stream_filenames_re = re.compile(r"\{(domain_filenames|data_filenames)\}")
+
 _stream_mct_file_template = """<?xml version="1.0"?>
 <file id="stream" version="1.0">
 <dataSource>
@@ -116,8 +124,6 @@ class NamelistGenerator(object):
         # first clean out any settings left over from previous calls
         self.new_instance()
 
-        self._definition.set_nodes(skip_groups=skip_groups)
-
         # Determine the array of entry nodes that will be acted upon
         self._default_nodes = self._definition.set_nodes(skip_groups=skip_groups)
 
@@ -397,23 +403,6 @@ class NamelistGenerator(object):
                 new_lines.append(line)
         return "\n".join(new_lines)
 
-    @staticmethod
-    def _days_in_month(month, year=1):
-        """Number of days in the given month (specified as an int, 1-12).
-
-        The `year` argument gives the year for which to request the number of
-        days, in a Gregorian calendar. Defaults to `1` (not a leap year).
-        """
-        month_start = datetime.date(year, month, 1)
-        if month == 12:
-            next_year = year+1
-            next_month = 1
-        else:
-            next_year = year
-            next_month = month + 1
-        next_month_start = datetime.date(next_year, next_month, 1)
-        return (next_month_start - month_start).days
-
     def _sub_paths(self, filenames, year_start, year_end):
         """Substitute indicators with given values in a list of filenames.
 
@@ -441,35 +430,40 @@ class NamelistGenerator(object):
 
         Returns a string (filenames separated by newlines).
         """
-        lines = [line for line in filenames.split("\n") if line]
-        new_lines = []
-        for line in lines:
-            match = _ymd_re.search(filenames)
+        return "\n".join(self.iter_sub_paths(filenames, year_start, year_end))
+
+    @staticmethod
+    def iter_sub_paths(filenames, year_start, year_end):
+        """Generate the filenames `_sub_paths` returns one at a time.
+
+        Daily files over a few centuries are hundreds of thousands of names, so
+        this lets them be written out or checked without building them all
+        first.
+
+        >>> list(NamelistGenerator.iter_sub_paths("clim.nc\\nf.%2ym.nc", 1, 1))[:4]
+        ['clim.nc', 'f.01-01.nc', 'f.01-02.nc', 'f.01-03.nc']
+        >>> len(list(NamelistGenerator.iter_sub_paths("f.%ymd.nc", 1850, 2014)))
+        60225
+        """
+        for line in filenames.split("\n"):
+            if not line:
+                continue
+            match = _ymd_re.search(line)
             if match is None:
-                new_lines.append(line)
+                yield line
                 continue
-            if match.group('digits'):
-                year_format = "{:0"+match.group('digits')+"d}"
+            parts = line.split(match.group(0))
+            year_format = "{:0" + (match.group('digits') or "4") + "d}"
+            if match.group('day'):
+                suffixes = _day_suffixes
+            elif match.group('month'):
+                suffixes = _month_suffixes
             else:
-                year_format = "{:04d}"
+                suffixes = ("",)
             for year in range(year_start, year_end+1):
-                if match.group('day'):
-                    for month in range(1, 13):
-                        days = self._days_in_month(month)
-                        for day in range(1, days+1):
-                            date_string = (year_format + "-{:02d}-{:02d}").format(year, month, day)
-                            new_line = line.replace(match.group(0), date_string)
-                            new_lines.append(new_line)
-                elif match.group('month'):
-                    for month in range(1, 13):
-                        date_string = (year_format + "-{:02d}").format(year, month)
-                        new_line = line.replace(match.group(0), date_string)
-                        new_lines.append(new_line)
-                else:
-                    date_string = year_format.format(year)
-                    new_line = line.replace(match.group(0), date_string)
-                    new_lines.append(new_line)
-        return "\n".join(new_lines)
+                year_string = year_format.format(year)
+                for suffix in suffixes:
+                    yield (year_string + suffix).join(parts)
 
     @staticmethod
     def _add_xml_delimiter(list_to_deliminate, delimiter):
@@ -480,6 +474,23 @@ class NamelistGenerator(object):
             list_to_deliminate[n] = pred + list_to_deliminate[n].strip() + postd
         return "\n      ".join(list_to_deliminate)
 
+    @staticmethod
+    def _write_stream_file(stream_path, filenames, **fields):
+        """Write a stream file from `_stream_mct_file_template`.
+
+        `filenames` maps the `domain_filenames` and `data_filenames` fields to
+        iterables of names, which are written out one per line as they are
+        produced rather than joined first.
+        """
+        pieces = _stream_filenames_re.split(_stream_mct_file_template)
+        with open(stream_path, 'w') as stream_file:
+            for i, piece in enumerate(pieces):
+                if i % 2 == 0:
+                    stream_file.write(piece.format(**fields))
+                else:
+                    names = iter(filenames[piece])
+                    stream_file.write(next(names, ""))
+                    stream_file.writelines("\n" + name for name in names)
 
     def create_stream_file_and_update_shr_strdata_nml(self, config, caseroot, #pylint:disable=too-many-locals
                            stream, stream_path, data_list_path):
@@ -510,8 +521,8 @@ class NamelistGenerator(object):
             strmobj = Stream(infile=stream_path)
             domain_filepath = strmobj.get_value("domainInfo/filePath")
             data_filepath = strmobj.get_value("fieldInfo/filePath")
-            domain_filenames = strmobj.get_value("domainInfo/fileNames")
-            data_filenames = strmobj.get_value("fieldInfo/fileNames")
+            domain_filenames = strmobj.get_value("domainInfo/fileNames").split("\n")
+            data_filenames = strmobj.get_value("fieldInfo/fileNames").split("\n")
         else:
             # Figure out the details of this stream.
             if stream in ("prescribed", "copyall"):
@@ -531,30 +542,33 @@ class NamelistGenerator(object):
             offset = self.get_default("strm_offset", config)
             year_start = int(self.get_default("strm_year_start", config))
             year_end = int(self.get_default("strm_year_end", config))
-            data_filenames = self._sub_paths(data_filenames, year_start, year_end)
-            domain_filenames = self._sub_paths(domain_filenames, year_start, year_end)
+            data_template = data_filenames
+            domain_template = domain_filenames
 
             # Overwrite domain_file if should be set from stream data
-            if domain_filenames == 'null':
+            if [line for line in domain_template.split("\n") if line] == ['null']:
                 domain_filepath = data_filepath
-                domain_filenames = data_filenames.splitlines()[0]
-
-            stream_file_text = _stream_mct_file_template.format(
+                domain_template = next(self.iter_sub_paths(data_template, year_start, year_end))
+
+            # The file names are expanded as they are written, here and again
+            # for the input data list, rather than held in memory; the stream
+            # file readers take one name per line, with no range notation.
+            self._write_stream_file(
+                stream_path,
+                {"domain_filenames" : self.iter_sub_paths(domain_template, year_start, year_end),
+                 "data_filenames" : self.iter_sub_paths(data_template, year_start, year_end)},
                 domain_varnames=domain_varnames,
                 domain_filepath=domain_filepath,
-                domain_filenames=domain_filenames,
                 data_varnames=data_varnames,
                 data_filepath=data_filepath,
-                data_filenames=data_filenames,
                 offset=offset,
             )
-
-            with open(stream_path, 'w') as stream_file:
-                stream_file.write(stream_file_text)
+            domain_filenames = self.iter_sub_paths(domain_template, year_start, year_end)
+            data_filenames = self.iter_sub_paths(data_template, year_start, year_end)
 
         lines_hash = self._get_input_file_hash(data_list_path)
         with open(data_list_path, 'a') as input_data_list:
-            for i, filename in enumerate(domain_filenames.split("\n")):
+            for i, filename in enumerate(domain_filenames):
                 if filename.strip() == '':
                     continue
                 filepath, filename = os.path.split(filename)
@@ -564,7 +578,7 @@ class NamelistGenerator(object):
                 hashValue = hashlib.md5(string.rstrip().encode('utf-8')).hexdigest()
                 if hashValue not in lines_hash:
                     input_data_list.write(string)
-            for i, filename in enumerate(data_filenames.split("\n")):
+            for i, filename in enumerate(data_filenames):
                 if filename.strip() == '':
                     continue
                 filepath = os.path.join(data_filepath, filename.strip())
@@ -0,0 +1,290 @@
+"""
+A local database of model performance. Every run that goes through get_timing
+records its throughput, cost and component run times, keyed by case, compset,
+grid, PE layout, machine and source commit, so that performance can be
+compared across runs without going back to the timing files.
+
+The database is a single SQLite file, by default ~/.cime/perf-history.db.
+Set CIME_PERF_HISTORY_DB in the environment or PERF_HISTORY_DB in the main
+section of ~/.cime/config to use another file, or to an empty value to stop
+recording.
+"""
+
+from CIME.XML.standard_module_setup import *
+from CIME.utils import SharedArea, get_cime_config, get_current_commit
+
+import datetime, json, sqlite3, sys
+from collections import namedtuple
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+_PERF_DB_DEFAULT = os.path.join("~", ".cime", "perf-history.db")
+_PERF_DB_TIMEOUT = 120 # seconds to wait for other writers
+_PERF_DB_SCHEMA  = """
+CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY, run_date TEXT NOT NULL,
+                                 caseroot TEXT, case_name TEXT, lid TEXT, instance INTEGER,
+                                 test TEXT, machine TEXT, compiler TEXT, mpilib TEXT,
+                                 compset TEXT, grid TEXT, pe_layout TEXT, commit_id TEXT,
+                                 total_pes INTEGER, cost_pes INTEGER, model_days REAL,
+                                 throughput REAL, cost REAL, init_time REAL, run_time REAL,
+                                 final_time REAL, comm_time REAL);
+CREATE INDEX IF NOT EXISTS runs_by_config ON runs (compset, grid, machine, pe_layout);
+CREATE INDEX IF NOT EXISTS runs_by_run ON runs (caseroot, lid, instance);
+CREATE TABLE IF NOT EXISTS component_times (run_id INTEGER NOT NULL, component TEXT NOT NULL,
+                                            comp TEXT, ntasks INTEGER, nthrds INTEGER, rootpe INTEGER,
+                                            pstrid INTEGER, ninst INTEGER, run_time REAL);
+CREATE INDEX IF NOT EXISTS component_times_by_run ON component_times (run_id);
+"""
+
+_RUN_COLUMNS = ("id", "run_date", "caseroot", "case_name", "lid", "instance", "test", "machine",
+                "compiler", "mpilib", "compset", "grid", "pe_layout", "commit_id", "total_pes",
+                "cost_pes", "model_days", "throughput", "cost", "init_time", "run_time",
+                "final_time", "comm_time")
+
+# One row of the runs table. throughput is in simulated years per day, cost in
+# pe-hours per simulated year and times in seconds.
+PerfRecord = namedtuple("PerfRecord", _RUN_COLUMNS)
+
+# The columns query_run_performance can filter on
+PERF_FILTERS = ("case_name", "test", "machine", "compiler", "mpilib", "compset", "grid",
+                "pe_layout", "commit_id")
+
+def get_perf_history_db():
+    """
+    Returns the path of the performance database, or None if recording is off
+    """
+    db_path = os.environ.get("CIME_PERF_HISTORY_DB")
+    if db_path is None:
+        cime_config = get_cime_config()
+        if cime_config.has_option("main", "PERF_HISTORY_DB"):
+            db_path = cime_config.get("main", "PERF_HISTORY_DB")
+        else:
+            db_path = _PERF_DB_DEFAULT
+
+    return os.path.expanduser(db_path) if db_path else None
+
+def get_pe_layout(components):
+    """
+    Returns a string describing the PE layout of components, the "components"
+    dict of a get_timing summary
+
+    >>> get_pe_layout({"ATM" : {"ntasks" : 64, "nthrds" : 2, "rootpe" : 0, "pstrid" : 1, "ninst" : 1},
+    ...                "CPL" : {"ntasks" : 32, "nthrds" : 1, "rootpe" : 0, "pstrid" : 1, "ninst" : 1},
+    ...                "OCN" : {"ntasks" : 16, "nthrds" : 1, "rootpe" : 64, "pstrid" : 2, "ninst" : 3}})
+    'ATM:64x2@0 CPL:32x1@0 OCN:16x1@64/2*3'
+    """
+    layout = []
+    for name in sorted(components):
+        comp = components[name]
+        item = "{}:{:d}x{:d}@{:d}".format(name, comp["ntasks"], comp["nthrds"], comp["rootpe"])
+        if comp["pstrid"] != 1:
+            item += "/{:d}".format(comp["pstrid"])
+        if comp["ninst"] != 1:
+            item += "*{:d}".format(comp["ninst"])
+        layout.append(item)
+
+    return " ".join(layout)
+
+def _open_perf_db(db_path, create=False):
+    """
+    Return a connection to the performance database at db_path. If there is no
+    database yet, return None or, if create, make one.
+    """
+    if not create and not os.path.exists(db_path):
+        return None
+
+    db_dir = os.path.dirname(db_path)
+    if db_dir and not os.path.isdir(db_dir):
+        os.makedirs(db_dir)
+
+    # isolation_level=None: transactions are explicit, see _perf_db_transaction
+    conn = sqlite3.connect(db_path, timeout=_PERF_DB_TIMEOUT, isolation_level=None)
+    conn.executescript(_PERF_DB_SCHEMA)
+    return conn
+
+@contextmanager
+def _perf_db_transaction(db_path):
+    """
+    Yield a connection to the (possibly new) performance database at db_path
+    with a write transaction open
+    """
+    with SharedArea():
+        conn = _open_perf_db(db_path, create=True)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            else:
+                conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+def _get_run_date(lid):
+    """
+    Returns the date of the run with lid, or now if lid is not a date
+
+    >>> _get_run_date("201017-143000")
+    '2020-10-17 14:30:00'
+    """
+    try:
+        run_date = datetime.datetime.strptime(lid, "%y%m%d-%H%M%S")
+    except ValueError:
+        run_date = datetime.datetime.now()
+
+    return run_date.strftime("%Y-%m-%d %H:%M:%S")
+
+def _insert_run(conn, summary, commit, test):
+    """
+    Insert the run described by get_timing summary, replacing any earlier
+    record of the same run
+    """
+    key = (summary.get("caseroot"), summary["lid"], summary["instance"])
+    old_ids = [row[0] for row in conn.execute("SELECT id FROM runs WHERE caseroot IS ? AND lid = ? AND instance = ?", key)]
+    for old_id in old_ids:
+        conn.execute("DELETE FROM component_times WHERE run_id = ?", (old_id,))
+        conn.execute("DELETE FROM runs WHERE id = ?", (old_id,))
+
+    components = summary["components"]
+    values = (_get_run_date(summary["lid"]), summary.get("caseroot"), summary["case"], summary["lid"], summary["instance"],
+              test, summary["machine"], summary.get("compiler"), summary.get("mpilib"),
+              summary["compset"], summary["grid"], get_pe_layout(components), commit,
+              summary["total_pes"], summary["cost_pes"], summary["model_days"], summary["throughput"],
+              summary["cost"], summary["init_time"], summary["run_time"], summary["final_time"],
+              summary["comm_time"])
+    run_id = conn.execute("INSERT INTO runs ({}) VALUES ({})".format(", ".join(_RUN_COLUMNS[1:]),
+                                                                   ", ".join("?" * len(values))), values).lastrowid
+
+    conn.executemany("INSERT INTO component_times (run_id, component, comp, ntasks, nthrds, rootpe, pstrid, ninst, run_time) "
+                     "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                     [(run_id, name, comp["comp"], comp["ntasks"], comp["nthrds"], comp["rootpe"],
+                       comp["pstrid"], comp["ninst"], comp["run_time"]) for name, comp in sorted(components.items())])
+
+def record_run_performance(db_path, summaries, commit=None, test=None):
+    """
+    Store the runs described by summaries, as returned by get_timing or read
+    back from its json output, in the performance database at db_path
+    """
+    with _perf_db_transaction(db_path) as conn:
+        for summary in summaries:
+            _insert_run(conn, summary, commit, test)
+
+def save_run_performance(case, summaries):
+    """
+    Store the runs of case described by summaries, as returned by get_timing,
+    in the performance database, if recording is on
+    """
+    db_path = get_perf_history_db()
+    if db_path is not None and summaries:
+        try:
+            srcroot = case.get_value("SRCROOT")
+            commit = get_current_commit(repo=srcroot) if srcroot and os.path.isdir(srcroot) else None
+            test = case.get_value("CASEBASEID") if case.get_value("TEST") else None
+            record_run_performance(db_path, summaries, commit=commit, test=test)
+
+        except Exception:
+            # We NEVER want a failure here to kill the run
+            logger.warning("Failed to store run performance: {}".format(sys.exc_info()[1]))
+
+def import_timing_files(db_path, json_files):
+    """
+    Store the runs in json_files, written by getTiming --format json, in the
+    performance database at db_path. Returns the number of runs stored.
+    """
+    summaries = []
+    for json_file in json_files:
+        with open(json_file, "r") as fd:
+            summaries.append(json.load(fd))
+
+    record_run_performance(db_path, summaries)
+    return len(summaries)
+
+def query_run_performance(db_path, since=None, limit=None, **filters):
+    """
+    Returns the PerfRecords of the runs matching filters (see PERF_FILTERS), in
+    the order they ran. since is a date string (YYYY-MM-DD) and limit keeps
+    only the most recent runs.
+    """
+    conn = _open_perf_db(db_path)
+    if conn is None:
+        return []
+
+    conditions = []
+    params = []
+    for column, value in sorted(filters.items()):
+        if value is not None:
+            expect(column in PERF_FILTERS, "Cannot filter runs on '{}'".format(column))
+            conditions.append("{} = ?".format(column))
+            params.append(value)
+    if since is not None:
+        conditions.append("run_date >= ?")
+        params.append(since)
+
+    query = "SELECT {} FROM runs".format(", ".join(_RUN_COLUMNS))
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY run_date, id"
+    try:
+        records = [PerfRecord(*row) for row in conn.execute(query, params)]
+    finally:
+        conn.close()
+
+    return records[-limit:] if limit else records
+
+def get_component_times(db_path, records):
+    """
+    Returns {run id -> {component -> run time}} for records
+    """
+    result = dict((record.id, {}) for record in records)
+    conn = _open_perf_db(db_path)
+    if conn is None:
+        return result
+
+    try:
+        ids = list(result.keys())
+        # Stay below SQLite's limit on query parameters
+        for idx in range(0, len(ids), 500):
+            chunk = ids[idx:idx + 500]
+            for run_id, component, run_time in conn.execute(
+                    "SELECT run_id, component, run_time FROM component_times WHERE run_id IN ({})".format(",".join("?" * len(chunk))), chunk):
+                result[run_id][component] = run_time
+    finally:
+        conn.close()
+
+    return result
+
+def find_throughput_regressions(records, window=5, threshold=0.1):
+    """
+    Returns a (record, reference throughput) pair for each of records whose
+    throughput is more than threshold (a fraction) below the median of the
+    window runs before it with the same compset, grid, machine, compiler and
+    PE layout. records must be in the order they ran.
+
+    >>> def run(idx, tput, grid="f19_g16"):
+    ...     return PerfRecord(idx, "", "", "c", "", 0, None, "m", "gnu", "mpi", "X", grid, "L", None,
+    ...                       1, 1, 1, tput, 1, 1, 1, 1, 1)
+    >>> runs = [run(1, 10.0), run(2, 10.4), run(3, 5.0, grid="f09_g16"), run(4, 9.8), run(5, 8.0)]
+    >>> [(record.id, reference) for record, reference in find_throughput_regressions(runs)]
+    [(5, 10.0)]
+    """
+    previous = {}
+    regressions = []
+    for record in records:
+        if record.throughput is None:
+            continue
+
+        config = (record.compset, record.grid, record.machine, record.compiler, record.pe_layout)
+        history = previous.setdefault(config, [])
+        if history:
+            recent = sorted(history[-window:])
+            middle = len(recent) // 2
+            reference = recent[middle] if len(recent) % 2 else (recent[middle - 1] + recent[middle]) / 2.0
+            if record.throughput < reference * (1.0 - threshold):
+                regressions.append((record, reference))
+
+        history.append(record.throughput)
+
+    return regressions
@@ -7,7 +7,9 @@ Library for saving build/run provenance.
 from CIME.XML.standard_module_setup import *
 from CIME.utils import touch, gzip_existing_file, SharedArea, convert_to_babylonian_time, get_current_commit, get_current_submodule_status, indent_string, run_cmd, run_cmd_no_fail, safe_copy
 
-import tarfile, getpass, signal, glob, shutil, sys
+import tarfile, getpass, signal, glob, shutil, sys, math, sqlite3
+from collections import namedtuple
+from contextlib import contextmanager
 
 logger = logging.getLogger(__name__)
 
@@ -424,59 +426,304 @@ def save_postrun_provenance(case, lid=None):
         elif model == "cesm":
             _save_postrun_provenance_cesm(case, lid)
 
+# Test history (walltimes, success transitions, phase timings, and throughput
+# and memory samples of baselines) is kept in a single SQLite database in the
+# baseline area. Older CIME versions used one small text file per test, those
+# are still read for tests the database does not know yet and are imported the
+# first time such a test is recorded.
+_HISTORY_DB_NAME        = "test-history.db"
+_HISTORY_DB_TIMEOUT     = 120 # seconds to wait for other writers
+_HISTORY_DB_SCHEMA      = """
+CREATE TABLE IF NOT EXISTS walltimes   (test TEXT NOT NULL, seconds INTEGER NOT NULL, commit_id TEXT);
+CREATE INDEX IF NOT EXISTS walltimes_by_test ON walltimes (test);
+CREATE TABLE IF NOT EXISTS success     (test TEXT PRIMARY KEY, last_pass TEXT, last_fail_transition TEXT);
+CREATE TABLE IF NOT EXISTS phase_times (test TEXT NOT NULL, phase TEXT NOT NULL, seconds REAL NOT NULL, procs INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS phase_times_by_test ON phase_times (test, phase);
+CREATE TABLE IF NOT EXISTS perf_samples (baseline TEXT NOT NULL, metric TEXT NOT NULL, value REAL NOT NULL, commit_id TEXT);
+CREATE INDEX IF NOT EXISTS perf_samples_by_baseline ON perf_samples (baseline, metric);
+"""
+_HISTORY_LEN            = 10  # Estimates only use this many of the most recent records
+_HISTORY_QUERY_CHUNK    = 500 # Stay below SQLite's limit on query parameters
+_PERF_SAMPLE_WINDOW     = 20  # Baseline comparisons only use this many of the most recent samples
+
 _WALLTIME_BASELINE_NAME = "walltimes"
 _WALLTIME_FILE_NAME     = "walltimes"
 _GLOBAL_MINUMUM_TIME    = 900
 _GLOBAL_WIGGLE          = 1000
 _WALLTIME_TOLERANCE     = ( (600, 2.0), (1800, 1.5), (9999999999, 1.25) )
 
+TestTimeStats = namedtuple("TestTimeStats", ["count", "last", "median", "p90"])
+
+def _open_history_db(baseline_root, create=False):
+    """
+    Return a connection to the test history database of baseline_root. If
+    there is no database yet, return None or, if create, make one.
+    """
+    the_path = os.path.join(baseline_root, _HISTORY_DB_NAME)
+    if not create and not os.path.exists(the_path):
+        return None
+
+    if not os.path.isdir(baseline_root):
+        os.makedirs(baseline_root)
+
+    # isolation_level=None: transactions are explicit, see _history_db_transaction
+    conn = sqlite3.connect(the_path, timeout=_HISTORY_DB_TIMEOUT, isolation_level=None)
+    conn.executescript(_HISTORY_DB_SCHEMA)
+    return conn
+
+@contextmanager
+def _history_db_transaction(baseline_root):
+    """
+    Yield a connection to the (possibly new) history database of baseline_root
+    with a write transaction open. Other writers wait for it to commit, which
+    makes read-modify-write updates safe.
+    """
+    with SharedArea():
+        conn = _open_history_db(baseline_root, create=True)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            else:
+                conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+def _query_by_test(conn, query, tests):
+    """
+    Run query, which must select test as its first column and contain one
+    "{}" where the list of test placeholders goes, for all tests, in chunks.
+    Rows are returned in insertion order.
+    """
+    tests = list(tests)
+    rows = []
+    for idx in range(0, len(tests), _HISTORY_QUERY_CHUNK):
+        chunk = tests[idx:idx + _HISTORY_QUERY_CHUNK]
+        rows.extend(conn.execute(query.format(",".join("?" * len(chunk))), chunk))
+
+    return rows
+
+def _get_percentile(sorted_values, fraction):
+    """
+    Nearest-rank percentile of a sorted, non-empty list
+
+    >>> _get_percentile([1, 2, 3, 4], 0.5)
+    2
+    >>> _get_percentile([1, 2, 3, 4, 5, 6, 7, 8, 9, 10], 0.9)
+    9
+    >>> _get_percentile([7], 0.9)
+    7
+    """
+    return sorted_values[max(0, int(math.ceil(fraction * len(sorted_values))) - 1)]
+
+def _read_legacy_walltimes(baseline_root, test):
+    the_path = os.path.join(baseline_root, _WALLTIME_BASELINE_NAME, test, _WALLTIME_FILE_NAME)
+    records = []
+    if os.path.exists(the_path):
+        with open(the_path, "r") as fd:
+            for line in fd:
+                items = line.split()
+                if items:
+                    records.append((int(items[0]), items[1] if len(items) > 1 else None))
+
+    return records
+
+def get_test_time_stats(baseline_root, tests):
+    """
+    Returns {test -> TestTimeStats} for the tests in tests that have a walltime
+    history. Statistics are over the most recent runs only, count is the
+    number of runs they are over.
+    """
+    result = {}
+    if baseline_root is not None:
+        try:
+            history = {}
+            conn = _open_history_db(baseline_root)
+            if conn is not None:
+                try:
+                    for test, seconds in _query_by_test(conn, "SELECT test, seconds FROM walltimes "
+                                                              "WHERE test IN ({}) ORDER BY rowid", tests):
+                        history.setdefault(test, []).append(seconds)
+                finally:
+                    conn.close()
+
+            for test in tests:
+                if test not in history:
+                    legacy = [seconds for seconds, _ in _read_legacy_walltimes(baseline_root, test)]
+                    if legacy:
+                        history[test] = legacy
+
+            for test, records in history.items():
+                records = records[-_HISTORY_LEN:]
+                recent = sorted(records)
+                result[test] = TestTimeStats(len(records), records[-1], _get_percentile(recent, 0.5),
+                                             _get_percentile(recent, 0.9))
+
+        except Exception:
+            # We NEVER want a failure here to kill the run
+            logger.warning("Failed to read test times: {}".format(sys.exc_info()[1]))
+
+    return result
+
+def get_recommended_test_times_based_on_past(baseline_root, tests, raw=False):
+    """
+    Returns {test -> walltime}, walltime is None for tests with no history.
+
+    With raw, the walltime is the median of recent runs, the typical time the
+    test takes. Otherwise, it is a walltime to request from the batch system:
+    the 90th percentile of recent runs plus some margin.
+    """
+    result = dict((test, None) for test in tests)
+    for test, stats in get_test_time_stats(baseline_root, tests).items():
+        if raw:
+            best_walltime = stats.median
+        else:
+            best_walltime = None
+            for cutoff, tolerance in _WALLTIME_TOLERANCE:
+                if stats.p90 <= cutoff:
+                    best_walltime = int(float(stats.p90) * tolerance)
+                    break
+
+            if best_walltime < _GLOBAL_MINUMUM_TIME:
+                best_walltime = _GLOBAL_MINUMUM_TIME
+
+            best_walltime += _GLOBAL_WIGGLE
+
+        result[test] = convert_to_babylonian_time(best_walltime)
+
+    return result
+
 def get_recommended_test_time_based_on_past(baseline_root, test, raw=False):
+    return get_recommended_test_times_based_on_past(baseline_root, [test], raw=raw)[test]
+
+def _import_legacy_walltimes(conn, baseline_root, test):
+    """
+    Copy the walltime history file of test, if any, into the database unless
+    the database already has history for test
+    """
+    if conn.execute("SELECT 1 FROM walltimes WHERE test = ? LIMIT 1", (test,)).fetchone() is None:
+        conn.executemany("INSERT INTO walltimes (test, seconds, commit_id) VALUES (?, ?, ?)",
+                         [(test, seconds, commit) for seconds, commit in _read_legacy_walltimes(baseline_root, test)])
+
+def save_test_time(baseline_root, test, time_seconds, commit):
+    """
+    Record the walltime of a run of test. Only the most recent records of a
+    test are kept.
+    """
     if baseline_root is not None:
         try:
-            the_path = os.path.join(baseline_root, _WALLTIME_BASELINE_NAME, test, _WALLTIME_FILE_NAME)
-            if os.path.exists(the_path):
-                last_line = int(open(the_path, "r").readlines()[-1].split()[0])
-                if raw:
-                    best_walltime = last_line
-                else:
-                    best_walltime = None
-                    for cutoff, tolerance in _WALLTIME_TOLERANCE:
-                        if last_line <= cutoff:
-                            best_walltime = int(float(last_line) * tolerance)
-                            break
+            with _history_db_transaction(baseline_root) as conn:
+                _import_legacy_walltimes(conn, baseline_root, test)
+                conn.execute("INSERT INTO walltimes (test, seconds, commit_id) VALUES (?, ?, ?)",
+                             (test, int(time_seconds), commit))
+                conn.execute("DELETE FROM walltimes WHERE test = ? AND rowid NOT IN "
+                             "(SELECT rowid FROM walltimes WHERE test = ? ORDER BY rowid DESC LIMIT ?)",
+                             (test, test, _HISTORY_LEN))
 
-                    if best_walltime < _GLOBAL_MINUMUM_TIME:
-                        best_walltime = _GLOBAL_MINUMUM_TIME
+        except Exception:
+            # We NEVER want a failure here to kill the run
+            logger.warning("Failed to store test time: {}".format(sys.exc_info()[1]))
 
-                    best_walltime += _GLOBAL_WIGGLE
+def get_phase_times_based_on_past(baseline_root, tests):
+    """
+    Returns {test -> {phase -> (seconds, procs)}} for the tests in tests that
+    have recorded phase timings. seconds is the median of the most recent
+    records.
+    """
+    result = {}
+    if baseline_root is not None:
+        try:
+            conn = _open_history_db(baseline_root)
+            if conn is not None:
+                history = {}
+                try:
+                    for test, phase, seconds, procs in _query_by_test(conn, "SELECT test, phase, seconds, procs FROM phase_times "
+                                                                            "WHERE test IN ({}) ORDER BY rowid", tests):
+                        history.setdefault(test, {}).setdefault(phase, []).append((seconds, procs))
+                finally:
+                    conn.close()
+
+                for test, phases in history.items():
+                    for phase, records in phases.items():
+                        result.setdefault(test, {})[phase] = _get_percentile(sorted(records[-_HISTORY_LEN:]), 0.5)
 
-                return convert_to_babylonian_time(best_walltime)
         except Exception:
             # We NEVER want a failure here to kill the run
-            logger.warning("Failed to read test time: {}".format(sys.exc_info()[1]))
+            logger.warning("Failed to read phase times: {}".format(sys.exc_info()[1]))
 
-    return None
+    return result
 
-def save_test_time(baseline_root, test, time_seconds, commit):
+def save_phase_times(baseline_root, phase_times):
+    """
+    Record phase timings, phase_times is a list of (test, phase, seconds, procs).
+    Only the most recent records of each phase of a test are kept.
+    """
+    if baseline_root is not None and phase_times:
+        try:
+            with _history_db_transaction(baseline_root) as conn:
+                conn.executemany("INSERT INTO phase_times (test, phase, seconds, procs) VALUES (?, ?, ?, ?)", phase_times)
+                conn.executemany("DELETE FROM phase_times WHERE test = ? AND phase = ? AND rowid NOT IN "
+                                 "(SELECT rowid FROM phase_times WHERE test = ? AND phase = ? ORDER BY rowid DESC LIMIT ?)",
+                                 [(test, phase, test, phase, _HISTORY_LEN)
+                                  for test, phase in set((test, phase) for test, phase, _, _ in phase_times)])
+
+        except Exception:
+            # We NEVER want a failure here to kill the run
+            logger.warning("Failed to store phase times: {}".format(sys.exc_info()[1]))
+
+def get_perf_samples(baseline_root, baseline, metric):
+    """
+    Returns the most recent samples of metric (a throughput or memory use)
+    recorded for baseline, oldest first
+    """
+    samples = []
     if baseline_root is not None:
         try:
-            with SharedArea():
-                the_dir = os.path.join(baseline_root, _WALLTIME_BASELINE_NAME, test)
-                if not os.path.exists(the_dir):
-                    os.makedirs(the_dir)
+            conn = _open_history_db(baseline_root)
+            if conn is not None:
+                try:
+                    samples = [row[0] for row in conn.execute("SELECT value FROM perf_samples WHERE baseline = ? AND metric = ? "
+                                                              "ORDER BY rowid DESC LIMIT ?", (baseline, metric, _PERF_SAMPLE_WINDOW))]
+                finally:
+                    conn.close()
+
+        except Exception:
+            # We NEVER want a failure here to kill the run
+            logger.warning("Failed to read performance samples: {}".format(sys.exc_info()[1]))
 
-                the_path = os.path.join(the_dir, _WALLTIME_FILE_NAME)
-                with open(the_path, "a") as fd:
-                    fd.write("{} {}\n".format(int(time_seconds), commit))
+    return samples[::-1]
+
+def save_perf_sample(baseline_root, baseline, metric, value, commit, reset=False, initial=None):
+    """
+    Add a sample of metric to baseline. With reset, the earlier samples are
+    dropped, as when the baseline is generated again. initial, if given, is
+    recorded first if baseline has no samples of metric yet: the value from a
+    baseline that predates sample history.
+    """
+    if baseline_root is not None:
+        try:
+            with _history_db_transaction(baseline_root) as conn:
+                if reset:
+                    conn.execute("DELETE FROM perf_samples WHERE baseline = ? AND metric = ?", (baseline, metric))
+                elif initial is not None and \
+                     conn.execute("SELECT 1 FROM perf_samples WHERE baseline = ? AND metric = ? LIMIT 1", (baseline, metric)).fetchone() is None:
+                    conn.execute("INSERT INTO perf_samples (baseline, metric, value, commit_id) VALUES (?, ?, ?, ?)",
+                                 (baseline, metric, initial, None))
+
+                conn.execute("INSERT INTO perf_samples (baseline, metric, value, commit_id) VALUES (?, ?, ?, ?)",
+                             (baseline, metric, value, commit))
 
         except Exception:
             # We NEVER want a failure here to kill the run
-            logger.warning("Failed to store test time: {}".format(sys.exc_info()[1]))
+            logger.warning("Failed to store performance sample: {}".format(sys.exc_info()[1]))
 
 _SUCCESS_BASELINE_NAME = "success-history"
 _SUCCESS_FILE_NAME     = "last-transitions"
 
-def _read_success_data(baseline_root, test):
+def _read_legacy_success_data(baseline_root, test):
     success_path = os.path.join(baseline_root, _SUCCESS_BASELINE_NAME, test, _SUCCESS_FILE_NAME)
     if os.path.exists(success_path):
         with open(success_path, "r") as fd:
@@ -491,7 +738,17 @@ def _read_success_data(baseline_root, test):
         if item == "None":
             prev_results[idx] = None
 
-    return success_path, prev_results
+    return prev_results
+
+def _read_success_data(conn, baseline_root, test):
+    """
+    Return [commit when test last passed, commit when test last transitioned
+    from pass to fail], conn may be None if there is no database
+    """
+    row = None if conn is None else \
+          conn.execute("SELECT last_pass, last_fail_transition FROM success WHERE test = ?", (test,)).fetchone()
+
+    return _read_legacy_success_data(baseline_root, test) if row is None else list(row)
 
 def _is_test_working(prev_results, src_root, testing=False):
     # If there is no history of success, prev run could not have succeeded and vice versa for failures
@@ -518,7 +775,13 @@ def get_test_success(baseline_root, src_root, test, testing=False):
     """
     if baseline_root is not None:
         try:
-            prev_results = _read_success_data(baseline_root, test)[1]
+            conn = _open_history_db(baseline_root)
+            try:
+                prev_results = _read_success_data(conn, baseline_root, test)
+            finally:
+                if conn is not None:
+                    conn.close()
+
             prev_success = _is_test_working(prev_results, src_root, testing=testing)
             return prev_success, prev_results[0], prev_results[1]
 
@@ -534,12 +797,8 @@ def save_test_success(baseline_root, src_root, test, succeeded, force_commit_tes
     """
     if baseline_root is not None:
         try:
-            with SharedArea():
-                success_path, prev_results = _read_success_data(baseline_root, test)
-
-                the_dir = os.path.dirname(success_path)
-                if not os.path.exists(the_dir):
-                    os.makedirs(the_dir)
+            with _history_db_transaction(baseline_root) as conn:
+                prev_results = _read_success_data(conn, baseline_root, test)
 
                 prev_succeeded = _is_test_working(prev_results, src_root, testing=(force_commit_test is not None))
 
@@ -553,9 +812,8 @@ def save_test_success(baseline_root, src_root, test, succeeded, force_commit_tes
                     else:
                         new_results[1] = my_commit # we transitioned to a failing state
 
-                    str_results = ["None" if item is None else item for item in new_results]
-                    with open(success_path, "w") as fd:
-                        fd.write("{}\n".format(" ".join(str_results)))
+                    conn.execute("INSERT OR REPLACE INTO success (test, last_pass, last_fail_transition) VALUES (?, ?, ?)",
+                                 [test] + new_results)
 
         except Exception:
             # We NEVER want a failure here to kill the run
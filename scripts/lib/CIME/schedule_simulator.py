@@ -0,0 +1,120 @@
+"""
+Offline replay of a TestScheduler run. Given (recorded or estimated) phase
+durations, simulate how a suite would be scheduled on a fixed proc pool, so
+that scheduling policies can be compared without running anything.
+
+The simulation follows the rules TestScheduler._dispatch uses: at most
+parallel_jobs phases at once, procs taken from a fixed pool, and tests that
+share a build waiting for the first test of their build group to finish its
+XML, SHAREDLIB_BUILD and MODEL_BUILD phases. Phases never fail.
+"""
+
+import heapq
+
+from CIME.XML.standard_module_setup import *
+from CIME.test_scheduler import PHASES, TEST_START, XML_PHASE, SHAREDLIB_BUILD_PHASE, MODEL_BUILD_PHASE, \
+    SCHEDULING_POLICIES, get_test_priorities
+
+logger = logging.getLogger(__name__)
+
+_BUILD_GROUP_DEP_PHASES = [XML_PHASE, SHAREDLIB_BUILD_PHASE, MODEL_BUILD_PHASE]
+
+###############################################################################
+def simulate_test_schedule(tests, build_groups, phase_times, priorities,
+                           proc_pool, parallel_jobs, phase_procs=None, model_build_cost=4, phases=None):
+###############################################################################
+    """
+    Return the simulated makespan, in seconds, of running phases of tests.
+
+    phase_times is {test -> {phase -> seconds}}. phase_procs is {test -> {phase -> procs}}
+    and overrides the procs a phase takes, 1 or model_build_cost for MODEL_BUILD.
+    priorities is {test -> priority}, see test_scheduler.get_test_priorities.
+
+    Two procs, one long test listed last: starting it first saves two seconds
+
+    >>> times = {"a" : {"RUN" : 2}, "b" : {"RUN" : 2}, "c" : {"RUN" : 4}}
+    >>> groups = [("a",), ("b",), ("c",)]
+    >>> simulate_test_schedule(["a", "b", "c"], groups, times, {"a" : 0, "b" : 1, "c" : 2}, 2, 2, phases=["INIT", "RUN"])
+    6.0
+    >>> simulate_test_schedule(["a", "b", "c"], groups, times, {"a" : 1, "b" : 2, "c" : 0}, 2, 2, phases=["INIT", "RUN"])
+    4.0
+    """
+    phases = PHASES if phases is None else phases
+    phase_procs = {} if phase_procs is None else phase_procs
+
+    first_tests = {}
+    for build_group in build_groups:
+        for test in build_group:
+            first_tests[test] = build_group[0]
+
+    done_phase = dict((test, phases.index(TEST_START)) for test in tests) # test -> index of last completed phase
+    ready = [(priorities[test], test) for test in tests]
+    heapq.heapify(ready)
+    running = [] # heap of (end time, test, phase, procs)
+    procs_avail = proc_pool
+    clock = 0.0
+
+    while ready or running:
+        deferred = []
+        while ready and len(running) < parallel_jobs and (procs_avail > 0 or not running):
+            priority, test = heapq.heappop(ready)
+            next_phase = phases[done_phase[test] + 1]
+
+            first_test = first_tests.get(test, test)
+            if first_test != test and next_phase in _BUILD_GROUP_DEP_PHASES:
+                if done_phase[first_test] < phases.index(next_phase):
+                    deferred.append((priority, test))
+                    continue
+
+                procs_needed = 1
+            elif next_phase == MODEL_BUILD_PHASE:
+                procs_needed = phase_procs.get(test, {}).get(next_phase, model_build_cost)
+            else:
+                procs_needed = phase_procs.get(test, {}).get(next_phase, 1)
+
+            procs_needed = min(procs_needed, proc_pool)
+            if procs_needed <= procs_avail:
+                procs_avail -= procs_needed
+                heapq.heappush(running, (clock + phase_times[test].get(next_phase, 0), test, next_phase, procs_needed))
+            else:
+                deferred.append((priority, test))
+
+        for item in deferred:
+            heapq.heappush(ready, item)
+
+        expect(running, "Simulation cannot make progress, tests {} are stuck".format([test for _, test in ready]))
+
+        # Advance to the next phase completion, deferred tests get another chance then
+        clock, test, phase, procs_needed = heapq.heappop(running)
+        procs_avail += procs_needed
+        done_phase[test] = phases.index(phase)
+        if done_phase[test] + 1 < len(phases):
+            heapq.heappush(ready, (priorities[test], test))
+
+        logger.debug("{:10.1f}: finished {} for {}".format(clock, phase, test))
+
+    return clock
+
+###############################################################################
+def compare_scheduling_policies(tests, build_groups, phase_times, proc_pool, parallel_jobs,
+                                phase_procs=None, model_build_cost=4, phases=None):
+###############################################################################
+    """
+    Return {policy -> simulated makespan} for every scheduling policy TestScheduler supports
+
+    c has a long run but shares the build of a, which is listed after b and d
+
+    >>> times = {"a" : {"MODEL_BUILD" : 2, "RUN" : 1}, "b" : {"MODEL_BUILD" : 2, "RUN" : 1},
+    ...          "c" : {"MODEL_BUILD" : 1, "RUN" : 6}, "d" : {"MODEL_BUILD" : 2, "RUN" : 2}}
+    >>> results = compare_scheduling_policies(["b", "d", "a", "c"], [("b",), ("d",), ("a", "c")], times, 2, 2,
+    ...                                       model_build_cost=1, phases=["INIT", "MODEL_BUILD", "RUN"])
+    >>> sorted(results.items())
+    [('critical_path', 9.0), ('in_order', 12.0)]
+    """
+    results = {}
+    for policy in SCHEDULING_POLICIES:
+        priorities = get_test_priorities(tests, build_groups, phase_times, policy=policy)
+        results[policy] = simulate_test_schedule(tests, build_groups, phase_times, priorities, proc_pool, parallel_jobs,
+                                                 phase_procs=phase_procs, model_build_cost=model_build_cost, phases=phases)
+
+    return results
@@ -8,11 +8,12 @@ phases. All other phases need to handle their own status because
 they can be run outside the context of TestScheduler.
 """
 
-import traceback, stat, threading, time, glob
+import traceback, stat, threading, time, glob, heapq, multiprocessing, sqlite3
 from collections import OrderedDict
 
 from CIME.XML.standard_module_setup import *
 import six
+from six.moves.queue import Queue, Empty
 from get_tests import get_recommended_test_time, get_build_groups
 from CIME.utils import append_status, append_testlog, TESTS_FAILED_ERR_CODE, parse_test_name, get_full_test_name, get_model, \
     convert_to_seconds, get_cime_root, get_project, get_timestamp, get_python_libs_root
@@ -26,11 +27,11 @@ from CIME.XML.component import Component
 from CIME.XML.tests import Tests
 from CIME.case import Case
 from CIME.wait_for_tests import wait_for_tests
-from CIME.provenance import get_recommended_test_time_based_on_past
+from CIME.provenance import get_recommended_test_times_based_on_past, get_phase_times_based_on_past, save_phase_times
 from CIME.locked_files import lock_file
 from CIME.cs_status_creator import create_cs_status
 from CIME.hist_utils import generate_teststatus
-from CIME.build import post_build
+from CIME.build import post_build, get_sharedlib_build_dirs
 
 logger = logging.getLogger(__name__)
 
@@ -39,6 +40,22 @@ TEST_START = "INIT" # Special pseudo-phase just for test_scheduler bookkeeping
 PHASES = [TEST_START, CREATE_NEWCASE_PHASE, XML_PHASE, SETUP_PHASE,
           SHAREDLIB_BUILD_PHASE, MODEL_BUILD_PHASE, RUN_PHASE] # Order matters
 
+# Estimated phase durations, in seconds, for phases with no recorded history
+_DEFAULT_PHASE_TIMES = {CREATE_NEWCASE_PHASE : 10,
+                        XML_PHASE            : 2,
+                        SETUP_PHASE          : 10,
+                        SHAREDLIB_BUILD_PHASE: 120,
+                        MODEL_BUILD_PHASE    : 600,
+                        RUN_PHASE            : 900}
+
+# How TestScheduler picks between tests that are ready at the same time,
+# see get_test_priorities
+SCHEDULING_POLICIES = ["critical_path", "in_order"]
+
+# How phases that run in-process python (currently XML_PHASE) are executed. The
+# other phases shell out and are always driven from threads.
+PHASE_BACKENDS = ["threads", "processes"]
+
 ###############################################################################
 def _translate_test_names_for_new_pecount(test_names, force_procs, force_threads):
 ###############################################################################
@@ -78,33 +95,290 @@ def _translate_test_names_for_new_pecount(test_names, force_procs, force_threads
 
     return new_test_names
 
-_TIME_CACHE = {}
 ###############################################################################
-def _get_time_est(test, baseline_root, as_int=False, use_cache=False, raw=False):
+def _get_time_est(test, baseline_root, raw=False):
+###############################################################################
+    return _get_time_ests([test], baseline_root, raw=raw)[test]
+
+###############################################################################
+def _get_time_ests(tests, baseline_root, raw=False):
+###############################################################################
+    """
+    Return {test -> recommended walltime or None}, from the history of past
+    runs (looked up for all tests at once) or else from the test config
+    """
+    recommended_times = get_recommended_test_times_based_on_past(baseline_root, tests, raw=raw)
+    for test in tests:
+        if recommended_times[test] is None:
+            recommended_times[test] = get_recommended_test_time(test)
+
+    return recommended_times
+
+###############################################################################
+def _order_tests_by_runtime(tests, baseline_root):
 ###############################################################################
-    if test in _TIME_CACHE and use_cache:
-        return _TIME_CACHE[test]
+    recommended_times = _get_time_ests(tests, baseline_root, raw=True)
+    tests.sort(key=lambda x: 9999999999 if recommended_times[x] is None else convert_to_seconds(recommended_times[x]),
+               reverse=True)
 
-    recommended_time = get_recommended_test_time_based_on_past(baseline_root, test, raw=raw)
+###############################################################################
+def get_phase_time_estimates(tests, phases, baseline_root):
+###############################################################################
+    """
+    Return ({test -> {phase -> seconds}}, {test -> {phase -> procs}}) for the
+    given phases of tests, based on phase timings recorded by past runs. Phases
+    a test has no history for are estimated from the other tests being run: the
+    median time recorded for that phase or, failing that, a fixed default. The RUN phase
+    falls back to the past or recommended walltime of the test.
+    procs only contains phases with recorded history.
+    """
+    history = get_phase_times_based_on_past(baseline_root, tests)
+    walltimes = _get_time_ests(tests, baseline_root, raw=True) if RUN_PHASE in phases else {}
+
+    fallbacks = {}
+    for phase in phases:
+        recorded = sorted(test_history[phase][0] for test_history in history.values() if phase in test_history)
+        fallbacks[phase] = recorded[len(recorded) // 2] if recorded else _DEFAULT_PHASE_TIMES.get(phase, 0)
+
+    times, procs = {}, {}
+    for test in tests:
+        test_history = history.get(test, {})
+        times[test], procs[test] = {}, {}
+        for phase in phases:
+            if phase in test_history:
+                times[test][phase], procs[test][phase] = test_history[phase]
+            else:
+                walltime = walltimes[test] if phase == RUN_PHASE else None
+                times[test][phase] = fallbacks[phase] if walltime is None else convert_to_seconds(walltime)
 
-    if recommended_time is None:
-        recommended_time = get_recommended_test_time(test)
+    return times, procs
 
-    if as_int:
-        if recommended_time is None:
-            recommended_time = 9999999999
+###############################################################################
+def get_test_priorities(tests, build_groups, phase_times, policy="critical_path"):
+###############################################################################
+    """
+    Return {test -> priority}. When several tests are ready for their next
+    phase, lower priorities are started first.
+
+    "in_order" keeps the order of tests. "critical_path" starts the tests with
+    the longest remaining chain of work first. The chain of the first test of a
+    build group includes the builds and runs of the rest of the group, since
+    those tests cannot build until it has. phase_times is {test -> {phase -> seconds}}.
+
+    >>> times = {"a" : {"MODEL_BUILD" : 10, "RUN" : 10}, "b" : {"MODEL_BUILD" : 10, "RUN" : 50},
+    ...          "c" : {"MODEL_BUILD" : 10, "RUN" : 100}, "d" : {"MODEL_BUILD" : 10, "RUN" : 20}}
+    >>> sorted(get_test_priorities(["a", "b", "c", "d"], [("a",), ("b",), ("c",), ("d",)], times).items())
+    [('a', 3), ('b', 1), ('c', 0), ('d', 2)]
+    >>> sorted(get_test_priorities(["a", "b", "c", "d"], [("a", "c"), ("b",), ("d",)], times).items())
+    [('a', 0), ('b', 2), ('c', 1), ('d', 3)]
+    >>> sorted(get_test_priorities(["a", "b", "c", "d"], [("a", "c"), ("b",), ("d",)], times, policy="in_order").items())
+    [('a', 0), ('b', 1), ('c', 2), ('d', 3)]
+    """
+    expect(policy in SCHEDULING_POLICIES,
+           "Unknown scheduling policy '{}', expected one of {}".format(policy, ", ".join(SCHEDULING_POLICIES)))
+
+    if policy == "in_order":
+        return dict((test, idx) for idx, test in enumerate(tests))
+
+    group_phases = [phase for phase in PHASES if phase not in [TEST_START, RUN_PHASE]]
+    path_lengths = {}
+    for build_group in build_groups:
+        for test in build_group:
+            path_lengths[test] = sum(phase_times[test].values())
+
+        # Tests sharing the build can only do it after the first test, and
+        # then still need to do the tail of their work
+        first_test = build_group[0]
+        tail = max([phase_times[test].get(MODEL_BUILD_PHASE, 0) + phase_times[test].get(RUN_PHASE, 0)
+                    for test in build_group[1:]] + [phase_times[first_test].get(RUN_PHASE, 0)])
+        path_lengths[first_test] = sum(phase_times[first_test].get(phase, 0) for phase in group_phases) + tail
+
+    order = sorted(tests, key=lambda test: -path_lengths[test])
+    return dict((test, idx) for idx, test in enumerate(order))
+
+###############################################################################
+def _xml_phase_impl(test, test_dir, test_id, test_root, test_options, cime_driver,
+                    baseline_root, baseline_cmp_name, baseline_gen_name, clean, save_timing,
+                    ccsm_cprnc, tput_tolerance, output_root, use_sharedlibroot,
+                    build_group_exeroot, gmake_j):
+###############################################################################
+    """
+    The work of TestScheduler._xml_phase. This only takes picklable arguments
+    and does not touch the scheduler so that it can run in a worker process.
+
+    If build_group_exeroot is None, this case defines the EXEROOT of its build
+    group. Returns (output_root, build_group_exeroot).
+    """
+    test_case,case_opts,_,_,_,compiler,_ = parse_test_name(test)
+
+    # Create, fill and write an envtest object
+    envtest = EnvTest(test_dir)
+
+    # Determine list of component classes that this coupler/driver knows how
+    # to deal with. This list follows the same order as compset longnames follow.
+    files = Files(comp_interface=cime_driver)
+    ufs_driver = os.environ.get("UFS_DRIVER")
+    attribute = None
+    if ufs_driver:
+        attribute = {"component":ufs_driver}
+
+    drv_config_file = files.get_value("CONFIG_CPL_FILE", attribute=attribute)
+
+    if cime_driver == "nuopc" and not os.path.exists(drv_config_file):
+        drv_config_file = files.get_value("CONFIG_CPL_FILE", {"component":"cpl"})
+    expect(os.path.exists(drv_config_file),"File {} not found, cime driver {}".format(drv_config_file, cime_driver))
+
+    drv_comp = Component(drv_config_file, "CPL")
+
+    envtest.add_elements_by_group(files, {}, "env_test.xml")
+    envtest.add_elements_by_group(drv_comp, {}, "env_test.xml")
+    envtest.set_value("TESTCASE", test_case)
+    envtest.set_value("TEST_TESTID", test_id)
+    envtest.set_value("CASEBASEID", test)
+    if "memleak_tolerance" in test_options:
+        envtest.set_value("TEST_MEMLEAK_TOLERANCE", test_options['memleak_tolerance'])
+
+    test_argv = "-testname {} -testroot {}".format(test, test_root)
+    if baseline_gen_name:
+        test_argv += " -generate {}".format(baseline_gen_name)
+        basegen_case_fullpath = os.path.join(baseline_root,baseline_gen_name, test)
+        logger.debug("basegen_case is {}".format(basegen_case_fullpath))
+        envtest.set_value("BASELINE_NAME_GEN", baseline_gen_name)
+        envtest.set_value("BASEGEN_CASE", os.path.join(baseline_gen_name, test))
+    if baseline_cmp_name:
+        test_argv += " -compare {}".format(baseline_cmp_name)
+        envtest.set_value("BASELINE_NAME_CMP", baseline_cmp_name)
+        envtest.set_value("BASECMP_CASE", os.path.join(baseline_cmp_name, test))
+
+    envtest.set_value("TEST_ARGV", test_argv)
+    envtest.set_value("CLEANUP", clean)
+
+    envtest.set_value("BASELINE_ROOT", baseline_root)
+    envtest.set_value("GENERATE_BASELINE", baseline_gen_name is not None)
+    envtest.set_value("COMPARE_BASELINE", baseline_cmp_name is not None)
+    envtest.set_value("CCSM_CPRNC", ccsm_cprnc)
+    if "tput_tolerance" in test_options:
+        tput_tolerance = test_options['tput_tolerance']
+
+    envtest.set_value("TEST_TPUT_TOLERANCE", 0.25 if tput_tolerance is None else tput_tolerance)
+
+    # Add the test instructions from config_test to env_test in the case
+    config_test = Tests()
+    testnode = config_test.get_test_node(test_case)
+    envtest.add_test(testnode)
+
+    if compiler == 'nag':
+        envtest.set_value("FORCE_BUILD_SMP","FALSE")
+
+    # Determine case_opts from the test_case
+    if case_opts is not None:
+        logger.debug("case_opts are {} ".format(case_opts))
+        for opt in case_opts: # pylint: disable=not-an-iterable
+
+            logger.debug("case_opt is {}".format(opt))
+            if opt == 'D':
+                envtest.set_test_parameter("DEBUG", "TRUE")
+                logger.debug (" DEBUG set to TRUE")
+
+            elif opt == 'E':
+                envtest.set_test_parameter("USE_ESMF_LIB", "TRUE")
+                logger.debug (" USE_ESMF_LIB set to TRUE")
+
+            elif opt == 'CG':
+                envtest.set_test_parameter("CALENDAR", "GREGORIAN")
+                logger.debug (" CALENDAR set to {}".format(opt))
+
+            elif opt.startswith('L'):
+                match =  re.match('L([A-Za-z])([0-9]*)', opt)
+                stop_option = {"y":"nyears", "m":"nmonths", "d":"ndays", "h":"nhours",
+                               "s":"nseconds", "n":"nsteps"}
+                opt = match.group(1)
+                envtest.set_test_parameter("STOP_OPTION",stop_option[opt])
+                opti = match.group(2)
+                envtest.set_test_parameter("STOP_N", opti)
+
+                logger.debug (" STOP_OPTION set to {}".format(stop_option[opt]))
+                logger.debug (" STOP_N      set to {}".format(opti))
+
+            elif opt.startswith('R'):
+                # R option is for testing in PTS_MODE or Single Column Model
+                #  (SCM) mode
+                envtest.set_test_parameter("PTS_MODE", "TRUE")
+
+                # For PTS_MODE, set all tasks and threads to 1
+                comps=["ATM","LND","ICE","OCN","CPL","GLC","ROF","WAV"]
+
+                for comp in comps:
+                    envtest.set_test_parameter("NTASKS_"+comp, "1")
+                    envtest.set_test_parameter("NTHRDS_"+comp, "1")
+                    envtest.set_test_parameter("ROOTPE_"+comp, "0")
+                    envtest.set_test_parameter("PIO_TYPENAME", "netcdf")
+
+            elif opt.startswith('A'):
+                # A option is for testing in ASYNC IO mode, only available with nuopc driver and pio2
+                envtest.set_test_parameter("PIO_ASYNC_INTERFACE", "TRUE")
+                envtest.set_test_parameter("CIME_DRIVER", "nuopc")
+                envtest.set_test_parameter("PIO_VERSION", "2")
+                match =  re.match('A([0-9]+)x?([0-9])*', opt)
+                envtest.set_test_parameter("PIO_NUMTASKS_CPL",  match.group(1))
+                if match.group(2):
+                    envtest.set_test_parameter("PIO_STRIDE_CPL",match.group(2))
+
+
+            elif (opt.startswith('I') or # Marker to distinguish tests with same name - ignored
+                  opt.startswith('M') or # handled in create_newcase
+                  opt.startswith('P') or # handled in create_newcase
+                  opt.startswith('N') or # handled in create_newcase
+                  opt.startswith('C') or # handled in create_newcase
+                  opt.startswith('V') or # handled in create_newcase
+                  opt == 'B'):           # handled in run_phase
+                pass
+
+            elif opt.startswith('IOP'):
+                logger.warning("IOP test option not yet implemented")
+            else:
+                expect(False, "Could not parse option '{}' ".format(opt))
+
+    envtest.write()
+    lock_file("env_run.xml", caseroot=test_dir, newname="env_run.orig.xml")
+
+    with Case(test_dir, read_only=False) as case:
+        if output_root is None:
+            output_root = case.get_value("CIME_OUTPUT_ROOT")
+        # if we are running a single test we don't need sharedlibroot
+        if use_sharedlibroot:
+            case.set_value("SHAREDLIBROOT",
+                           os.path.join(output_root,
+                                        "sharedlibroot.{}".format(test_id)))
+        envtest.set_initial_values(case)
+        case.set_value("TEST", True)
+        case.set_value("SAVE_TIMING", save_timing)
+
+        # handle single-exe here, all cases will use the EXEROOT from
+        # the first case in the build group
+        if build_group_exeroot is None:
+            build_group_exeroot = case.get_value("EXEROOT")
         else:
-            recommended_time = convert_to_seconds(recommended_time)
+            case.set_value("EXEROOT", build_group_exeroot)
 
-    if use_cache:
-        _TIME_CACHE[test] = recommended_time
+        # Scale back build parallelism on systems with few cores
+        if gmake_j is not None:
+            case.set_value("GMAKE_J", gmake_j)
 
-    return recommended_time
+    return output_root, build_group_exeroot
 
 ###############################################################################
-def _order_tests_by_runtime(tests, baseline_root):
+def _init_phase_worker(cime_driver):
 ###############################################################################
-    tests.sort(key=lambda x: _get_time_est(x, baseline_root, as_int=True, use_cache=True, raw=True), reverse=True)
+    """
+    Initializer for the processes of the "processes" phase backend. Each
+    worker only ever handles one test at a time, so unlike the threads of
+    the producer process it can safely use the XML read cache. Warm it with
+    the config files every XML phase needs.
+    """
+    GenericXML.DISABLE_CACHING = False
+    Files(comp_interface=cime_driver)
+    Tests()
 
 ###############################################################################
 class TestScheduler(object):
@@ -123,7 +397,8 @@ class TestScheduler(object):
                  allow_baseline_overwrite=False, output_root=None,
                  force_procs=None, force_threads=None, mpilib=None,
                  input_dir=None, pesfile=None, mail_user=None, mail_type=None, allow_pnl=False,
-                 non_local=False, single_exe=False, workflow=None):
+                 non_local=False, single_exe=False, workflow=None, phase_backend="threads",
+                 scheduling_policy="critical_path"):
     ###########################################################################
         self._cime_root       = get_cime_root()
         self._cime_model      = get_model()
@@ -140,6 +415,13 @@ class TestScheduler(object):
         self._non_local       = non_local
         self._build_groups    = []
         self._workflow        = workflow
+        self._phase_backend   = phase_backend
+        self._phase_pool      = None # Worker processes, only while running tests
+        self._phase_timings   = {}   # phase -> [(test, start, end, success)]
+        self._phase_procs     = {}   # (test, phase) -> procs
+
+        expect(phase_backend in PHASE_BACKENDS,
+               "Unknown phase backend '{}', expected one of {}".format(phase_backend, ", ".join(PHASE_BACKENDS)))
 
         self._mail_user = mail_user
         self._mail_type = mail_type
@@ -312,6 +594,24 @@ class TestScheduler(object):
         for build_group in self._build_groups:
             self._build_group_exeroots[build_group] = None
 
+        # Test to build group map
+        self._test_build_groups = {}
+        for build_group in self._build_groups:
+            for test_name in build_group:
+                self._test_build_groups[test_name] = build_group
+
+        # Tests are dispatched in this order when several are ready, lower first
+        phase_times = get_phase_time_estimates(self._tests, self._phases[1:], self._baseline_root)[0]
+        self._test_priorities = get_test_priorities(list(self._tests), self._build_groups, phase_times,
+                                                    policy=scheduling_policy)
+        logger.info("create_test will start ready tests in {} order".format(scheduling_policy.replace("_", " ")))
+
+        # Test to (sharedlib_dir, cprnc_dir), filled in after SETUP
+        self._sharedlib_build_dirs = {}
+
+        # Consumer threads report the tests they are done with here
+        self._finished_queue = Queue()
+
         logger.debug("Build groups are:")
         for build_group in self._build_groups:
             for test_name in build_group:
@@ -556,170 +856,35 @@ class TestScheduler(object):
     ###########################################################################
     def _xml_phase(self, test):
     ###########################################################################
-        test_case,case_opts,_,_,_,compiler,_ = parse_test_name(test)
-
-        # Create, fill and write an envtest object
-        test_dir = self._get_test_dir(test)
-        envtest = EnvTest(test_dir)
-
-        # Determine list of component classes that this coupler/driver knows how
-        # to deal with. This list follows the same order as compset longnames follow.
-        files = Files(comp_interface=self._cime_driver)
-        ufs_driver = os.environ.get("UFS_DRIVER")
-        attribute = None
-        if ufs_driver:
-            attribute = {"component":ufs_driver}
-
-        drv_config_file = files.get_value("CONFIG_CPL_FILE", attribute=attribute)
-
-        if self._cime_driver == "nuopc" and not os.path.exists(drv_config_file):
-            drv_config_file = files.get_value("CONFIG_CPL_FILE", {"component":"cpl"})
-        expect(os.path.exists(drv_config_file),"File {} not found, cime driver {}".format(drv_config_file, self._cime_driver))
-
-        drv_comp = Component(drv_config_file, "CPL")
-
-        envtest.add_elements_by_group(files, {}, "env_test.xml")
-        envtest.add_elements_by_group(drv_comp, {}, "env_test.xml")
-        envtest.set_value("TESTCASE", test_case)
-        envtest.set_value("TEST_TESTID", self._test_id)
-        envtest.set_value("CASEBASEID", test)
-        if test in self._test_data and "options" in self._test_data[test] and \
-                "memleak_tolerance" in self._test_data[test]['options']:
-            envtest.set_value("TEST_MEMLEAK_TOLERANCE", self._test_data[test]['options']['memleak_tolerance'])
-
-        test_argv = "-testname {} -testroot {}".format(test, self._test_root)
-        if self._baseline_gen_name:
-            test_argv += " -generate {}".format(self._baseline_gen_name)
-            basegen_case_fullpath = os.path.join(self._baseline_root,self._baseline_gen_name, test)
-            logger.debug("basegen_case is {}".format(basegen_case_fullpath))
-            envtest.set_value("BASELINE_NAME_GEN", self._baseline_gen_name)
-            envtest.set_value("BASEGEN_CASE", os.path.join(self._baseline_gen_name, test))
-        if self._baseline_cmp_name:
-            test_argv += " -compare {}".format(self._baseline_cmp_name)
-            envtest.set_value("BASELINE_NAME_CMP", self._baseline_cmp_name)
-            envtest.set_value("BASECMP_CASE", os.path.join(self._baseline_cmp_name, test))
-
-        envtest.set_value("TEST_ARGV", test_argv)
-        envtest.set_value("CLEANUP", self._clean)
-
-        envtest.set_value("BASELINE_ROOT", self._baseline_root)
-        envtest.set_value("GENERATE_BASELINE", self._baseline_gen_name is not None)
-        envtest.set_value("COMPARE_BASELINE", self._baseline_cmp_name is not None)
-        envtest.set_value("CCSM_CPRNC", self._machobj.get_value("CCSM_CPRNC", resolved=False))
-        tput_tolerance = self._machobj.get_value("TEST_TPUT_TOLERANCE", resolved=False)
-        if test in self._test_data and "options" in self._test_data[test] and \
-           "tput_tolerance" in self._test_data[test]['options']:
-            tput_tolerance = self._test_data[test]['options']['tput_tolerance']
-
-        envtest.set_value("TEST_TPUT_TOLERANCE", 0.25 if tput_tolerance is None else tput_tolerance)
-
-        # Add the test instructions from config_test to env_test in the case
-        config_test = Tests()
-        testnode = config_test.get_test_node(test_case)
-        envtest.add_test(testnode)
+        is_first_test, _, my_build_group = self._get_build_group(test)
+        if is_first_test:
+            expect(self._build_group_exeroots[my_build_group] is None, "Should not already have exeroot")
+            build_group_exeroot = None
+        else:
+            build_group_exeroot = self._build_group_exeroots[my_build_group]
+            expect(build_group_exeroot is not None, "Should already have exeroot")
+
+        test_options = self._test_data.get(test, {}).get("options", {})
+        args = (test, self._get_test_dir(test), self._test_id, self._test_root, test_options, self._cime_driver,
+                self._baseline_root, self._baseline_cmp_name, self._baseline_gen_name, self._clean, self._save_timing,
+                self._machobj.get_value("CCSM_CPRNC", resolved=False),
+                self._machobj.get_value("TEST_TPUT_TOLERANCE", resolved=False),
+                self._output_root, len(self._tests) > 1 and self._cime_model != "e3sm",
+                build_group_exeroot,
+                self._proc_pool if self._model_build_cost > self._proc_pool else None)
+
+        if self._phase_pool is None:
+            output_root, exeroot = _xml_phase_impl(*args)
+        else:
+            output_root, exeroot = self._phase_pool.apply(_xml_phase_impl, args)
 
-        if compiler == 'nag':
-            envtest.set_value("FORCE_BUILD_SMP","FALSE")
+        if self._output_root is None:
+            self._output_root = output_root
 
-        # Determine case_opts from the test_case
-        if case_opts is not None:
-            logger.debug("case_opts are {} ".format(case_opts))
-            for opt in case_opts: # pylint: disable=not-an-iterable
-
-                logger.debug("case_opt is {}".format(opt))
-                if opt == 'D':
-                    envtest.set_test_parameter("DEBUG", "TRUE")
-                    logger.debug (" DEBUG set to TRUE")
-
-                elif opt == 'E':
-                    envtest.set_test_parameter("USE_ESMF_LIB", "TRUE")
-                    logger.debug (" USE_ESMF_LIB set to TRUE")
-
-                elif opt == 'CG':
-                    envtest.set_test_parameter("CALENDAR", "GREGORIAN")
-                    logger.debug (" CALENDAR set to {}".format(opt))
-
-                elif opt.startswith('L'):
-                    match =  re.match('L([A-Za-z])([0-9]*)', opt)
-                    stop_option = {"y":"nyears", "m":"nmonths", "d":"ndays", "h":"nhours",
-                                   "s":"nseconds", "n":"nsteps"}
-                    opt = match.group(1)
-                    envtest.set_test_parameter("STOP_OPTION",stop_option[opt])
-                    opti = match.group(2)
-                    envtest.set_test_parameter("STOP_N", opti)
-
-                    logger.debug (" STOP_OPTION set to {}".format(stop_option[opt]))
-                    logger.debug (" STOP_N      set to {}".format(opti))
-
-                elif opt.startswith('R'):
-                    # R option is for testing in PTS_MODE or Single Column Model
-                    #  (SCM) mode
-                    envtest.set_test_parameter("PTS_MODE", "TRUE")
-
-                    # For PTS_MODE, set all tasks and threads to 1
-                    comps=["ATM","LND","ICE","OCN","CPL","GLC","ROF","WAV"]
-
-                    for comp in comps:
-                        envtest.set_test_parameter("NTASKS_"+comp, "1")
-                        envtest.set_test_parameter("NTHRDS_"+comp, "1")
-                        envtest.set_test_parameter("ROOTPE_"+comp, "0")
-                        envtest.set_test_parameter("PIO_TYPENAME", "netcdf")
-
-                elif opt.startswith('A'):
-                    # A option is for testing in ASYNC IO mode, only available with nuopc driver and pio2
-                    envtest.set_test_parameter("PIO_ASYNC_INTERFACE", "TRUE")
-                    envtest.set_test_parameter("CIME_DRIVER", "nuopc")
-                    envtest.set_test_parameter("PIO_VERSION", "2")
-                    match =  re.match('A([0-9]+)x?([0-9])*', opt)
-                    envtest.set_test_parameter("PIO_NUMTASKS_CPL",  match.group(1))
-                    if match.group(2):
-                        envtest.set_test_parameter("PIO_STRIDE_CPL",match.group(2))
-
-
-                elif (opt.startswith('I') or # Marker to distinguish tests with same name - ignored
-                      opt.startswith('M') or # handled in create_newcase
-                      opt.startswith('P') or # handled in create_newcase
-                      opt.startswith('N') or # handled in create_newcase
-                      opt.startswith('C') or # handled in create_newcase
-                      opt.startswith('V') or # handled in create_newcase
-                      opt == 'B'):           # handled in run_phase
-                    pass
-
-                elif opt.startswith('IOP'):
-                    logger.warning("IOP test option not yet implemented")
-                else:
-                    expect(False, "Could not parse option '{}' ".format(opt))
-
-        envtest.write()
-        lock_file("env_run.xml", caseroot=test_dir, newname="env_run.orig.xml")
-
-        with Case(test_dir, read_only=False) as case:
-            if self._output_root is None:
-                self._output_root = case.get_value("CIME_OUTPUT_ROOT")
-            # if we are running a single test we don't need sharedlibroot
-            if len(self._tests) > 1 and self._cime_model != "e3sm":
-                case.set_value("SHAREDLIBROOT",
-                               os.path.join(self._output_root,
-                                            "sharedlibroot.{}".format(self._test_id)))
-            envtest.set_initial_values(case)
-            case.set_value("TEST", True)
-            case.set_value("SAVE_TIMING", self._save_timing)
-
-            # handle single-exe here, all cases will use the EXEROOT from
-            # the first case in the build group
-            is_first_test, _, my_build_group = self._get_build_group(test)
-            if is_first_test:
-                expect(self._build_group_exeroots[my_build_group] is None, "Should not already have exeroot")
-                self._build_group_exeroots[my_build_group] = case.get_value("EXEROOT")
-            else:
-                build_group_exeroot = self._build_group_exeroots[my_build_group]
-                expect(build_group_exeroot is not None, "Should already have exeroot")
-                case.set_value("EXEROOT", build_group_exeroot)
+        if is_first_test:
+            self._build_group_exeroots[my_build_group] = exeroot
 
-            # Scale back build parallelism on systems with few cores
-            if self._model_build_cost > self._proc_pool:
-                case.set_value("GMAKE_J", self._proc_pool)
-                self._model_build_cost = self._proc_pool
+        self._model_build_cost = min(self._model_build_cost, self._proc_pool)
 
         return True, ""
 
@@ -734,6 +899,11 @@ class TestScheduler(object):
             cmdstat, output, _ = run_cmd("./case.cmpgen_namelists", combine_output=True, from_dir=test_dir)
             expect(cmdstat in [0, TESTS_FAILED_ERR_CODE], "Fatal error in case.cmpgen_namelists: {}".format(output))
 
+            # Work out the sharedlib configuration here, in parallel, rather than
+            # in the producer when the test is ready to build
+            if SHAREDLIB_BUILD_PHASE in self._phases and self._cime_model != "e3sm":
+                self._get_sharedlib_build_dirs(test)
+
         return rv
 
     ###########################################################################
@@ -752,11 +922,9 @@ class TestScheduler(object):
     ###########################################################################
     def _get_build_group(self, test):
     ###########################################################################
-        for build_group in self._build_groups:
-            if test in build_group:
-                return test == build_group[0], build_group[0], build_group
-
-        expect(False, "No build group for test '{}'".format(test))
+        build_group = self._test_build_groups.get(test)
+        expect(build_group is not None, "No build group for test '{}'".format(test))
+        return test == build_group[0], build_group[0], build_group
 
     ###########################################################################
     def _model_build_phase(self, test):
@@ -814,8 +982,13 @@ class TestScheduler(object):
             return False, errput
 
     ###########################################################################
-    def _get_procs_needed(self, test, phase, threads_in_flight=None, no_batch=False):
+    def _get_blocker(self, test, phase, threads_in_flight):
     ###########################################################################
+        """
+        Return what test must wait for before it can start phase, or None if
+        it can start now. The result is always the name of a test that is
+        either in flight or the first test of this test's build group.
+        """
         # For build pools, we must wait for the first case to complete XML, SHAREDLIB,
         # and MODEL_BUILD phases before the other cases can do those phases
         is_first_test, first_test, _ = self._get_build_group(test)
@@ -824,9 +997,55 @@ class TestScheduler(object):
             build_group_dep_phases = [XML_PHASE, SHAREDLIB_BUILD_PHASE, MODEL_BUILD_PHASE]
             if phase in build_group_dep_phases:
                 if self._get_test_status(first_test, phase=phase) == TEST_PEND_STATUS:
-                    return self._proc_pool + 1
+                    return first_test
                 else:
-                    return 1
+                    return None
+
+        if phase == SHAREDLIB_BUILD_PHASE and self._cime_model != "e3sm":
+            # Tests share SHAREDLIBROOT. Sharedlib builds for different library
+            # configurations can run in parallel, but only one build at a time may
+            # touch a given configuration's tree (or the per-compiler cprnc). Later
+            # tests with that configuration reuse the objects of the first one.
+            sharedlib_dir, cprnc_dir = self._get_sharedlib_build_dirs(test)
+            if cprnc_dir is not None and os.path.isdir(cprnc_dir):
+                cprnc_dir = None # Already built or being built, see build._build_libraries
+
+            for running_test, (_, _, running_phase) in six.iteritems(threads_in_flight):
+                if running_phase == SHAREDLIB_BUILD_PHASE:
+                    running_sharedlib_dir, running_cprnc_dir = self._get_sharedlib_build_dirs(running_test)
+                    if sharedlib_dir is None or running_sharedlib_dir in [None, sharedlib_dir] or \
+                       (cprnc_dir is not None and cprnc_dir == running_cprnc_dir):
+                        return running_test
+
+        return None
+
+    ###########################################################################
+    def _get_sharedlib_build_dirs(self, test):
+    ###########################################################################
+        """
+        Return (sharedlib_dir, cprnc_dir) for test, see build.get_sharedlib_build_dirs.
+        sharedlib_dir is None if the case could not be read, such a test is
+        treated as conflicting with every other sharedlib build.
+        """
+        if test not in self._sharedlib_build_dirs:
+            try:
+                with Case(self._get_test_dir(test), read_only=True) as case:
+                    self._sharedlib_build_dirs[test] = get_sharedlib_build_dirs(case)
+            except Exception as e:
+                logger.warning("Could not determine sharedlib configuration for test {}: {}".format(test, str(e)))
+                self._sharedlib_build_dirs[test] = (None, None)
+
+        return self._sharedlib_build_dirs[test]
+
+    ###########################################################################
+    def _get_procs_needed(self, test, phase, threads_in_flight=None, no_batch=False):
+    ###########################################################################
+        if self._get_blocker(test, phase, {} if threads_in_flight is None else threads_in_flight) is not None:
+            return self._proc_pool + 1
+
+        is_first_test = self._get_build_group(test)[0]
+        if not is_first_test and phase in [XML_PHASE, SHAREDLIB_BUILD_PHASE, MODEL_BUILD_PHASE]:
+            return 1
 
         if phase == RUN_PHASE and (self._no_batch or no_batch):
             test_dir = self._get_test_dir(test)
@@ -834,14 +1053,6 @@ class TestScheduler(object):
             return total_pes
 
         elif (phase == SHAREDLIB_BUILD_PHASE):
-            if self._cime_model != "e3sm":
-                # Will force serialization of sharedlib builds
-                # TODO - instead of serializing, compute all library configs needed and build
-                # them all in parallel
-                for _, _, running_phase in threads_in_flight.values():
-                    if (running_phase == SHAREDLIB_BUILD_PHASE):
-                        return self._proc_pool + 1
-
             return 1
         elif (phase == MODEL_BUILD_PHASE):
             # Model builds now happen in parallel
@@ -852,19 +1063,26 @@ class TestScheduler(object):
     ###########################################################################
     def _wait_for_something_to_finish(self, threads_in_flight):
     ###########################################################################
+        """
+        Block until at least one thread in flight is done, release its procs
+        and return a list of (test, phase) for every finished thread.
+        """
         expect(len(threads_in_flight) <= self._parallel_jobs, "Oversubscribed?")
-        finished_tests = []
-        while not finished_tests:
-            for test, thread_info in threads_in_flight.items():
-                if not thread_info[0].is_alive():
-                    finished_tests.append((test, thread_info[1]))
-
-            if not finished_tests:
-                time.sleep(0.2)
+        finished_tests = [self._finished_queue.get()]
+        while True:
+            try:
+                finished_tests.append(self._finished_queue.get_nowait())
+            except Empty:
+                break
 
-        for finished_test, procs_needed in finished_tests:
+        results = []
+        for finished_test in finished_tests:
+            thread, procs_needed, phase = threads_in_flight.pop(finished_test)
+            thread.join()
             self._procs_avail += procs_needed
-            del threads_in_flight[finished_test]
+            results.append((finished_test, phase))
+
+        return results
 
     ###########################################################################
     def _update_test_status_file(self, test, test_phase, status):
@@ -877,12 +1095,23 @@ class TestScheduler(object):
         with TestStatus(test_dir=test_dir, test_name=test) as ts:
             ts.set_status(test_phase, status)
 
+    ###########################################################################
+    def _consumer_thread(self, test, test_phase, phase_method):
+    ###########################################################################
+        try:
+            self._consumer(test, test_phase, phase_method)
+        finally:
+            # Wake up the producer
+            self._finished_queue.put(test)
+
     ###########################################################################
     def _consumer(self, test, test_phase, phase_method):
     ###########################################################################
         before_time = time.time()
         success, errors = self._run_catch_exceptions(test, test_phase, phase_method)
-        elapsed_time = time.time() - before_time
+        after_time = time.time()
+        elapsed_time = after_time - before_time
+        self._phase_timings.setdefault(test_phase, []).append((test, before_time, after_time, success))
         status  = (TEST_PEND_STATUS if test_phase == RUN_PHASE and not \
                    self._no_batch else TEST_PASS_STATUS) if success else TEST_FAIL_STATUS
 
@@ -920,72 +1149,143 @@ class TestScheduler(object):
             self._update_test_status(test, RUN_PHASE, TEST_PEND_STATUS)
             self._consumer(test, RUN_PHASE, self._run_phase)
 
+    ###########################################################################
+    def _dispatch(self, ready, blocked, threads_in_flight):
+    ###########################################################################
+        """
+        Start the next phase of as many ready tests as workers and procs allow,
+        highest priority first. ready is a heap of (priority, test). Tests that
+        must wait for another phase to finish are moved to blocked, keyed by
+        what they wait on (see _get_blocker).
+        """
+        deferred = []
+        while ready and len(threads_in_flight) < self._parallel_jobs and \
+              (self._procs_avail > 0 or not threads_in_flight):
+            priority, test = heapq.heappop(ready)
+            logger.debug("test_name: " + test)
+
+            test_phase, test_status = self._get_test_data(test)
+            expect(test_status != TEST_PEND_STATUS, test)
+            next_phase = self._phases[self._phases.index(test_phase) + 1]
+
+            # Park a blocked test until its blocker finishes a phase. A blocker
+            # can be in flight, or still waiting to start (e.g. the first test
+            # of the build group when a later test of the group outranks it).
+            # Only a blocker with no work left, because it failed, can never
+            # unblock it; then the test fails below for lack of procs.
+            blocker = self._get_blocker(test, next_phase, threads_in_flight)
+            if blocker is not None and (threads_in_flight or self._work_remains(blocker)):
+                blocked.setdefault(blocker, []).append(test)
+                continue
+
+            procs_needed = self._get_procs_needed(test, next_phase, threads_in_flight)
+
+            if procs_needed <= self._procs_avail:
+                self._procs_avail -= procs_needed
+                self._phase_procs[(test, next_phase)] = procs_needed
+
+                # Necessary to print this way when multiple threads printing
+                logger.info("Starting {} for test {} with {:d} procs".format(next_phase, test, procs_needed))
+
+                self._update_test_status(test, next_phase, TEST_PEND_STATUS)
+                new_thread = threading.Thread(target=self._consumer_thread,
+                    args=(test, next_phase, getattr(self, "_{}_phase".format(next_phase.lower())) ))
+                threads_in_flight[test] = (new_thread, procs_needed, next_phase)
+                new_thread.start()
+
+                logger.debug("  Current workload:")
+                total_procs = 0
+                for the_test, the_data in six.iteritems(threads_in_flight):
+                    logger.debug("    {}: {} -> {}".format(the_test, the_data[2], the_data[1]))
+                    total_procs += the_data[1]
+
+                logger.debug("    Total procs in use: {}".format(total_procs))
+
+            elif not threads_in_flight:
+                msg = "Phase '{}' for test '{}' required more processors, {:d}, than this machine can provide, {:d}".format(next_phase, test, procs_needed, self._procs_avail)
+                logger.warning(msg)
+                self._update_test_status(test, next_phase, TEST_PEND_STATUS)
+                self._update_test_status(test, next_phase, TEST_FAIL_STATUS)
+                self._log_output(test, msg)
+                if next_phase == RUN_PHASE:
+                    self._update_test_status_file(test, SUBMIT_PHASE, TEST_PASS_STATUS)
+                    self._update_test_status_file(test, next_phase, TEST_FAIL_STATUS)
+                else:
+                    self._update_test_status_file(test, next_phase, TEST_FAIL_STATUS)
+
+            else:
+                # Not enough procs right now, try again when something finishes
+                deferred.append((priority, test))
+
+        for item in deferred:
+            heapq.heappush(ready, item)
+
     ###########################################################################
     def _producer(self):
     ###########################################################################
         threads_in_flight = {} # test-name -> (thread, procs, phase)
-        while True:
-            work_to_do = False
-            num_threads_launched_this_iteration = 0
-            for test in self._tests:
-                logger.debug("test_name: " + test)
-
+        ready = [(self._test_priorities[test], test) for test in self._tests if self._work_remains(test)]
+        heapq.heapify(ready)
+        blocked = {} # blocker -> [test-name], see _get_blocker
+
+        while ready or blocked or threads_in_flight:
+            self._dispatch(ready, blocked, threads_in_flight)
+
+            if not threads_in_flight:
+                # Nothing is running, so only tests whose blockers failed can be
+                # left blocked. Give them another pass, they will fail for lack of procs.
+                for tests in blocked.values():
+                    for test in tests:
+                        heapq.heappush(ready, (self._test_priorities[test], test))
+
+                blocked = {}
+                continue
+
+            # Sleep until a consumer thread is done, then requeue everything it unblocked
+            for test, phase in self._wait_for_something_to_finish(threads_in_flight):
+                unblocked = blocked.pop(test, [])
                 if self._work_remains(test):
-                    work_to_do = True
-
-                    # If we have no workers available, immediately break out of loop so we can wait
-                    if len(threads_in_flight) == self._parallel_jobs:
-                        break
-
-                    if test not in threads_in_flight:
-                        test_phase, test_status = self._get_test_data(test)
-                        expect(test_status != TEST_PEND_STATUS, test)
-                        next_phase = self._phases[self._phases.index(test_phase) + 1]
-                        procs_needed = self._get_procs_needed(test, next_phase, threads_in_flight)
-
-                        if procs_needed <= self._procs_avail:
-                            self._procs_avail -= procs_needed
-
-                            # Necessary to print this way when multiple threads printing
-                            logger.info("Starting {} for test {} with {:d} procs".format(next_phase, test, procs_needed))
-
-                            self._update_test_status(test, next_phase, TEST_PEND_STATUS)
-                            new_thread = threading.Thread(target=self._consumer,
-                                args=(test, next_phase, getattr(self, "_{}_phase".format(next_phase.lower())) ))
-                            threads_in_flight[test] = (new_thread, procs_needed, next_phase)
-                            new_thread.start()
-                            num_threads_launched_this_iteration += 1
-
-                            logger.debug("  Current workload:")
-                            total_procs = 0
-                            for the_test, the_data in six.iteritems(threads_in_flight):
-                                logger.debug("    {}: {} -> {}".format(the_test, the_data[2], the_data[1]))
-                                total_procs += the_data[1]
-
-                            logger.debug("    Total procs in use: {}".format(total_procs))
-                        else:
-                            if not threads_in_flight:
-                                msg = "Phase '{}' for test '{}' required more processors, {:d}, than this machine can provide, {:d}".format(next_phase, test, procs_needed, self._procs_avail)
-                                logger.warning(msg)
-                                self._update_test_status(test, next_phase, TEST_PEND_STATUS)
-                                self._update_test_status(test, next_phase, TEST_FAIL_STATUS)
-                                self._log_output(test, msg)
-                                if next_phase == RUN_PHASE:
-                                    self._update_test_status_file(test, SUBMIT_PHASE, TEST_PASS_STATUS)
-                                    self._update_test_status_file(test, next_phase, TEST_FAIL_STATUS)
-                                else:
-                                    self._update_test_status_file(test, next_phase, TEST_FAIL_STATUS)
-                                num_threads_launched_this_iteration += 1
-
-            if not work_to_do:
-                break
+                    unblocked.append(test)
+
+                for unblocked_test in unblocked:
+                    heapq.heappush(ready, (self._test_priorities[unblocked_test], unblocked_test))
+
+    ###########################################################################
+    def _report_phase_throughput(self):
+    ###########################################################################
+        """
+        Log, for each phase run by this scheduler, how many tests went through
+        it and how many tests per minute it completed over the wallclock span
+        of that phase. This is the number to compare between phase backends.
+        """
+        logger.info("Phase throughput ({} backend):".format(self._phase_backend))
+        for phase in self._phases:
+            timings = self._phase_timings.get(phase)
+            if timings:
+                span = max(end for _, _, end, _ in timings) - min(start for _, start, _, _ in timings)
+                busy = sum(end - start for _, start, end, _ in timings)
+                logger.info("  {:<16} {:4d} tests in {:9.2f} seconds, {:9.2f} tests/min, average concurrency {:.2f}".format(
+                    phase, len(timings), span, 60.0 * len(timings) / max(span, 1e-6), busy / max(span, 1e-6)))
 
-            if num_threads_launched_this_iteration == 0:
-                # No free resources, wait for something in flight to finish
-                self._wait_for_something_to_finish(threads_in_flight)
+    ###########################################################################
+    def _save_phase_times(self):
+    ###########################################################################
+        """
+        Add the durations of the phases that passed in this run to the phase
+        history in the baseline area, so later runs can schedule with them. On
+        batch systems the RUN phase only submits, so it is not recorded.
+        """
+        if self._baseline_root is None or not os.path.isdir(self._baseline_root):
+            return
+
+        phase_times = []
+        for phase, timings in six.iteritems(self._phase_timings):
+            if phase != RUN_PHASE or self._no_batch:
+                for test, start, end, success in timings:
+                    if success:
+                        phase_times.append((test, phase, end - start, self._phase_procs.get((test, phase), 1)))
 
-        for unfinished_thread, _, _ in threads_in_flight.values():
-            unfinished_thread.join()
+        save_phase_times(self._baseline_root, phase_times)
 
     ###########################################################################
     def _setup_cs_files(self):
@@ -1049,9 +1349,29 @@ class TestScheduler(object):
         # Setup cs files
         self._setup_cs_files()
 
+        # Lets cs.status and wait_for_tests read the whole suite at once
+        try:
+            create_test_status_index(self._test_root)
+        except sqlite3.Error as e:
+            logger.warning("Could not create a test status index in {}: {}".format(self._test_root, e))
+
+        if self._phase_backend == "processes" and XML_PHASE in self._phases:
+            # Create the pool before any consumer threads exist
+            self._phase_pool = multiprocessing.Pool(self._parallel_jobs, initializer=_init_phase_worker,
+                                                    initargs=(self._cime_driver,))
+
         GenericXML.DISABLE_CACHING = True
-        self._producer()
-        GenericXML.DISABLE_CACHING = False
+        try:
+            self._producer()
+        finally:
+            GenericXML.DISABLE_CACHING = False
+            if self._phase_pool is not None:
+                self._phase_pool.close()
+                self._phase_pool.join()
+                self._phase_pool = None
+
+        self._report_phase_throughput()
+        self._save_phase_times()
 
         expect(threading.active_count() == 1, "Leftover threads?")
 
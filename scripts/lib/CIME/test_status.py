@@ -21,16 +21,38 @@ Additional important design decisions:
 2) If the user repeats a core state, that invalidates all subsequent state. For
    example, if a user rebuilds their case, then any of the post-run states like the
    RUN state are no longer valid.
+3) Status changes are appended to a journal next to the TestStatus file as soon as
+   they are made, and compacted into the TestStatus file, which is replaced
+   atomically, when the context manager exits. Readers see the TestStatus file
+   plus the journal, so they never see a partially written file, and concurrent
+   writers of the same test do not overwrite each other's changes.
+4) A test root can have a test status index, a database with the TestStatus
+   contents of all of its tests (see create_test_status_index). TestStatus keeps
+   it up to date, so the status of a whole suite can be read at once with
+   get_test_statuses instead of opening every TestStatus file.
 """
 
 from CIME.XML.standard_module_setup import *
 
 from collections import OrderedDict
+from contextlib import contextmanager
 
-import os, itertools
+import os, itertools, fcntl, stat, threading, sqlite3
 from CIME import expected_fails
 
 TEST_STATUS_FILENAME = "TestStatus"
+TEST_STATUS_JOURNAL_FILENAME = ".TestStatus.journal"
+TEST_STATUS_INDEX_FILENAME = ".test_status_index.db"
+
+_TEST_STATUS_INDEX_TIMEOUT = 60
+_TEST_STATUS_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS test_status (
+    case_dir TEXT PRIMARY KEY,
+    test_name TEXT,
+    seq INTEGER,
+    contents TEXT
+);
+"""
 
 # The statuses that a phase can be in
 TEST_PEND_STATUS = "PEND"
@@ -116,9 +138,145 @@ def _test_helper2(file_contents, wait_for_run=False, check_throughput=False, che
 
     return rv
 
+@contextmanager
+def _journal_lock(fd, exclusive):
+    """
+    Hold a lock on an open journal file. Locking is best effort, some parallel
+    file systems are mounted without lock support.
+    """
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        locked = True
+    except (IOError, OSError):
+        locked = False
+
+    try:
+        yield
+    finally:
+        if locked:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+def _read_journal(fd):
+    """
+    Returns ([(status, test_name, phase, comments)], sequence number) from an
+    open journal. Each entry is a line '<seq> <status> <test_name> <phase> [comments]',
+    compaction leaves only a '<seq>' line.
+
+    >>> import io
+    >>> _read_journal(io.StringIO(u"3\\n4 PASS ERS.foo.A RUN time=42\\n5 FAIL ERS.foo.A MEMLEAK\\n6 PA"))
+    ([('PASS', 'ERS.foo.A', 'RUN', 'time=42'), ('FAIL', 'ERS.foo.A', 'MEMLEAK', '')], 5)
+    """
+    fd.seek(0)
+    entries = []
+    seq = 0
+    for line in fd.read().splitlines():
+        tokens = [str(token) for token in line.split()]
+        if len(tokens) == 1 and tokens[0].isdigit():
+            seq = int(tokens[0])
+        elif len(tokens) >= 4 and tokens[0].isdigit():
+            seq = int(tokens[0])
+            entries.append((tokens[1], tokens[2], tokens[3], " ".join(tokens[4:])))
+        # Anything else is a partial line left by a writer that died
+
+    return entries, seq
+
+def get_test_status_sequence_number(test_dir):
+    """
+    Returns a number that grows with every status change made with TestStatus
+    in test_dir, 0 if there were none. Only the small journal file is read, so
+    this is a cheap way to poll a test for changes.
+    """
+    try:
+        with open(os.path.join(test_dir, TEST_STATUS_JOURNAL_FILENAME), "r") as fd:
+            with _journal_lock(fd, False):
+                return _read_journal(fd)[1]
+    except (IOError, OSError):
+        return 0
+
+def _open_test_status_index(test_root, create=False):
+    """
+    Return a connection to the test status index of test_root. If there is no
+    index, return None or, if create, make one.
+    """
+    the_path = os.path.join(test_root, TEST_STATUS_INDEX_FILENAME)
+    if not create and not os.path.exists(the_path):
+        return None
+
+    conn = sqlite3.connect(the_path, timeout=_TEST_STATUS_INDEX_TIMEOUT, isolation_level=None)
+    conn.executescript(_TEST_STATUS_INDEX_SCHEMA)
+    return conn
+
+def create_test_status_index(test_root):
+    """
+    Create a test status index in test_root, if there is none. From then on, the
+    TestStatus files of tests in test_root are mirrored in it.
+    """
+    _open_test_status_index(test_root, create=True).close()
+
+def _update_test_status_index(test_dir, test_name, seq, contents):
+    """
+    Record the TestStatus contents of test_dir in the index of its test root, if
+    there is one. An index that cannot be updated is removed so that readers
+    go back to the TestStatus files instead of trusting it.
+    """
+    test_root, case_dir = os.path.split(os.path.abspath(test_dir))
+    try:
+        conn = _open_test_status_index(test_root)
+        if conn is not None:
+            try:
+                conn.execute("INSERT OR REPLACE INTO test_status VALUES (?, ?, ?, ?)", (case_dir, test_name, seq, contents))
+            finally:
+                conn.close()
+    except sqlite3.Error as e:
+        index_path = os.path.join(test_root, TEST_STATUS_INDEX_FILENAME)
+        logging.warning("Could not update test status index {}, removing it: {}".format(index_path, e))
+        try:
+            os.remove(index_path)
+        except OSError:
+            pass
+
+def read_test_status_index(test_root):
+    """
+    Returns {case dir name -> (sequence number, TestStatus contents)} for the
+    tests in the index of test_root, empty if there is no usable index.
+    """
+    try:
+        conn = _open_test_status_index(test_root)
+        if conn is None:
+            return {}
+        try:
+            return dict((case_dir, (seq, contents)) for case_dir, seq, contents in
+                        conn.execute("SELECT case_dir, seq, contents FROM test_status"))
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logging.warning("Could not read test status index in {}: {}".format(test_root, e))
+        return {}
+
+def get_test_statuses(test_dirs):
+    """
+    Returns a list with the TestStatus of each of test_dirs. Tests found in
+    the test status index of their test root come from it, with one read for
+    each test root. The others are read from their TestStatus files. TestStatus
+    objects from the index are read-only.
+    """
+    indexes = {}
+    result = []
+    for test_dir in test_dirs:
+        test_root, case_dir = os.path.split(os.path.abspath(test_dir))
+        if test_root not in indexes:
+            indexes[test_root] = read_test_status_index(test_root)
+
+        if case_dir in indexes[test_root]:
+            result.append(TestStatus(test_dir=test_dir, contents=indexes[test_root][case_dir][1]))
+        else:
+            result.append(TestStatus(test_dir=test_dir))
+
+    return result
+
 class TestStatus(object):
 
-    def __init__(self, test_dir=None, test_name=None, no_io=False):
+    def __init__(self, test_dir=None, test_name=None, no_io=False, contents=None):
         """
         Create a TestStatus object
 
@@ -126,22 +284,36 @@ class TestStatus(object):
 
         no_io is intended only for testing, and should be kept False in
         production code
+
+        contents, if given, is used in place of the TestStatus file, e.g. when
+        it comes from the test status index. The object is then read-only.
         """
         test_dir = os.getcwd() if test_dir is None else test_dir
         self._filename = os.path.join(test_dir, TEST_STATUS_FILENAME)
+        self._journal_filename = os.path.join(test_dir, TEST_STATUS_JOURNAL_FILENAME)
         self._phase_statuses = OrderedDict() # {name -> (status, comments)}
         self._test_name = test_name
         self._ok_to_modify = False
         self._no_io = no_io
-
-        if os.path.exists(self._filename):
-            self._parse_test_status_file()
-            if not os.access(self._filename, os.W_OK):
+        self._seq = 0
+        self._needs_compaction = False
+
+        if contents is not None:
+            self._no_io = True
+            self._parse_test_status(contents)
+        elif os.path.exists(self._filename) or os.path.exists(self._journal_filename):
+            self._load()
+            if (os.path.exists(self._filename) and not os.access(self._filename, os.W_OK)) or \
+               not os.access(test_dir, os.W_OK):
                 self._no_io = True
         else:
             expect(test_name is not None, "Must provide test_name if TestStatus file doesn't exist")
 
     def __enter__(self):
+        # Pick up changes made by other writers since this object was loaded
+        if not self._no_io and (os.path.exists(self._filename) or os.path.exists(self._journal_filename)):
+            self._load()
+
         self._ok_to_modify = True
         return self
 
@@ -162,6 +334,12 @@ class TestStatus(object):
     def get_name(self):
         return self._test_name
 
+    def get_sequence_number(self):
+        """
+        The sequence number of the last change in this object, see get_test_status_sequence_number
+        """
+        return self._seq
+
     def set_status(self, phase, status, comments=""):
         """
         Update the status of this test by changing the status of given phase to the
@@ -208,6 +386,14 @@ class TestStatus(object):
                 expect(self._phase_statuses[previous_core_phase][0] == TEST_PASS_STATUS,
                        "Cannot move past core phase '{}', it didn't pass: ".format(previous_core_phase))
 
+        self._apply_status(phase, status, comments)
+        if not self._no_io:
+            self._append_to_journal(phase, status, comments)
+
+    def _apply_status(self, phase, status, comments):
+        """
+        Change the status of phase in memory, along with the phases it implies
+        """
         reran_phase = (phase in self._phase_statuses and self._phase_statuses[phase][0] != TEST_PEND_STATUS and phase in CORE_PHASES)
         if reran_phase:
             # All subsequent phases are invalidated
@@ -284,9 +470,73 @@ class TestStatus(object):
                     non_pass_counts[phase] += 1
 
     def flush(self):
-        if self._phase_statuses and not self._no_io:
-            with open(self._filename, "w") as fd:
-                fd.write(self.phase_statuses_dump())
+        """
+        Compact the journal into the TestStatus file. The file is replaced
+        atomically and includes changes made by other writers.
+        """
+        if not self._needs_compaction or self._no_io:
+            return
+
+        with open(self._journal_filename, "a+") as fd:
+            with _journal_lock(fd, True):
+                self._load_locked(fd)
+                tmp_filename = "{}.{:d}.{:d}.tmp".format(self._filename, os.getpid(), threading.current_thread().ident)
+                with open(tmp_filename, "w") as tmp_fd:
+                    tmp_fd.write(self.phase_statuses_dump())
+                if os.path.exists(self._filename):
+                    os.chmod(tmp_filename, stat.S_IMODE(os.stat(self._filename).st_mode))
+                os.rename(tmp_filename, self._filename)
+
+                fd.seek(0)
+                fd.truncate()
+                fd.write("{:d}\n".format(self._seq))
+                fd.flush()
+
+                # Still under the lock, so the index gets updates in the same order as the file
+                _update_test_status_index(os.path.dirname(self._filename), self._test_name, self._seq,
+                                          self.phase_statuses_dump())
+
+        self._needs_compaction = False
+
+    def _append_to_journal(self, phase, status, comments):
+        with open(self._journal_filename, "a+") as fd:
+            with _journal_lock(fd, True):
+                self._seq = _read_journal(fd)[1] + 1
+                fd.write("{:d} {} {} {} {}".format(self._seq, status, self._test_name, phase, comments).rstrip() + "\n")
+
+        self._needs_compaction = True
+
+    def _load(self):
+        """
+        Load phase statuses from the TestStatus file and the journal
+        """
+        if os.path.exists(self._journal_filename):
+            try:
+                with open(self._journal_filename, "r") as fd:
+                    with _journal_lock(fd, False):
+                        self._load_locked(fd)
+                return
+            except (IOError, OSError):
+                # The journal was removed or cannot be read
+                pass
+
+        self._load_locked(None)
+
+    def _load_locked(self, journal_fd):
+        self._phase_statuses = OrderedDict()
+        if os.path.exists(self._filename):
+            self._parse_test_status_file()
+
+        if journal_fd is not None:
+            entries, self._seq = _read_journal(journal_fd)
+            for status, curr_test_name, phase, comments in entries:
+                if (self._test_name is None):
+                    self._test_name = curr_test_name
+                else:
+                    expect(self._test_name == curr_test_name,
+                           "inconsistent test name in TestStatus journal: '{}' != '{}'".format(self._test_name, curr_test_name))
+
+                self._apply_status(phase, status, comments)
 
     def _parse_test_status(self, file_contents):
         """
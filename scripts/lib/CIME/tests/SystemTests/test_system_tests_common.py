@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+"""
+This module contains unit tests of the baseline performance comparisons of
+SystemTestsCommon.
+"""
+
+# pylint:disable=protected-access
+
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from CIME.SystemTests.system_tests_common import SystemTestsCommon
+from CIME import provenance
+import CIME.test_status as test_status
+from CIME.tests.case_fake import CaseFake
+
+def _write_cpl_log(path, throughput):
+    with gzip.open(path, "wb") as fd:
+        fd.write("# simulated years / cmp-day =   {:.3f}  \n".format(throughput).encode("utf-8"))
+
+class SystemTestsCommonFake(SystemTestsCommon):
+
+    # Stubs of methods called by SystemTestsCommon.__init__ that interact with
+    # the file system
+    def _init_environment(self, caseroot):
+        pass
+
+    def _init_locked_files(self, caseroot, expected):
+        pass
+
+class TestComparePerformance(unittest.TestCase):
+
+    def setUp(self):
+        self._tempdir = tempfile.mkdtemp()
+        self._baseline_root = os.path.join(self._tempdir, "baselines")
+        self._baseline_dir = os.path.join(self._baseline_root, "master", "ERS.f19_g16.X")
+        os.makedirs(self._baseline_dir)
+        _write_cpl_log(os.path.join(self._baseline_dir, "cpl.log.gz"), 5.0)
+
+        self._case = CaseFake(os.path.join(self._tempdir, "case"))
+        for item, value in [("BASELINE_ROOT", self._baseline_root), ("BASECMP_CASE", "master/ERS.f19_g16.X"),
+                            ("SRCROOT", self._tempdir), ("TEST_TPUT_TOLERANCE", 0.25)]:
+            self._case.set_value(item, value)
+        os.makedirs(self._case.get_value("RUNDIR"))
+
+    def tearDown(self):
+        shutil.rmtree(self._tempdir)
+
+    def _compare_throughput(self, throughput):
+        _write_cpl_log(os.path.join(self._case.get_value("RUNDIR"), "cpl.log.123-456.gz"), throughput)
+        test = SystemTestsCommonFake(self._case)
+        test._compare_throughput()
+        return test._test_status.get_status(test_status.THROUGHPUT_PHASE)
+
+    def test_legacy_baseline(self):
+        """Without samples, the baseline log is compared with the fixed tolerance and becomes the first sample"""
+        self.assertEqual(self._compare_throughput(4.0), test_status.TEST_PASS_STATUS)
+        self.assertEqual(provenance.get_perf_samples(self._baseline_root, "master/ERS.f19_g16.X/cpl.log", "throughput"),
+                         [5.0, 4.0])
+
+    def _save_samples(self, values):
+        for value in values:
+            provenance.save_perf_sample(self._baseline_root, "master/ERS.f19_g16.X/cpl.log", "throughput", value, "abc")
+
+    def _get_samples(self):
+        return provenance.get_perf_samples(self._baseline_root, "master/ERS.f19_g16.X/cpl.log", "throughput")
+
+    def test_tolerance_is_floor(self):
+        """Samples with little spread do not make the bound narrower than the tolerance"""
+        self._save_samples([5.0, 5.02, 4.98, 5.01] * 3)
+        self.assertEqual(self._compare_throughput(4.5), test_status.TEST_PASS_STATUS)
+        self.assertEqual(len(self._get_samples()), 13)
+
+    def test_sample_bounds(self):
+        """With enough noisy samples, the bound follows their spread; failing samples are not recorded"""
+        self._save_samples([5.0, 4.0, 6.0, 4.5, 5.5] * 2)
+        self.assertEqual(self._compare_throughput(3.5), test_status.TEST_PASS_STATUS)
+        self.assertEqual(self._compare_throughput(2.0), test_status.TEST_FAIL_STATUS)
+        self.assertEqual(len(self._get_samples()), 11)
+
+if __name__ == '__main__':
+    unittest.main()
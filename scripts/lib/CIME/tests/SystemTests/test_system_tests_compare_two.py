@@ -134,6 +134,7 @@ class SystemTestsCompareTwoFake(SystemTestsCompareTwo):
             self.run_pass_caseroot.append(self._case2.get_value('CASEROOT'))
 
         self.compare_should_pass = compare_should_pass
+        self.compare_stop_on_diff = None
 
         self.log = []
 
@@ -179,11 +180,12 @@ class SystemTestsCompareTwoFake(SystemTestsCompareTwo):
         if caseroot not in self.run_pass_caseroot:
             raise RuntimeError('caseroot not in run_pass_caseroot')
 
-    def _do_compare_test(self, suffix1, suffix2, ignore_fieldlist_diffs=False):
+    def _do_compare_test(self, suffix1, suffix2, ignore_fieldlist_diffs=False, stop_on_diff=False):
         """
         This fake implementation allows controlling whether compare_test
         passes or fails
         """
+        self.compare_stop_on_diff = stop_on_diff
         return (self.compare_should_pass, "no comment")
 
     def _check_for_memleak(self):
@@ -558,5 +560,24 @@ class TestSystemTestsCompareTwo(unittest.TestCase):
         self.assertEqual(test_status.TEST_FAIL_STATUS,
                          mytest._test_status.get_status(compare_phase_name))
 
+    def test_compare_success_change(self):
+        # Make sure that a comparison requiring differences stops at the first
+        # one, and that differences are reported as a pass
+
+        # Setup
+        case1root = os.path.join(self.tempdir, 'case1')
+        case1 = CaseFake(case1root)
+        mytest = SystemTestsCompareTwoFake(case1,
+                                           compare_should_pass = False)
+
+        # Exercise
+        success = mytest._component_compare_test('base', 'test', success_change=True)
+
+        # Verify
+        self.assertTrue(success)
+        self.assertTrue(mytest.compare_stop_on_diff)
+        mytest._component_compare_test('base', 'test')
+        self.assertFalse(mytest.compare_stop_on_diff)
+
 if __name__ == "__main__":
     unittest.main(verbosity=2, catchbreak=True)
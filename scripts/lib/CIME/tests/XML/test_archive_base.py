@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import shutil
+import tempfile
+from CIME.date import date
+from CIME.XML.archive_base import ArchiveBase, ArchiveDirSnapshot
+from CIME.XML.generic_xml import GenericXML
+
+_ARCHIVE_SPEC = """<?xml version="1.0"?>
+<components version="2.0">
+  <comp_archive_spec compname="cam" compclass="atm">
+    <rest_file_extension>r</rest_file_extension>
+    <hist_file_extension>h\\d*.*\\.nc$</hist_file_extension>
+    <hist_file_extension>i</hist_file_extension>
+  </comp_archive_spec>
+  <comp_archive_spec compname="drv" compclass="cpl">
+    <hist_file_extension>hi\\..*\\.nc$</hist_file_extension>
+  </comp_archive_spec>
+</components>
+"""
+
+_RUNDIR_FILES = ["case.cam.h0.0001-01.nc", "case.cam.h0.0001-02.nc", "case.cam.h1.0001-01-01-00000.nc",
+                 "case.cam.i.0002-01-01-00000.nc", "case.cam.r.0002-01-01-00000.nc",
+                 "case.cam.h0.0001-02.nc.base", "case.cam.h0.0001-02.nc.base.cprnc.out",
+                 "case.cpl.hi.0001-01-02-00000.nc", "case.cpl.log.1234", "refcase.cam.h0.0001-01.nc"]
+
+class TestArchiveDirSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self._workdir = tempfile.mkdtemp()
+        self._spec_file = os.path.join(self._workdir, "config_archive.xml")
+        with open(self._spec_file, "w") as fd:
+            fd.write(_ARCHIVE_SPEC)
+        self._archive = ArchiveBase(infile=self._spec_file)
+        self._snapshot = ArchiveDirSnapshot(self._archive, self._workdir, files=_RUNDIR_FILES)
+
+    def tearDown(self):
+        GenericXML.invalidate(self._spec_file)
+        shutil.rmtree(self._workdir)
+
+    def test_all_hist_files(self):
+        """Each component gets the files matching any of its extensions, with or without a suffix"""
+        self.assertEqual(self._snapshot.get_all_hist_files("case", "cam", ref_case="refcase"),
+                         ["case.cam.h0.0001-01.nc", "case.cam.h0.0001-02.nc",
+                          "case.cam.h1.0001-01-01-00000.nc", "case.cam.i.0002-01-01-00000.nc"])
+        self.assertEqual(self._snapshot.get_all_hist_files("case", "cam", suffix="base"),
+                         ["case.cam.h0.0001-02.nc.base"])
+        self.assertEqual(self._snapshot.get_all_hist_files("case", "cpl"), ["case.cpl.hi.0001-01-02-00000.nc"])
+        self.assertEqual(self._snapshot.get_all_hist_files("case", "clm"), [])
+
+    def test_latest_and_by_date(self):
+        """Files can be looked up by extension, latest first, and by date"""
+        self.assertEqual(self._snapshot.get_latest_hist_files("case", "cam", ref_case="refcase"),
+                         ["case.cam.h0.0001-02.nc", "case.cam.h1.0001-01-01-00000.nc",
+                          "case.cam.i.0002-01-01-00000.nc"])
+        by_date = self._snapshot.get_hist_files_by_date("case", "cam", ref_case="refcase")
+        self.assertEqual(by_date,
+                         [(date(1, 1, 1), ["case.cam.h0.0001-01.nc", "case.cam.h1.0001-01-01-00000.nc"]),
+                          (date(1, 2, 1), ["case.cam.h0.0001-02.nc"]),
+                          (date(2, 1, 1), ["case.cam.i.0002-01-01-00000.nc"])])
+
+if __name__ == '__main__':
+    unittest.main()
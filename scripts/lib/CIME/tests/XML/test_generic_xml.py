@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+
+import unittest
+import gc
+import io
+import logging
+import os
+import shutil
+import tempfile
+import stat
+import time
+import weakref
+from CIME.XML import generic_xml
+from CIME.XML.generic_xml import GenericXML
+from CIME.utils import EnvironmentContext
+
+logger = logging.getLogger(__name__)
+
+class TestPersistentCache(unittest.TestCase):
+
+    def setUp(self):
+        self._workdir = tempfile.mkdtemp()
+        self._cachedir = os.path.join(self._workdir, "cache")
+        self._main_file = os.path.join(self._workdir, "main.xml")
+        self._include_file = os.path.join(self._workdir, "include.xml")
+        with open(self._main_file, "w") as fd:
+            fd.write("""<?xml version="1.0"?>
+<config xmlns:xi="http://www.w3.org/2001/XInclude">
+  <item id="a">1</item>
+  <xi:include href="include.xml"/>
+</config>
+""")
+        self._write_include("2")
+        # The test files do not live in CIMEROOT
+        self._is_candidate = generic_xml._is_persistent_cache_candidate
+        generic_xml._is_persistent_cache_candidate = lambda _: True
+
+    def tearDown(self):
+        generic_xml._is_persistent_cache_candidate = self._is_candidate
+        GenericXML.invalidate(self._main_file)
+        GenericXML.invalidate(self._include_file)
+        shutil.rmtree(self._workdir)
+
+    def _write_include(self, value):
+        with open(self._include_file, "w") as fd:
+            fd.write("""<?xml version="1.0"?>
+<config>
+  <item id="b">{}</item>
+</config>
+""".format(value))
+
+    def _read_values(self):
+        GenericXML.invalidate(self._main_file)
+        obj = GenericXML(self._main_file)
+        return [(obj.get(node, "id"), obj.text(node)) for node in obj.get_children("item")]
+
+    def test_persistent_cache_roundtrip(self):
+        """A second read in a fresh process-level cache comes from disk and matches"""
+        with EnvironmentContext(CIME_XML_CACHE_DIR=self._cachedir):
+            first = self._read_values()
+            self.assertEqual(len(os.listdir(self._cachedir)), 1)
+            second = self._read_values()
+
+        self.assertEqual(first, [("a", "1"), ("b", "2")])
+        self.assertEqual(first, second)
+
+    def test_persistent_cache_tracks_includes(self):
+        """Changing an included file invalidates the cached parent"""
+        with EnvironmentContext(CIME_XML_CACHE_DIR=self._cachedir):
+            self._read_values()
+            self._write_include("three")
+            # Make sure the signature changes even on coarse mtime filesystems
+            os.utime(self._include_file, (0, 0))
+            values = self._read_values()
+
+        self.assertEqual(values, [("a", "1"), ("b", "three")])
+
+    def test_persistent_cache_checks_contents(self):
+        """A change that keeps the size and mtime of a file still invalidates the entry"""
+        with EnvironmentContext(CIME_XML_CACHE_DIR=self._cachedir):
+            self._read_values()
+            mtime = os.path.getmtime(self._include_file)
+            self._write_include("3")
+            os.utime(self._include_file, (mtime, mtime))
+            # The process-level cache only checks mtimes
+            GenericXML.invalidate(self._include_file)
+            values = self._read_values()
+
+        self.assertEqual(values, [("a", "1"), ("b", "3")])
+
+    def test_persistent_cache_shared(self):
+        """Entries are readable by the other users of a shared cache directory"""
+        with EnvironmentContext(CIME_XML_CACHE_DIR=self._cachedir):
+            self._read_values()
+
+        for name in os.listdir(self._cachedir):
+            self.assertTrue(os.stat(os.path.join(self._cachedir, name)).st_mode & stat.S_IROTH)
+
+    def test_persistent_cache_eviction(self):
+        """The least recently used entries are removed once the cache is full"""
+        max_entries = generic_xml._PERSISTENT_CACHE_MAX_ENTRIES
+        try:
+            generic_xml._PERSISTENT_CACHE_MAX_ENTRIES = 2
+            with EnvironmentContext(CIME_XML_CACHE_DIR=self._cachedir):
+                paths = [generic_xml._get_persistent_cache_path(self._cachedir, str(i), None) for i in range(3)]
+                for i, path in enumerate(paths[:2]):
+                    generic_xml.store_persistent_cache_entry(path, i)
+                    os.utime(path, (i, i))
+
+                self.assertEqual(generic_xml.load_persistent_cache_entry(paths[0]), 0)
+                generic_xml.store_persistent_cache_entry(paths[2], 2)
+        finally:
+            generic_xml._PERSISTENT_CACHE_MAX_ENTRIES = max_entries
+
+        self.assertEqual(sorted(os.listdir(self._cachedir)),
+                         sorted(os.path.basename(path) for path in [paths[0], paths[2]]))
+
+    def test_persistent_cache_case_files(self):
+        """Files outside of CIMEROOT are not persisted"""
+        generic_xml._is_persistent_cache_candidate = self._is_candidate
+        with EnvironmentContext(CIME_XML_CACHE_DIR=self._cachedir):
+            self._read_values()
+
+        self.assertFalse(os.path.exists(self._cachedir))
+
+    def test_persistent_cache_disabled(self):
+        """An empty CIME_XML_CACHE_DIR disables the on-disk cache"""
+        with EnvironmentContext(CIME_XML_CACHE_DIR=""):
+            self._read_values()
+
+        self.assertFalse(os.path.exists(self._cachedir))
+
+class TestScanChildrenIndex(unittest.TestCase):
+
+    def setUp(self):
+        self._workdir = tempfile.mkdtemp()
+        self._xml_filepath = os.path.join(self._workdir, "grids.xml")
+        entries = []
+        for i in range(400):
+            entries.append('  <gridmap atm_grid="a{:d}" ocn_grid="o{:d}"{}>'
+                           '<map name="ATM2OCN_FMAPNAME">f{:d}</map></gridmap>'.format(
+                               i % 40, i % 7, ' kind="x"' if i % 3 == 0 else "", i))
+        with open(self._xml_filepath, "w") as fd:
+            fd.write('<?xml version="1.0"?>\n<config>\n{}\n</config>\n'.format("\n".join(entries)))
+
+    def tearDown(self):
+        GenericXML.DISABLE_INDEXING = False
+        GenericXML.invalidate(self._xml_filepath)
+        shutil.rmtree(self._workdir)
+
+    def _queries(self):
+        queries = [("gridmap", None), ("map", {"name": "ATM2OCN_FMAPNAME"}),
+                   ("gridmap", {"kind": None}), ("gridmap", {"kind": "y"}), ("missing", None)]
+        for atm in range(0, 40, 3):
+            queries.append(("gridmap", {"atm_grid": "a{:d}".format(atm), "ocn_grid": "o{:d}".format(atm % 7)}))
+            queries.append(("gridmap", {"atm_grid": "a{:d}".format(atm), "kind": None}))
+
+        return queries
+
+    def _run_queries(self, obj, queries):
+        return [[obj.text(node) if obj.text(node) else obj.attrib(node) for node in obj.scan_children(name, attributes=attributes)]
+                for name, attributes in queries]
+
+    def test_index_matches_xpath(self):
+        """The indexed lookup returns the same nodes, in the same order, as xpath"""
+        obj = GenericXML(self._xml_filepath, read_only=False)
+        queries = self._queries()
+        indexed = self._run_queries(obj, queries)
+        GenericXML.DISABLE_INDEXING = True
+        self.assertEqual(indexed, self._run_queries(obj, queries))
+
+    def test_index_invalidated_on_mutation(self):
+        """add_child, remove_child and set are visible to subsequent scans"""
+        obj = GenericXML(self._xml_filepath, read_only=False)
+        node = obj.scan_child("gridmap", attributes={"atm_grid": "a30", "ocn_grid": "o3"})
+        obj.set(node, "atm_grid", "new")
+        self.assertEqual(len(obj.scan_children("gridmap", attributes={"atm_grid": "new"})), 1)
+        obj.remove_child(node)
+        self.assertEqual(obj.scan_children("gridmap", attributes={"atm_grid": "new"}), [])
+        obj.add_child(node)
+        self.assertEqual(obj.scan_children("gridmap", attributes={"atm_grid": "new"}), [node])
+
+    def test_index_invalidated_across_trees(self):
+        """Changing nodes of a tree through an object for another tree is visible in scans of the first"""
+        owner = GenericXML(self._xml_filepath, read_only=False)
+        other = GenericXML(read_only=False)
+        other.read_fd(io.StringIO(u'<?xml version="1.0"?>\n<config/>\n'))
+        node = owner.scan_child("gridmap", attributes={"atm_grid": "a30", "ocn_grid": "o3"})
+        map_node = owner.get_child("map", root=node)
+        self.assertEqual(len(owner.scan_children("map", attributes={"name": "ATM2OCN_FMAPNAME"})), 400)
+
+        other.remove_child(map_node, root=node)
+        self.assertEqual(len(owner.scan_children("map", attributes={"name": "ATM2OCN_FMAPNAME"})), 399)
+        other.add_child(map_node, root=node)
+        other.set(map_node, "name", "OCN2ATM_FMAPNAME")
+        self.assertEqual(len(owner.scan_children("map", attributes={"name": "OCN2ATM_FMAPNAME"})), 1)
+
+    def test_index_freed(self):
+        """The index of a tree goes away with the tree"""
+        obj = GenericXML(self._xml_filepath, read_only=False)
+        obj.scan_children("gridmap")
+        GenericXML.invalidate(self._xml_filepath)
+        root_ref = weakref.ref(obj.root.xml_element)
+        del obj
+        gc.collect()
+        self.assertIsNone(root_ref())
+
+    def test_index_benchmark(self):
+        """Report query throughput of the indexed lookup against the xpath path"""
+        obj = GenericXML(self._xml_filepath)
+        queries = self._queries() * 20
+        rates = {}
+        for disable in (True, False):
+            GenericXML.DISABLE_INDEXING = disable
+            start = time.time()
+            self._run_queries(obj, queries)
+            rates["xpath" if disable else "indexed"] = len(queries) / max(time.time() - start, 1e-9)
+
+        logger.info("scan_children throughput (queries/s): xpath {:.0f}, indexed {:.0f}".format(rates["xpath"], rates["indexed"]))
+
+if __name__ == '__main__':
+    unittest.main()
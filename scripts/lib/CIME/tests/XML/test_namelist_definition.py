@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+from CIME.XML import namelist_definition
+from CIME.XML.namelist_definition import NamelistDefinition
+from CIME.XML.entry_id import EntryID
+from CIME.XML.generic_xml import GenericXML
+from CIME.utils import EnvironmentContext, CIMEError
+
+_DEFINITION = """<?xml version="1.0"?>
+<entry_id version="2.0">
+  <entry id="datamode">
+    <type>char</type>
+    <category>streams</category>
+    <group>dwav_nml</group>
+    <valid_values>NULL,COPYALL</valid_values>
+    <values match="last">
+      <value>NULL</value>
+      <value wav="dwav">COPYALL</value>
+      <value wav="d.*">other</value>
+    </values>
+  </entry>
+  <entry id="nx" modify_via_xml="WAV_NX">
+    <type>integer(2)</type>
+    <category>grid</category>
+    <group>dwav_nml</group>
+    <values>
+      <value grid="1x1">1</value>
+      <value grid="1x1" wav="dwav">2</value>
+    </values>
+  </entry>
+  <entry id="filename" per_stream_entry="true">
+    <type>char*256</type>
+    <category>streams</category>
+    <group>shr_strdata_nml</group>
+    <input_pathname>abs</input_pathname>
+  </entry>
+</entry_id>
+"""
+
+class FilesFake(object):
+
+    def get_schema(self, _):
+        return None
+
+class TestNamelistDefinition(unittest.TestCase):
+
+    def setUp(self):
+        self._workdir = tempfile.mkdtemp()
+        self._cachedir = os.path.join(self._workdir, "cache")
+        self._definition_file = os.path.join(self._workdir, "namelist_definition_dwav.xml")
+        with open(self._definition_file, "w") as fd:
+            fd.write(_DEFINITION)
+        namelist_definition._SCHEMAS.clear()
+
+    def tearDown(self):
+        GenericXML.invalidate(self._definition_file)
+        namelist_definition._SCHEMAS.clear()
+        shutil.rmtree(self._workdir)
+
+    def test_schema(self):
+        """Lookups answered from the compiled schema agree with the XML"""
+        with EnvironmentContext(CIME_XML_CACHE_DIR=""):
+            definition = NamelistDefinition(self._definition_file, files=FilesFake())
+
+        default_nodes = definition.set_nodes(skip_groups=["shr_strdata_nml"])
+        self.assertEqual([definition.get(node, "id") for node in default_nodes], ["datamode", "nx"])
+        self.assertEqual(len(definition.get_entry_nodes()), 2)
+        self.assertEqual(definition.get_group("DATAMODE"), "dwav_nml")
+        self.assertEqual(definition.split_type_string("nx"), ("integer", None, 2))
+        self.assertEqual(definition.split_type_string("filename"), ("character", 256, 1))
+        self.assertEqual(definition.get_per_stream_entries(), ["filename"])
+        self.assertEqual(definition.get_input_pathname("filename"), "abs")
+        self.assertTrue(definition.is_valid_value("datamode", ["'COPYALL'"]))
+        self.assertFalse(definition.is_valid_value("datamode", ["'COPY'"]))
+        with self.assertRaises(CIMEError):
+            definition._user_modifiable_in_variable_definition("nx")
+
+        for attributes in [{}, {"wav" : "dwav"}, {"wav" : "dwav", "grid" : "1x1"}, {"grid" : "1x1"}]:
+            for exact_match in (True, False):
+                for node in definition.get_children("entry"):
+                    vid = definition.get(node, "id")
+                    expected = EntryID.get_value_match(definition, vid, attributes=attributes,
+                                                       exact_match=exact_match, entry_node=node)
+                    self.assertEqual(definition.get_value_match(vid, attributes=attributes, exact_match=exact_match),
+                                     definition._split_defaults_text(expected) if expected is not None else '')
+
+    def test_default_value_lookup(self):
+        """Default values are looked up once per value of the attributes they depend on"""
+        with EnvironmentContext(CIME_XML_CACHE_DIR=""):
+            definition = NamelistDefinition(self._definition_file, files=FilesFake())
+
+        config = {"wav" : "dwav", "ocn" : "docn"}
+        definition.add_attributes(config)
+        self.assertEqual(definition.get_value_match("datamode", exact_match=False), ["other"])
+        self.assertEqual(definition.get_value_match("datamode"), ["COPYALL"])
+
+        match_default_value = namelist_definition._match_default_value
+        try:
+            namelist_definition._match_default_value = None
+            value = definition.get_value_match("datamode", attributes={"ocn" : "pop"})
+            value.append("changed")
+            self.assertEqual(definition.get_value_match("datamode"), ["COPYALL"])
+        finally:
+            namelist_definition._match_default_value = match_default_value
+
+        config["wav"] = "xwav"
+        self.assertEqual(definition.get_value_match("datamode"), ["NULL"])
+        self.assertEqual(definition.get_value_match("nx", attributes={"wav" : "dwav", "grid" : "1x1"}), ["2"])
+
+    def test_schema_cache(self):
+        """The schema is compiled once, shared in the process and reused from disk"""
+        with EnvironmentContext(CIME_XML_CACHE_DIR=self._cachedir):
+            first = NamelistDefinition(self._definition_file, files=FilesFake())
+            self.assertIs(NamelistDefinition(self._definition_file, files=FilesFake())._schema, first._schema)
+            self.assertEqual(len([name for name in os.listdir(self._cachedir) if name.startswith("nmldef-")]), 1)
+
+            namelist_definition._SCHEMAS.clear()
+            compile_schema = NamelistDefinition._compile_schema
+            try:
+                NamelistDefinition._compile_schema = None
+                second = NamelistDefinition(self._definition_file, files=FilesFake())
+            finally:
+                NamelistDefinition._compile_schema = compile_schema
+
+        self.assertEqual(second._schema, first._schema)
+
+if __name__ == '__main__':
+    unittest.main()
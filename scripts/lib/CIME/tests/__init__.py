@@ -0,0 +1,9 @@
+import atexit
+import os
+import shutil
+import tempfile
+
+# Keep the on-disk parse cache filled by the unit tests out of the user's
+# ~/.cime/xml_cache
+os.environ["CIME_XML_CACHE_DIR"] = tempfile.mkdtemp(prefix="cime_xml_cache")
+atexit.register(shutil.rmtree, os.environ["CIME_XML_CACHE_DIR"], True)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+from CIME.case import Case
+
+_ENV_FILE = """<?xml version="1.0"?>
+<file id="{name}" version="2.0">
+  <header>test</header>
+  <group id="test">
+{entries}
+  </group>
+</file>
+"""
+
+_ENTRIES = {
+    "env_case.xml"  : [("CASE", "mycase", "char"), ("CIME_OUTPUT_ROOT", "/out", "char"),
+                       ("TOOL", "$SHELL{{cat {tool_file}}}", "char")],
+    "env_run.xml"   : [("RUNDIR", "$CIME_OUTPUT_ROOT/$CASE/run", "char"), ("DOUT_S_ROOT", "$RUNDIR/archive", "char"),
+                       ("STOP_N", "5", "integer")],
+    "env_build.xml" : [("EXEROOT", "$CIME_OUTPUT_ROOT/$CASE/bld", "char"), ("STOP_N", "ten", "char")],
+}
+
+class TestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._caseroot = tempfile.mkdtemp()
+        self._tool_file = os.path.join(self._caseroot, "tool")
+        self._write_tool("gnu")
+        for name, entries in _ENTRIES.items():
+            self._write_env_file(name, entries)
+
+        # Writes the other env files
+        with Case(self._caseroot, read_only=False):
+            pass
+
+    def tearDown(self):
+        shutil.rmtree(self._caseroot)
+
+    def _write_tool(self, text):
+        with open(self._tool_file, "w") as fd:
+            fd.write(text)
+
+    def _write_env_file(self, name, entries):
+        path = os.path.join(self._caseroot, name)
+        with open(path, "w") as fd:
+            fd.write(_ENV_FILE.format(name=name, entries="\n".join(
+                '    <entry id="{}" value="{}"><type>{}</type></entry>'.format(
+                    vid, value.format(tool_file=self._tool_file), vtype) for vid, value, vtype in entries)))
+
+        # Make sure the file is read again even on coarse mtime filesystems
+        mtime = os.path.getmtime(path) + 10 if os.path.exists(path) else None
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+
+    def test_resolved_values_set_value(self):
+        """set_value drops the resolved values depending on the variable, directly or not"""
+        with Case(self._caseroot, read_only=False) as case:
+            self.assertEqual(case.get_value("DOUT_S_ROOT"), "/out/mycase/run/archive")
+            self.assertEqual(case.get_value("EXEROOT"), "/out/mycase/bld")
+            case.set_value("CIME_OUTPUT_ROOT", "/scratch")
+            self.assertEqual(case.get_value("DOUT_S_ROOT"), "/scratch/mycase/run/archive")
+            self.assertEqual(case.get_value("EXEROOT"), "/scratch/mycase/bld")
+            case.set_value("RUNDIR", "/run")
+            self.assertEqual(case.get_value("DOUT_S_ROOT"), "/run/archive")
+
+    def test_resolved_values_read_xml(self):
+        """Reading the env files again drops all resolved values"""
+        with Case(self._caseroot, read_only=False) as case:
+            self.assertEqual(case.get_value("EXEROOT"), "/out/mycase/bld")
+            self._write_env_file("env_case.xml", [("CASE", "other", "char"), ("CIME_OUTPUT_ROOT", "/out", "char")])
+            case.read_xml()
+            self.assertEqual(case.get_value("EXEROOT"), "/out/other/bld")
+
+    def test_resolved_values_env_file(self):
+        """Changes made through an env file rather than the case drop all resolved values"""
+        with Case(self._caseroot, read_only=False) as case:
+            self.assertEqual(case.get_value("EXEROOT"), "/out/mycase/bld")
+            case.get_env("case").set_value("CASE", "other")
+            self.assertEqual(case.get_value("EXEROOT"), "/out/other/bld")
+
+    def test_resolved_values_shell(self):
+        """Values involving $SHELL{} are not remembered"""
+        with Case(self._caseroot, read_only=False) as case:
+            self.assertEqual(case.get_value("TOOL"), "gnu")
+            self._write_tool("intel")
+            self.assertEqual(case.get_value("TOOL"), "intel")
+
+    def test_env_index(self):
+        """Looking variables up in their owning env file first finds what scanning all files finds"""
+        with Case(self._caseroot, read_only=False) as case:
+            variables = ["CASE", "STOP_N", "RUNDIR", "DOUT_S_ROOT", "EXEROOT"]
+            def lookup():
+                return [(case.get_value(vid), case.get_value(vid, resolved=False), case.get_values(vid),
+                         case.get_type_info(vid)) for vid in variables] + [case.get_value("MISSING")]
+
+            indexed = lookup()
+            self.assertEqual(indexed[1], (5, 5, [5], "integer"))
+            self.assertEqual(case._env_index["STOP_N"], case.get_env("run"))
+
+            def full_scan(item, env_files=None):
+                return case._files if env_files is None else env_files
+
+            case._get_env_files = full_scan
+            self.assertEqual(lookup(), indexed)
+
+    def test_env_index_updates(self):
+        """set_value goes to the owning env file, variables the index misses are found and added"""
+        with Case(self._caseroot, read_only=False) as case:
+            self.assertEqual(case.set_value("STOP_N", 7, return_file=True)[1], case.get_env("run").filename)
+            self.assertEqual(case.get_env("build").get_value("STOP_N"), "ten")
+
+            del case._env_index["EXEROOT"]
+            self.assertEqual(case.get_value("EXEROOT"), "/out/mycase/bld")
+            self.assertIs(case._env_index["EXEROOT"], case.get_env("build"))
+            self.assertEqual(case.get_value("MISSING"), None)
+            self.assertNotIn("MISSING", case._env_index)
+
+    def test_values_dict(self):
+        """get_values_dict returns what get_value returns for each variable"""
+        with Case(self._caseroot, read_only=False) as case:
+            variables = ["CASE", "STOP_N", "RUNDIR", "DOUT_S_ROOT", "EXEROOT", "MISSING"]
+            del case._env_index["EXEROOT"]
+            for resolved in (True, False):
+                self.assertEqual(case.get_values_dict(variables, resolved=resolved),
+                                 dict((vid, case.get_value(vid, resolved=resolved)) for vid in variables))
+
+            # Each env file is asked only for the variables it owns
+            asked = []
+            for env_file in case._env_entryid_files:
+                def get_value(vid, attribute=None, resolved=True, subgroup=None, env_file=env_file,
+                              orig_get_value=env_file.get_value):
+                    asked.append((vid, env_file))
+                    return orig_get_value(vid, attribute, resolved=resolved, subgroup=subgroup)
+                env_file.get_value = get_value
+
+            self.assertEqual(case.get_values_dict(["STOP_N", "EXEROOT"]), {"STOP_N" : 5, "EXEROOT" : "/out/mycase/bld"})
+            self.assertEqual(asked, [("STOP_N", case.get_env("run")), ("EXEROOT", case.get_env("build"))])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import shutil
+import stat
+import tempfile
+from CIME.case import case_st_archive
+from CIME.XML.archive_base import ArchiveBase
+from CIME.XML.generic_xml import GenericXML
+
+_ARCHIVE_SPEC = """<?xml version="1.0"?>
+<components version="2.0">
+  <comp_archive_spec compname="cam" compclass="atm">
+    <rest_file_extension>r</rest_file_extension>
+    <hist_file_extension>h\\d*.*\\.nc$</hist_file_extension>
+    <rest_history_varname>unset</rest_history_varname>
+  </comp_archive_spec>
+  <comp_archive_spec compname="drv" compclass="cpl">
+    <rest_file_extension>r</rest_file_extension>
+    <hist_file_extension>hi\\..*\\.nc$</hist_file_extension>
+    <rest_history_varname>unset</rest_history_varname>
+  </comp_archive_spec>
+</components>
+"""
+
+class TestArchivePlan(unittest.TestCase):
+
+    def setUp(self):
+        self._workdir = tempfile.mkdtemp()
+        self._rundir = os.path.join(self._workdir, "run")
+        self._archdir = os.path.join(self._workdir, "archive")
+        os.makedirs(self._rundir)
+        for name in ["case.cam.h0.0001-01.nc", "case.cam.r.0001-02-01-00000.nc", "rpointer.atm"]:
+            with open(os.path.join(self._rundir, name), "w") as fd:
+                fd.write(name)
+
+    def tearDown(self):
+        shutil.rmtree(self._workdir)
+
+    def _plan(self):
+        plan = case_st_archive._ArchivePlan(self._rundir)
+        histfile = os.path.join(self._rundir, "case.cam.h0.0001-01.nc")
+        restfile = os.path.join(self._rundir, "case.cam.r.0001-02-01-00000.nc")
+        restdir = os.path.join(self._archdir, "rest")
+        histdir = os.path.join(self._archdir, "atm", "hist")
+        plan.makedirs(restdir)
+        plan.makedirs(histdir)
+        plan.copy(histfile, os.path.join(restdir, os.path.basename(histfile)))
+        plan.write(os.path.join(restdir, "rpointer.atm"), "case.cam.r.0001-02-01-00000.nc \n")
+        plan.remove(restfile)
+        plan.move(histfile, os.path.join(histdir, os.path.basename(histfile)))
+        return plan
+
+    def test_listing(self):
+        """The run directory listing follows the planned moves and removals"""
+        plan = self._plan()
+        self.assertEqual(plan.listdir(), ["rpointer.atm"])
+        self.assertEqual(plan.glob("rpointer.*"), [os.path.join(self._rundir, "rpointer.atm")])
+        self.assertFalse(plan.isfile(os.path.join(self._rundir, "case.cam.h0.0001-01.nc")))
+
+    def test_dry_run(self):
+        """Describing the plan changes nothing"""
+        lines = self._plan().describe()
+        self.assertEqual(len(lines), 6)
+        self.assertTrue(lines[0].startswith("creating directory"))
+        self.assertFalse(os.path.exists(self._archdir))
+        self.assertEqual(len(os.listdir(self._rundir)), 3)
+
+    def test_execute(self):
+        """Operations on one file run in order, whatever the number of workers"""
+        self._plan().execute(num_workers=4)
+        self.assertEqual(os.listdir(self._rundir), ["rpointer.atm"])
+        for subdir in ["rest", os.path.join("atm", "hist")]:
+            with open(os.path.join(self._archdir, subdir, "case.cam.h0.0001-01.nc"), "r") as fd:
+                self.assertEqual(fd.read(), "case.cam.h0.0001-01.nc")
+        with open(os.path.join(self._archdir, "rest", "rpointer.atm"), "r") as fd:
+            self.assertEqual(fd.read(), "case.cam.r.0001-02-01-00000.nc \n")
+
+    def test_copy_file(self):
+        """Copies keep the data and permissions of the source"""
+        src = os.path.join(self._rundir, "big.nc")
+        with open(src, "wb") as fd:
+            fd.write(os.urandom(3 * 1024 * 1024 + 7))
+        os.chmod(src, stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP)
+        dest = os.path.join(self._workdir, "big.nc")
+        case_st_archive._copy_file(src, dest)
+        with open(src, "rb") as fsrc, open(dest, "rb") as fdest:
+            self.assertEqual(fsrc.read(), fdest.read())
+        self.assertEqual(os.stat(src).st_mode, os.stat(dest).st_mode)
+
+class TestArchiveCompletedHistory(unittest.TestCase):
+
+    def setUp(self):
+        self._workdir = tempfile.mkdtemp()
+        self._rundir = os.path.join(self._workdir, "run")
+        os.makedirs(self._rundir)
+        self._spec_file = os.path.join(self._workdir, "config_archive.xml")
+        with open(self._spec_file, "w") as fd:
+            fd.write(_ARCHIVE_SPEC)
+
+    def tearDown(self):
+        GenericXML.invalidate(self._spec_file)
+        shutil.rmtree(self._workdir)
+
+    def test_completed_history(self):
+        """Only history files from before the last set of restart files are moved"""
+        names = ["case.cpl.r.0001-02-01-00000.nc", "case.cpl.r.0001-03-01-00000.nc",
+                 "case.cam.r.0001-03-01-00000.nc", "rpointer.atm", "cesm.log.1234",
+                 "case.cam.h0.0001-01.nc", "case.cam.h0.0001-02.nc", "case.cam.h0.0001-03.nc",
+                 "case.cpl.hi.0001-02-01-00000.nc"]
+        for name in names:
+            with open(os.path.join(self._rundir, name), "w") as fd:
+                fd.write(name)
+
+        num_moved = case_st_archive._archive_completed_history(ArchiveBase(infile=self._spec_file), ["cam", "drv"],
+                                                               "case", self._rundir, os.path.join(self._workdir, "archive"))
+        self.assertEqual(num_moved, 3)
+        self.assertEqual(sorted(os.listdir(os.path.join(self._workdir, "archive", "atm", "hist"))),
+                         ["case.cam.h0.0001-01.nc", "case.cam.h0.0001-02.nc"])
+        self.assertEqual(os.listdir(os.path.join(self._workdir, "archive", "cpl", "hist")),
+                         ["case.cpl.hi.0001-02-01-00000.nc"])
+        self.assertEqual(len(os.listdir(self._rundir)), len(names) - 3)
+
+if __name__ == '__main__':
+    unittest.main()
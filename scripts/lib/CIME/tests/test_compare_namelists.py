@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+from CIME import compare_namelists
+from CIME.compare_namelists import compare_namelist_files, is_namelist_file
+
+_DRV_IN = """&seq_timemgr_inparm
+  atm_cpl_dt = 1800
+  calendar = 'NO_LEAP'
+  stop_n = 5
+/
+&seq_infodata_inparm
+  case_name = 'ERS.f19_g16.A.machine_intel.G.20200101_000000_abcdef'
+  flux_epbal = 'off'
+  flux_albav = .false.
+  eps_frac = 1.0e-02
+  aoflux_grid = 'ocn'
+  orb_obliq = 23.4441
+/
+"""
+
+class TestCompareNamelists(unittest.TestCase):
+
+    def setUp(self):
+        self._tempdir = tempfile.mkdtemp()
+        compare_namelists._CACHE.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self._tempdir)
+
+    def _write(self, name, text):
+        path = os.path.join(self._tempdir, name)
+        with open(path, "w") as fd:
+            fd.write(text)
+        return path
+
+    def test_same_values_written_differently(self):
+        """Namelists that only differ in how the values are written match"""
+        gold = self._write("gold_in", "&nml\n val = 1, 1, 1, 2\n rval = 0.1\n lval = .true.\n"
+                                      " sval = 'a b'\n dval = 'one -> two', 'three -> four'\n/\n")
+        comp = self._write("comp_in", "&NML\n val = 3*1, 2 rval = 1.d-1, lval = T\n"
+                                      " sval = \"a b\" dval = 'three->four', 'one -> two' /\n")
+        self.assertEqual(compare_namelist_files(gold, comp), (True, ""))
+
+    def test_different_values(self):
+        """Real differences are still reported"""
+        gold = self._write("drv_in", _DRV_IN)
+        comp = self._write("drv_in.comp", _DRV_IN.replace("1.0e-02", "1.1e-02").replace("stop_n = 5", "stop_n = 6")
+                                                 .replace("20200101_000000_abcdef", "20200202_120000_fedcba"))
+        is_match, comments = compare_namelist_files(gold, comp, "ERS.f19_g16.A.machine_intel")
+        self.assertFalse(is_match)
+        self.assertEqual(comments,
+                         "  BASE: stop_n = 5\n"
+                         "  COMP: stop_n = 6\n"
+                         "  BASE: eps_frac = 1.0e-02\n"
+                         "  COMP: eps_frac = 1.1e-02\n")
+
+    def test_other_files(self):
+        """Files the namelist parser cannot read are compared line by line as before"""
+        rcfile = self._write("seq_maps.rc", "# mapping\natm2ocn_fmapname: 'idmap'\natm2ocn_fmaptype: 'X'\n")
+        self.assertTrue(is_namelist_file(rcfile))
+        self.assertEqual(compare_namelist_files(rcfile, rcfile), (True, ""))
+        self.assertFalse(is_namelist_file(self._write("datm.streams.txt", "<?xml version=\"1.0\"?>\n<file/>\n")))
+
+    def test_parse_once(self):
+        """A file is parsed once until it changes"""
+        path = self._write("drv_in", _DRV_IN)
+        self.assertTrue(is_namelist_file(path))
+        parse_namelists = compare_namelists._parse_namelists
+        parse = compare_namelists.parse
+        try:
+            compare_namelists._parse_namelists = compare_namelists.parse = None
+            self.assertEqual(compare_namelist_files(path, path), (True, ""))
+        finally:
+            compare_namelists._parse_namelists = parse_namelists
+            compare_namelists.parse = parse
+
+        self._write("drv_in", _DRV_IN.replace("stop_n = 5", "stop_n = 10"))
+        os.utime(path, (0, 0))
+        self.assertEqual(compare_namelists._parse_namelist_file(path)["seq_timemgr_inparm"]["stop_n"], "10")
+
+if __name__ == '__main__':
+    unittest.main()
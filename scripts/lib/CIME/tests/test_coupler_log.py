@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+from CIME import coupler_log
+
+_MEMORY_LINE = " memory_write: model date =   {:08d}       0 memory =    {:.2f} MB (highwater)    300.00 MB (usage)  (pe=    0 comps= cpl ATM)\n"
+
+def _make_log_lines(ndays, complete=True):
+    lines = [" tStamp_write: model date =   {:08d}       0 wall clock = 2020-01-01 10:00:00 avg dt =     1.00 dt =     1.00\n".format(10101)]
+    for day in range(ndays):
+        lines.append(_MEMORY_LINE.format(10102 + day, 1000.0 + day))
+    lines.append("  # simulated years / cmp-day =       5.261  \n")
+    lines.append("  # simulated years / cmp-day =       9.999  \n")
+    if complete:
+        lines.append("(seq_mct_drv): ===============       SUCCESSFUL TERMINATION OF CPL7-cesm ===============\n")
+    return lines
+
+class TestCouplerLog(unittest.TestCase):
+
+    def setUp(self):
+        self._tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._tempdir)
+
+    def _write_log(self, name, lines):
+        path = os.path.join(self._tempdir, name)
+        with (gzip.open(path, "wb") if name.endswith(".gz") else open(path, "wb")) as fd:
+            fd.write("".join(lines).encode("utf-8"))
+        return path
+
+    def test_read_coupler_log(self):
+        """One pass extracts memory, throughput, model dates and completion"""
+        path = self._write_log("cpl.log.1.gz", _make_log_lines(3))
+        summary = coupler_log.read_coupler_log(path)
+        self.assertEqual(summary.memory, [(10102.0, 1000.0), (10103.0, 1001.0), (10104.0, 1002.0)])
+        self.assertEqual(summary.throughput, 5.261)
+        self.assertEqual(summary.model_dates, ["00010101", "00010102", "00010103", "00010104"])
+        self.assertTrue(summary.completed)
+        self.assertTrue(summary.compressed)
+        self.assertIs(coupler_log.read_coupler_log(path), summary)
+
+        path = self._write_log("cpl.log.2", _make_log_lines(1, complete=False))
+        summary = coupler_log.read_coupler_log(path)
+        self.assertFalse(summary.completed or summary.compressed)
+
+        # A changed log is read again
+        with open(path, "a") as fd:
+            fd.write(_MEMORY_LINE.format(10103, 2000.0))
+        os.utime(path, (0, 0))
+        self.assertEqual(coupler_log.read_coupler_log(path).memory[-1], (10103.0, 2000.0))
+
+    def test_coupler_log_contains(self):
+        """Markers are found at the end of the log, anywhere in it, and across read boundaries"""
+        lines = _make_log_lines(5000)
+        plain = self._write_log("cpl.log.1", lines)
+        compressed = self._write_log("cpl.log.1.gz", lines)
+        early = self._write_log("cpl.log.2", ["HAS ENDED\n"] + _make_log_lines(5000, complete=False))
+        for path in [plain, compressed]:
+            self.assertTrue(coupler_log.coupler_log_contains(path))
+            self.assertFalse(coupler_log.coupler_log_contains(path, marker="HAS ENDED"))
+        self.assertTrue(coupler_log.coupler_log_contains(early, marker="HAS ENDED"))
+        self.assertFalse(coupler_log.coupler_log_contains(early))
+
+        read_size = coupler_log._READ_SIZE
+        try:
+            coupler_log._READ_SIZE = 7
+            self.assertTrue(coupler_log.coupler_log_contains(compressed, marker="model date =   00010200"))
+        finally:
+            coupler_log._READ_SIZE = read_size
+
+if __name__ == '__main__':
+    unittest.main()
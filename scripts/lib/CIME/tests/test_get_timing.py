@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+import csv
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from CIME import get_timing
+from CIME.tests.case_fake import CaseFake
+
+_MCT_STATS = """\
+name                 on  processes  threads        count      walltotal   wallmax (proc   thrd  )   wallmin (proc   thrd  )
+"CPL:INIT"            -         2        2 2.000000e+00   1.900000e+01     9.675 (     0      0)     9.325 (     1      0)
+"CPL:RUN_LOOP"        -         2        2 9.600000e+02   9.000000e+02   450.174 (     1      0)   449.826 (     0      0)
+"CPL:CLOCK_ADVANCE"   -         2        2 9.600000e+02   9.000000e-02     0.047 (     1      0)     0.043 (     0      0)
+"CPL:RUN"             -         2        2 9.600000e+02   6.400000e+02   324.956 (     1      0)   314.956 (     0      0)
+"CPL:ATM_RUN"         -         2        2 9.600000e+02   3.400000e+01    20.444 (     1      0)    15.180 (     0      0)
+"CPL:OCN_RUN"         -         2        2 9.600000e+02   3.400000e-01     0.383 (     1      0)     0.290 (     0      0)
+"CPL:COMM"            -         2        2 9.600000e+02   3.400000e+01    17.674 (     1      0)    10.000 (     0      0)
+"CPL:FINAL"           y         2        2 2.000000e+00   2.000000e-03     0.001 (     1      0)     0.001 (     0      0)
+"CPL:C2O"             -         2        2 9.600000e+02   2.000000e-01     0.100 (     1      0)     0.090 (     0      0)
+"CPL:C2O"             -         1        1 4.800000e+02   1.000000e-01     0.100 (     0      0)     0.100 (     0      0)
+"""
+
+_ESMF_SUMMARY = """\
+Region                         PETs   Count    Mean (s)    Min (s)     Min PET Max (s)     Max PET
+  [ensemble] Init 1            4      1        5.6100      5.6000      0       5.6200      3
+  [ensemble] RunPhase1         4      1        90.1000     90.0000     1       90.2000     2
+    [ESM0001] RunPhase1        4      1        90.0000     89.9000     1       90.1000     2
+      [ATM] RunPhase1          4      48       20.0000     19.0000     1       21.0000     2
+      [MED] med_phases_prep    4      48       1.5000      1.4000      1       1.6000      2
+      [MED] med_fraction_set   4      48       0.2500      0.2000      1       0.3000      2
+      [ATM-TO-MED] RunPhase1   4      48       0.5000      0.4000      1       0.6000      2
+      MED: (med_phases_profile) 4     48       0.0100      0.0100      1       0.0100      2
+    [ESM0002] RunPhase1        4      1        91.0000     89.9000     1       90.1000     2
+      [ATM] RunPhase1          4      48       30.0000     29.0000     1       31.0000     2
+      [MED-TO-ATM] RunPhase1   4      48       0.7500      0.4000      1       0.6000      2
+    [ESM0001] Finalize         4      1        1.0000      1.0000      1       1.0000      2
+  [ensemble] FinalizePhase1    4      1        1.2000      1.1000      1       1.3000      2
+"""
+
+class TestTimingTable(unittest.TestCase):
+
+    def test_mct(self):
+        """GPTL timers are looked up by name, the first one listed winning"""
+        table = get_timing._TimingTable(_MCT_STATS.splitlines(True), "mct")
+        self.assertEqual(len(table.records), 10)
+        self.assertEqual(table.get("CPL:CLOCK_ADVANCE"),
+                         get_timing.TimingRecord("CPL:CLOCK_ADVANCE", None, None, 2, 960, 0.045, 0.043, 0.047))
+        self.assertEqual(table.get("CPL:C2O").pets, 2)
+        self.assertIsNone(table.get("CPL:NONE"))
+
+    def test_nuopc(self):
+        """ESMF regions keep the ESM run phase they were timed in"""
+        table = get_timing._TimingTable(_ESMF_SUMMARY.splitlines(True), "nuopc")
+        self.assertEqual(table.get("[ensemble] Init 1").phase, "init")
+        self.assertEqual(table.get("[ATM] RunPhase1", phase="run", instance="0001").mean, 20.0)
+        self.assertEqual(table.get("[ATM] RunPhase1", phase="run", instance="0002").mean, 30.0)
+        self.assertIsNone(table.get("[ATM] RunPhase1", phase="run", instance="0003"))
+        self.assertEqual(table.get("MED: (med_phases_profile)").count, 48)
+
+    def test_nuopc_lookups(self):
+        """The mediator and communication times sum the regions of one instance"""
+        case = CaseFake.__new__(CaseFake)
+        case.vars = {"COMP_INTERFACE" : "nuopc"}
+        parser = get_timing._TimingParser(case)
+        parser.table = get_timing._TimingTable(_ESMF_SUMMARY.splitlines(True), "nuopc")
+        self.assertEqual(parser.gettime2(""), (4, 48))
+        self.assertEqual(parser.getMEDtime(""), (1.75, 1.75))
+        self.assertEqual(parser.getCOMMtime("0001"), 0.5)
+        self.assertEqual(parser.getCOMMtime("0002"), 0.75)
+        self.assertEqual(parser.gettime("[ensemble] RunPhase1"), (90.0, 90.2, True))
+
+class TestGetTiming(unittest.TestCase):
+
+    def setUp(self):
+        self._tempdir = tempfile.mkdtemp()
+        self._cwd = os.getcwd()
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        shutil.rmtree(self._tempdir)
+
+    def _make_case(self):
+        case = CaseFake(os.path.join(self._tempdir, "case"))
+        case.get_values = lambda item: ["CPL", "ATM", "LND", "ICE", "OCN", "ROF", "GLC", "WAV"]
+        settings = {"COMP_INTERFACE" : "mct", "MODEL" : "cesm", "MACH" : "mach", "USER" : "user",
+                    "CONTINUE_RUN" : False, "NCPL_BASE_PERIOD" : "day", "ATM_NCPL" : 48, "OCN_NCPL" : 24,
+                    "COMPSET" : "X", "GRID" : "f19_g16", "STOP_OPTION" : "ndays", "STOP_N" : 10,
+                    "COST_PES" : 0, "COSTPES_PER_NODE" : None, "TOTALPES" : 2,
+                    "MAX_MPITASKS_PER_NODE" : 2, "MAX_TASKS_PER_NODE" : 2}
+        for comp in case.get_values("COMP_CLASSES"):
+            settings.update({"NTASKS_" + comp : 2, "ROOTPE_" + comp : 0, "PSTRID_" + comp : 1,
+                             "NTHRDS_" + comp : 1, "NINST_" + comp : 1, "COMP_" + comp : "x" + comp.lower()})
+        for item, value in settings.items():
+            case.set_value(item, value)
+
+        timingdir = os.path.join(case.get_value("RUNDIR"), "timing")
+        os.makedirs(timingdir)
+        with open(os.path.join(timingdir, "model_timing_stats"), "w") as fd:
+            fd.write(_MCT_STATS)
+        return case
+
+    def test_get_timing(self):
+        """The text summary is written along with the requested machine-readable copies"""
+        case = self._make_case()
+        summaries = get_timing.get_timing(case, "123-456", formats=["json", "csv"])
+
+        self.assertEqual(len(summaries), 1)
+        summary = summaries[0]
+        self.assertEqual(summary["model_days"], 10)
+        self.assertEqual(summary["init_time"], 9.675)
+        self.assertEqual(summary["components"]["ATM"]["run_time"], 20.444)
+        self.assertAlmostEqual(summary["throughput"], 864000.0 / (summary["run_time"] * 365.0))
+
+        timingfile = os.path.join(case.get_value("CASEROOT"), "timing", "cesm_timing.case.123-456")
+        with open(timingfile) as fd:
+            self.assertIn("    Model Throughput:", fd.read())
+
+        with open(timingfile + ".json") as fd:
+            contents = json.load(fd)
+        self.assertEqual(contents["run_time"], summary["run_time"])
+        self.assertEqual(len(contents["timers"]), 10)
+        self.assertEqual(contents["timers"][0]["heading"], "CPL:INIT")
+
+        with open(timingfile + ".csv") as fd:
+            rows = list(csv.reader(fd))
+        self.assertEqual(tuple(rows[0]), get_timing.TimingRecord._fields)
+        self.assertEqual(rows[3][:5], ["CPL:CLOCK_ADVANCE", "", "", "2", "960"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import shutil
+import stat
+import tempfile
+import time
+from CIME import hist_utils
+
+# Prints a field difference, then takes a long time to get to its summary
+_FAKE_CPRNC = """#!/bin/sh
+case "$3" in
+  *same*)
+    echo "  of which 0 had non-zero differences"
+    echo "  the two files seem to be IDENTICAL" ;;
+  *)
+    echo " RMS T   1.0E+00"
+    sleep 30
+    echo "  of which 1 had non-zero differences"
+    echo "  the two files seem to be DIFFERENT" ;;
+esac
+"""
+
+class TestCprnc(unittest.TestCase):
+
+    def setUp(self):
+        self._workdir = tempfile.mkdtemp()
+        self._cprnc_exe = os.path.join(self._workdir, "cprnc")
+        with open(self._cprnc_exe, "w") as fd:
+            fd.write(_FAKE_CPRNC)
+        os.chmod(self._cprnc_exe, stat.S_IRWXU)
+
+    def tearDown(self):
+        shutil.rmtree(self._workdir)
+
+    def _cprnc(self, file2, **kwargs):
+        return hist_utils.cprnc("cam", "case.cam.h0.nc", file2, None, self._workdir,
+                                cprnc_exe=self._cprnc_exe, **kwargs)
+
+    def test_identical(self):
+        """Summary strings are found in the streamed output, which is also saved"""
+        files_match, log_name, comment = self._cprnc("same.cam.h0.nc")
+        self.assertTrue(files_match)
+        self.assertEqual(comment, "")
+        with open(log_name, "r") as fd:
+            self.assertTrue("IDENTICAL" in fd.read())
+
+    def test_stop_on_diff(self):
+        """cprnc is stopped at the first difference when only pass/fail is needed"""
+        start = time.time()
+        files_match, log_name, _ = self._cprnc("other.cam.h0.nc", stop_on_diff=True, outfile_suffix="base")
+        self.assertFalse(files_match)
+        self.assertTrue(time.time() - start < 20)
+        self.assertTrue(log_name.endswith(".cprnc.out.base"))
+        with open(log_name, "r") as fd:
+            self.assertTrue(hist_utils.CPRNC_STOPPED in fd.read())
+
+    def test_cprnc_command(self):
+        """The cprnc command may include a wrapper"""
+        self._cprnc_exe = "sh " + self._cprnc_exe
+        self.assertTrue(self._cprnc("same.cam.h0.nc")[0])
+
+    def test_missing_cprnc(self):
+        """A cprnc that cannot be run fails the comparison"""
+        self._cprnc_exe = os.path.join(self._workdir, "missing")
+        self.assertFalse(self._cprnc("same.cam.h0.nc", outfile_suffix=None)[0])
+
+if __name__ == '__main__':
+    unittest.main()
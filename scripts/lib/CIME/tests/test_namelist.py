@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+import glob
+import logging
+import os
+import time
+import unittest
+import six
+
+from CIME import namelist
+from CIME.utils import get_cime_root, CIMEError
+
+logger = logging.getLogger(__name__)
+
+# Namelists exercising the corners of the grammar, valid or not
+_EDGE_CASES = [
+    "",
+    " \n!Comment",
+    "! Comment \n &group /! Comment\n ",
+    "! Comment \n &group /! Comment ",
+    "&group1\n foo='bar','bazz'\n,, foo2=2*5\n / &group2 /",
+    "&group foo='bar', foo+='baz' /",
+    "&group foo='abc''def', bar=\"x\"\"y\", bazz='''' /",
+    "&group foo=(1.,2.), bar=2*(3., 4.) /",
+    "&group foo=nan(1,2), bar=inf, bazz=-.5d-3 /",
+    "&group foo = 1.e+5, 2.e+5 /",
+    "&group foo = 1, +2 /",
+    "&group foo(2:4) = 1, 2, 3\n bar(3) = .true. /",
+    "&group foo(1:2) = 1, 2, 3 /",
+    "&group foo%bar = 1, foo@a = 2 /",
+    "&group\n foo = 1, ! comment\n ! more\n bar = 2\n/",
+    "&group\n foo = 1 ! bad comment\n/",
+    "&group ! bad comment\n foo = 1 /",
+    "&group foo = 3*, 2* /",
+    "&group foo = 6*foo= /",
+    "&group foo = 'unterminated /",
+    "&group foo = (1., 2. /",
+    "&group foo = ((1 /",
+    "&group foo = 1 / &group foo = 2 /",
+    "&group foo = 1 /junk",
+    "&group foo = 1\r\n/",
+    "&group foo = 1",
+    "&group foo + = 1 /",
+    "&group foo =\n 1 /",
+    "&group foo(1,2) = 1 /",
+    "&group 1foo = 1 /",
+    "&group foo = hamburger /",
+    "!blah \n foo='bar','bazz'\n,, foo2=2*5\n ",
+    "foo='bar', foo(3)='bazz'",
+    "foo='bar'\n foo+='bazz'",
+    "foo='bar', foo=",
+    "foo=",
+    "foo=1,",
+    "foo=6*",
+    "foo='bar'",
+    "foo = 1 / ",
+    "foo ! bad\n = 1",
+]
+
+def _parse_with(parser_class, text, groupless):
+    try:
+        return parser_class(text, groupless).parse_namelist()
+    except (namelist._NamelistEOF, namelist._NamelistParseError, CIMEError, AttributeError, IndexError, ValueError) as error:
+        return type(error).__name__, str(error)
+
+def _get_repo_namelists():
+    cimeroot = get_cime_root()
+    patterns = [os.path.join("src", "components", "*", "*", "cime_config", "user_nl_*"),
+                os.path.join("scripts", "tests", "user_mods_test*", "user_nl_*"),
+                os.path.join("src", "externals", "pio*", "*", "*", "namelists", "*_in.*"),
+                os.path.join("tools", "mapping", "gen_mapping_files", "runoff_to_ocn", "*.nml")]
+    return sorted(path for pattern in patterns for path in glob.glob(os.path.join(cimeroot, pattern)))
+
+def _read_namelist(path):
+    with open(path) as fd:
+        return fd.read().replace('\t', ' ')
+
+class TestNamelistParser(unittest.TestCase):
+
+    def test_same_as_reference_parser(self):
+        """The fast parser gives the same results and errors as _NamelistParser"""
+        texts = _EDGE_CASES + [_read_namelist(path) for path in _get_repo_namelists()]
+        for text in texts:
+            for groupless in (False, True):
+                self.assertEqual(_parse_with(namelist._FastNamelistParser, text, groupless),
+                                 _parse_with(namelist._NamelistParser, text, groupless),
+                                 msg="{!r} (groupless={})".format(text, groupless))
+
+    def test_parse_error_location(self):
+        """Parse errors give the line and column they were found at"""
+        with six.assertRaisesRegex(self, CIMEError, "'hamburger' at line 3, column 22"):
+            namelist.parse(text="&group\n foo = 1,\n bar = 2, 3, hamburger\n/")
+
+    def test_parse_benchmark(self):
+        """Report the parsing rate of the namelists in the repository with both parsers"""
+        texts = [(_read_namelist(path), os.path.basename(path).startswith("user_nl_")) for path in _get_repo_namelists()]
+        texts.append(("".join("&group{:d}\n".format(group) +
+                              "".join(" var{:d} = {:d}, 'abc''d', 3*.true., 1.5e-3, 2*, ! comment\n".format(idx, idx)
+                                      for idx in range(500)) + "/\n" for group in range(10)), False))
+        size = sum(len(text) for text, _ in texts)
+        rates = {}
+        for parser_class in (namelist._NamelistParser, namelist._FastNamelistParser):
+            start = time.time()
+            for text, groupless in texts:
+                _parse_with(parser_class, text, groupless)
+            rates[parser_class.__name__] = size / 1024.0 / max(time.time() - start, 1e-9)
+
+        logger.info("namelist parsing rate (kB/s): _NamelistParser {:.0f}, _FastNamelistParser {:.0f}".format(
+            rates["_NamelistParser"], rates["_FastNamelistParser"]))
+
+if __name__ == '__main__':
+    unittest.main()
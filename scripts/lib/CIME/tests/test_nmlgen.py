@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+from CIME import nmlgen
+from CIME.nmlgen import NamelistGenerator
+
+class NamelistGeneratorFake(NamelistGenerator):
+    """
+    A NamelistGenerator whose defaults come from a dict rather than from a
+    case and a namelist definition file
+    """
+
+    # pylint: disable=super-init-not-called
+    def __init__(self, defaults):
+        self._defaults = defaults
+        self.updated_streams = []
+
+    def get_default(self, name, config=None, allow_none=False):
+        return self._defaults[name]
+
+    def update_shr_strdata_nml(self, config, stream, stream_path):
+        self.updated_streams.append((stream, stream_path))
+
+class TestStreamFile(unittest.TestCase):
+
+    def setUp(self):
+        self._workdir = tempfile.mkdtemp()
+        self._stream_path = os.path.join(self._workdir, "datm.streams.txt.CORE2")
+        self._data_list_path = os.path.join(self._workdir, "datm.input_data_list")
+        self._defaults = {"strm_domdir" : "/dom", "strm_domfil" : "domain.nc",
+                          "strm_datdir" : "/data", "strm_datfil" : "f.%ym.nc",
+                          "strm_domvar" : "time time\nxc lon", "strm_datvar" : "u u\nv v",
+                          "strm_offset" : "0", "strm_year_start" : "2000", "strm_year_end" : "2001"}
+
+    def tearDown(self):
+        shutil.rmtree(self._workdir)
+
+    def _create(self):
+        generator = NamelistGeneratorFake(self._defaults)
+        generator.create_stream_file_and_update_shr_strdata_nml({}, self._workdir, "CORE2", self._stream_path,
+                                                                self._data_list_path)
+        self.assertEqual(generator.updated_streams, [("CORE2", self._stream_path)])
+        with open(self._stream_path, "r") as fd:
+            stream_text = fd.read()
+        with open(self._data_list_path, "r") as fd:
+            data_list_text = fd.read()
+
+        return stream_text, data_list_text
+
+    def _expected_stream_text(self, domain_filepath, domain_filenames, data_filenames):
+        return nmlgen._stream_mct_file_template.format(
+            domain_varnames="time time\nxc lon", domain_filepath=domain_filepath,
+            domain_filenames="\n".join(domain_filenames), data_varnames="u u\nv v",
+            data_filepath="/data", data_filenames="\n".join(data_filenames), offset="0")
+
+    def test_stream_file(self):
+        """Stream files and input data lists are written exactly as when the names were joined first"""
+        data_filenames = ["f.{:d}-{:02d}.nc".format(year, month) for year in (2000, 2001) for month in range(1, 13)]
+        stream_text, data_list_text = self._create()
+
+        self.assertEqual(stream_text, self._expected_stream_text("/dom", ["domain.nc"], data_filenames))
+        self.assertEqual(data_list_text, "domain1 = /dom/domain.nc\n" +
+                         "".join("file{:d} = /data/{}\n".format(i + 1, name) for i, name in enumerate(data_filenames)))
+
+        # Lines already in the input data list are not repeated
+        self.assertEqual(self._create()[1], data_list_text)
+
+    def test_domain_from_data(self):
+        """A null domain file is replaced by the first data file"""
+        self._defaults.update({"strm_domfil" : "null", "strm_datfil" : "f.%y.nc"})
+        stream_text, data_list_text = self._create()
+
+        self.assertEqual(stream_text, self._expected_stream_text("/data", ["f.2000.nc"], ["f.2000.nc", "f.2001.nc"]))
+        self.assertEqual(data_list_text, "domain1 = /data/f.2000.nc\nfile1 = /data/f.2000.nc\nfile2 = /data/f.2001.nc\n")
+
+    def test_indicator_per_line(self):
+        """Each line is expanded with its own date indicator, lines without one are kept once"""
+        self.assertEqual(list(NamelistGenerator.iter_sub_paths("clim.nc\nf.%ym.nc\n\ng.%2y.nc", 2000, 2000)),
+                         ["clim.nc"] + ["f.2000-{:02d}.nc".format(month) for month in range(1, 13)] + ["g.2000.nc"])
+        self._defaults["strm_datfil"] = "clim.nc\nf.%y.nc"
+        stream_text = self._create()[0]
+        self.assertEqual(stream_text, self._expected_stream_text("/dom", ["domain.nc"], ["clim.nc", "f.2000.nc", "f.2001.nc"]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from CIME import perf_history
+
+def _make_summary(lid, throughput, caseroot="/cases/a", grid="f19_g16"):
+    components = {}
+    for name in ["CPL", "ATM", "OCN"]:
+        components[name] = {"comp" : name.lower(), "ntasks" : 4, "nthrds" : 1, "rootpe" : 0,
+                            "pstrid" : 1, "ninst" : 1, "min_time" : 1.0, "run_time" : 2.0}
+    return {"case" : os.path.basename(caseroot), "caseroot" : caseroot, "lid" : lid, "instance" : 0,
+            "machine" : "mach", "compiler" : "gnu", "mpilib" : "mpich", "compset" : "X", "grid" : grid,
+            "total_pes" : 4, "cost_pes" : 4, "model_days" : 10, "throughput" : throughput,
+            "cost" : 1.0, "init_time" : 1.0, "run_time" : 10.0, "final_time" : 0.1, "comm_time" : 0.5,
+            "components" : components}
+
+class TestPerfHistory(unittest.TestCase):
+
+    def setUp(self):
+        self._tempdir = tempfile.mkdtemp()
+        self._db = os.path.join(self._tempdir, "perf", "perf-history.db")
+
+    def tearDown(self):
+        shutil.rmtree(self._tempdir)
+
+    def test_no_database(self):
+        """Queries on a missing database find nothing and create nothing"""
+        self.assertEqual(perf_history.query_run_performance(self._db), [])
+        self.assertFalse(os.path.exists(os.path.dirname(self._db)))
+
+    def test_record_and_query(self):
+        """Runs are kept in the order they ran, and recording a run again replaces it"""
+        perf_history.record_run_performance(self._db, [_make_summary("200101-120000", 5.0), _make_summary("200102-120000", 4.0)],
+                                            commit="abc")
+        perf_history.record_run_performance(self._db, [_make_summary("200103-120000", 3.0, caseroot="/cases/b", grid="f09_g16")],
+                                            test="ERS.f09_g16.X")
+        perf_history.record_run_performance(self._db, [_make_summary("200102-120000", 4.5)], commit="def")
+
+        records = perf_history.query_run_performance(self._db)
+        self.assertEqual([(record.run_date, record.throughput) for record in records],
+                         [("2020-01-01 12:00:00", 5.0), ("2020-01-02 12:00:00", 4.5), ("2020-01-03 12:00:00", 3.0)])
+        self.assertEqual(records[0].pe_layout, "ATM:4x1@0 CPL:4x1@0 OCN:4x1@0")
+        self.assertEqual(records[1].commit_id, "def")
+
+        def lids(**kwargs):
+            return [record.lid[:6] for record in perf_history.query_run_performance(self._db, **kwargs)]
+        self.assertEqual(lids(grid="f19_g16"), ["200101", "200102"])
+        self.assertEqual(lids(test="ERS.f09_g16.X"), ["200103"])
+        self.assertEqual(lids(since="2020-01-02"), ["200102", "200103"])
+        self.assertEqual(lids(limit=1), ["200103"])
+
+        comp_times = perf_history.get_component_times(self._db, records)
+        self.assertEqual(comp_times[records[1].id], {"CPL" : 2.0, "ATM" : 2.0, "OCN" : 2.0})
+
+    def test_import_timing_files(self):
+        """Runs can be added from the json written by getTiming"""
+        json_file = os.path.join(self._tempdir, "cesm_timing.a.1.json")
+        with open(json_file, "w") as fd:
+            json.dump(_make_summary("200101-120000", 5.0), fd)
+
+        self.assertEqual(perf_history.import_timing_files(self._db, [json_file]), 1)
+        self.assertEqual([record.case_name for record in perf_history.query_run_performance(self._db)], ["a"])
+
+if __name__ == '__main__':
+    unittest.main()
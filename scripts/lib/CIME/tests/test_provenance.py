@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+import unittest
+import multiprocessing
+import os
+import shutil
+import tempfile
+from CIME import provenance
+
+def _save_times(baseline_root, test, count):
+    for i in range(count):
+        provenance.save_test_time(baseline_root, test, 100 + i, "commit{:d}".format(i))
+
+class TestTestHistory(unittest.TestCase):
+
+    def setUp(self):
+        self._baseline_root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._baseline_root)
+
+    def test_no_history(self):
+        """Lookups in an empty baseline area find nothing and create nothing"""
+        self.assertEqual(provenance.get_recommended_test_times_based_on_past(self._baseline_root, ["a", "b"]),
+                         {"a" : None, "b" : None})
+        self.assertEqual(provenance.get_test_success(self._baseline_root, None, "a", testing=True), (False, None, None))
+        self.assertEqual(os.listdir(self._baseline_root), [])
+
+    def test_walltime_stats(self):
+        """Estimates use the median and 90th percentile of the most recent runs"""
+        for seconds in [5000] + [100] * 5 + [200] * 4 + [2000]:
+            provenance.save_test_time(self._baseline_root, "a", seconds, "abc")
+        provenance.save_test_time(self._baseline_root, "b", 700, "abc")
+
+        stats = provenance.get_test_time_stats(self._baseline_root, ["a", "b", "c"])
+        self.assertEqual(sorted(stats.keys()), ["a", "b"])
+        self.assertEqual(stats["a"], provenance.TestTimeStats(count=10, last=2000, median=100, p90=200))
+
+        raw = provenance.get_recommended_test_times_based_on_past(self._baseline_root, ["a", "b", "c"], raw=True)
+        self.assertEqual(raw, {"a" : "00:01:40", "b" : "00:11:40", "c" : None})
+        self.assertEqual(provenance.get_recommended_test_time_based_on_past(self._baseline_root, "b"), "00:34:10")
+
+    def test_legacy_walltimes(self):
+        """Per-test walltime files are still read, and imported on the next save"""
+        legacy_dir = os.path.join(self._baseline_root, "walltimes", "a")
+        os.makedirs(legacy_dir)
+        with open(os.path.join(legacy_dir, "walltimes"), "w") as fd:
+            fd.write("300 abc\n500 def\n")
+
+        self.assertEqual(provenance.get_test_time_stats(self._baseline_root, ["a"])["a"].last, 500)
+        provenance.save_test_time(self._baseline_root, "a", 700, "ghi")
+        shutil.rmtree(legacy_dir)
+        self.assertEqual(provenance.get_test_time_stats(self._baseline_root, ["a"])["a"],
+                         provenance.TestTimeStats(count=3, last=700, median=500, p90=700))
+
+    def test_concurrent_writers(self):
+        """Records from several processes writing at once are all saved, in order"""
+        procs = [multiprocessing.Process(target=_save_times, args=(self._baseline_root, test, 20))
+                 for test in ["a", "b", "c", "d"]]
+        for proc in procs:
+            proc.start()
+        for proc in procs:
+            proc.join()
+
+        stats = provenance.get_test_time_stats(self._baseline_root, ["a", "b", "c", "d"])
+        self.assertEqual([stats[test] for test in "abcd"],
+                         [provenance.TestTimeStats(count=10, last=119, median=114, p90=118)] * 4)
+
+    def test_success_transitions(self):
+        """Success history records the last pass and the last pass-to-fail transition"""
+        def record(test, success, commit, exp_last_pass, exp_trans_fail):
+            provenance.save_test_success(self._baseline_root, None, test, success, force_commit_test=commit)
+            self.assertEqual(provenance.get_test_success(self._baseline_root, None, test, testing=True),
+                             (success, exp_last_pass, exp_trans_fail))
+
+        record("a", False, "AAA", None , "AAA")
+        record("b", True , "AAA", "AAA", None)
+        record("a", False, "BBB", None , "AAA")
+        record("b", True , "BBB", "BBB", None)
+        record("a", True , "CCC", "CCC", "AAA")
+        record("b", False, "CCC", "BBB", "CCC")
+
+    def test_phase_times(self):
+        """Phase timings are summarized by their median"""
+        provenance.save_phase_times(self._baseline_root, [("a", "SETUP", 10.0, 1), ("a", "MODEL_BUILD", 300.0, 4)])
+        provenance.save_phase_times(self._baseline_root, [("a", "SETUP", 30.0, 1), ("a", "SETUP", 20.0, 1)])
+        provenance.save_phase_times(self._baseline_root, [("b", "SETUP", 5.0, 1)])
+        self.assertEqual(provenance.get_phase_times_based_on_past(self._baseline_root, ["a", "c"]),
+                         {"a" : {"SETUP" : (20.0, 1), "MODEL_BUILD" : (300.0, 4)}})
+
+    def test_history_is_bounded(self):
+        """Only the most recent records are read, old walltimes and phase timings are dropped"""
+        for seconds in [5000] * 5 + [100] * 10:
+            provenance.save_test_time(self._baseline_root, "a", seconds, "abc")
+            provenance.save_phase_times(self._baseline_root, [("a", "SETUP", float(seconds), 1)])
+
+        self.assertEqual(provenance.get_test_time_stats(self._baseline_root, ["a"])["a"],
+                         provenance.TestTimeStats(count=10, last=100, median=100, p90=100))
+        conn = provenance._open_history_db(self._baseline_root)
+        try:
+            self.assertEqual(conn.execute("SELECT seconds FROM walltimes").fetchall(), [(100,)] * 10)
+            self.assertEqual(conn.execute("SELECT seconds FROM phase_times").fetchall(), [(100.0,)] * 10)
+        finally:
+            conn.close()
+
+    def test_perf_samples(self):
+        """Performance samples keep a window of the latest values, regenerating a baseline starts over"""
+        self.assertEqual(provenance.get_perf_samples(self._baseline_root, "b/t/cpl.log", "throughput"), [])
+        provenance.save_perf_sample(self._baseline_root, "b/t/cpl.log", "throughput", 4.0, "abc", initial=5.0)
+        provenance.save_perf_sample(self._baseline_root, "b/t/cpl.log", "throughput", 4.5, "abc", initial=5.0)
+        provenance.save_perf_sample(self._baseline_root, "b/t/cpl.log", "memory", 100.0, "abc")
+        self.assertEqual(provenance.get_perf_samples(self._baseline_root, "b/t/cpl.log", "throughput"), [5.0, 4.0, 4.5])
+
+        for idx in range(30):
+            provenance.save_perf_sample(self._baseline_root, "b/t/cpl.log", "throughput", float(idx), "abc")
+        self.assertEqual(provenance.get_perf_samples(self._baseline_root, "b/t/cpl.log", "throughput"),
+                         [float(idx) for idx in range(10, 30)])
+
+        provenance.save_perf_sample(self._baseline_root, "b/t/cpl.log", "throughput", 3.0, "def", reset=True)
+        self.assertEqual(provenance.get_perf_samples(self._baseline_root, "b/t/cpl.log", "throughput"), [3.0])
+        self.assertEqual(provenance.get_perf_samples(self._baseline_root, "b/t/cpl.log", "memory"), [100.0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from collections import OrderedDict
+from six.moves.queue import Queue
+from CIME.test_scheduler import TestScheduler, TEST_START, CREATE_NEWCASE_PHASE
+from CIME.test_status import *
+
+_PHASES = [TEST_START, CREATE_NEWCASE_PHASE, SETUP_PHASE, SHAREDLIB_BUILD_PHASE, MODEL_BUILD_PHASE]
+
+def _make_scheduler(test_root, build_groups, priorities, parallel_jobs, proc_pool, model_build_cost=4):
+    """
+    A TestScheduler for the tests of build_groups with the state its
+    constructor would set up, but no machine, cases or test directories
+    """
+    scheduler = TestScheduler.__new__(TestScheduler)
+    scheduler._tests = OrderedDict((test, (TEST_START, TEST_PASS_STATUS))
+                                   for build_group in build_groups for test in build_group)
+    scheduler._phases = list(_PHASES)
+    scheduler._build_groups = build_groups
+    scheduler._test_build_groups = dict((test, build_group) for build_group in build_groups for test in build_group)
+    scheduler._test_priorities = priorities
+    scheduler._parallel_jobs = parallel_jobs
+    scheduler._proc_pool = proc_pool
+    scheduler._procs_avail = proc_pool
+    scheduler._model_build_cost = model_build_cost
+    scheduler._cime_model = "e3sm"
+    scheduler._no_batch = True
+    scheduler._no_run = True
+    scheduler._test_root = test_root
+    scheduler._test_id = "id"
+    scheduler._baseline_gen_name = None
+    scheduler._baseline_cmp_name = None
+    scheduler._completed_tests = 0
+    scheduler._phase_timings = {}
+    scheduler._phase_procs = {}
+    scheduler._sharedlib_build_dirs = {}
+    scheduler._finished_queue = Queue()
+    scheduler._update_test_status_file = lambda *_: None
+    return scheduler
+
+class _StubPhases(object):
+    """
+    Stands in for the phase methods of a TestScheduler, recording when each
+    phase of each test ran and how many procs were in use meanwhile
+    """
+
+    def __init__(self, scheduler, duration=0.0, fail=()):
+        self._scheduler = scheduler
+        self._duration = duration
+        self._fail = fail
+        self._lock = threading.Lock()
+        self.started = []      # (test, phase) in the order they started
+        self.intervals = {}    # (test, phase) -> (start, end)
+        self.max_procs_in_use = 0
+        for phase in _PHASES[1:]:
+            setattr(scheduler, "_{}_phase".format(phase.lower()), self._make_phase(phase))
+
+    def _make_phase(self, phase):
+        def run(test):
+            start = time.time()
+            with self._lock:
+                self.started.append((test, phase))
+                self.max_procs_in_use = max(self.max_procs_in_use,
+                                            self._scheduler._proc_pool - self._scheduler._procs_avail)
+            time.sleep(self._duration)
+            with self._lock:
+                self.intervals[(test, phase)] = (start, time.time())
+            return (test, phase) not in self._fail, ""
+
+        return run
+
+class TestTestScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self._test_root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._test_root)
+
+    def _run(self, scheduler):
+        scheduler._producer()
+        self.assertEqual(scheduler._procs_avail, scheduler._proc_pool)
+        return dict((test, scheduler._get_test_data(test)) for test in scheduler._tests)
+
+    def test_dispatch_order(self):
+        """With one job at a time, tests run through their phases in priority order"""
+        scheduler = _make_scheduler(self._test_root, [("a",), ("b",), ("c",)], {"c" : 0, "a" : 1, "b" : 2}, 1, 8)
+        phases = _StubPhases(scheduler)
+        results = self._run(scheduler)
+
+        self.assertEqual(phases.started, [(test, phase) for test in ["c", "a", "b"] for phase in _PHASES[1:]])
+        self.assertEqual(set(results.values()), set([(MODEL_BUILD_PHASE, TEST_PASS_STATUS)]))
+
+    def test_blocking(self):
+        """Tests sharing a build wait for the first test of the group, then reuse its build with 1 proc"""
+        scheduler = _make_scheduler(self._test_root, [("a", "b"), ("c",)], {"a" : 0, "b" : 1, "c" : 2}, 3, 16)
+        phases = _StubPhases(scheduler, duration=0.02)
+        results = self._run(scheduler)
+
+        self.assertEqual(set(results.values()), set([(MODEL_BUILD_PHASE, TEST_PASS_STATUS)]))
+        for phase in [SHAREDLIB_BUILD_PHASE, MODEL_BUILD_PHASE]:
+            self.assertGreaterEqual(phases.intervals[("b", phase)][0], phases.intervals[("a", phase)][1])
+
+        self.assertEqual(scheduler._phase_procs[("a", MODEL_BUILD_PHASE)], 4)
+        self.assertEqual(scheduler._phase_procs[("b", MODEL_BUILD_PHASE)], 1)
+        self.assertEqual(scheduler._phase_procs[("c", MODEL_BUILD_PHASE)], 4)
+
+    def test_blocker_not_started(self):
+        """A test that outranks the first test of its build group waits for it rather than failing"""
+        scheduler = _make_scheduler(self._test_root, [("a", "b")], {"b" : 0, "a" : 1}, 1, 16)
+        phases = _StubPhases(scheduler)
+        results = self._run(scheduler)
+
+        self.assertEqual(results, {"a" : (MODEL_BUILD_PHASE, TEST_PASS_STATUS), "b" : (MODEL_BUILD_PHASE, TEST_PASS_STATUS)})
+        for phase in [SHAREDLIB_BUILD_PHASE, MODEL_BUILD_PHASE]:
+            self.assertLess(phases.started.index(("a", phase)), phases.started.index(("b", phase)))
+
+    def test_failed_blocker(self):
+        """Tests waiting on a build that failed fail too, and are not waited on forever"""
+        scheduler = _make_scheduler(self._test_root, [("a", "b")], {"a" : 0, "b" : 1}, 2, 16)
+        _StubPhases(scheduler, fail=[("a", SHAREDLIB_BUILD_PHASE)])
+        results = self._run(scheduler)
+
+        self.assertEqual(results["a"], (SHAREDLIB_BUILD_PHASE, TEST_FAIL_STATUS))
+        self.assertEqual(results["b"][1], TEST_FAIL_STATUS)
+
+    def test_proc_accounting(self):
+        """Phases only start while their procs are available"""
+        scheduler = _make_scheduler(self._test_root, [("a",), ("b",), ("c",)], {"a" : 0, "b" : 1, "c" : 2}, 3, 5)
+        phases = _StubPhases(scheduler, duration=0.02)
+        results = self._run(scheduler)
+
+        self.assertEqual(set(results.values()), set([(MODEL_BUILD_PHASE, TEST_PASS_STATUS)]))
+        self.assertLessEqual(phases.max_procs_in_use, 5)
+        builds = sorted(phases.intervals[(test, MODEL_BUILD_PHASE)] for test in ["a", "b", "c"])
+        for (_, end), (start, _) in zip(builds, builds[1:]):
+            self.assertGreaterEqual(start, end)
+
+    def test_too_many_procs(self):
+        """A phase needing more procs than the pool fails instead of waiting forever"""
+        scheduler = _make_scheduler(self._test_root, [("a",), ("b",)], {"a" : 0, "b" : 1}, 2, 2)
+        scheduler._log_output = lambda *_: None
+        phases = _StubPhases(scheduler)
+        results = self._run(scheduler)
+
+        self.assertEqual(results, {"a" : (MODEL_BUILD_PHASE, TEST_FAIL_STATUS), "b" : (MODEL_BUILD_PHASE, TEST_FAIL_STATUS)})
+        self.assertNotIn(("a", MODEL_BUILD_PHASE), phases.started)
+
+class TestSharedlibBlocker(unittest.TestCase):
+
+    def setUp(self):
+        self._test_root = tempfile.mkdtemp()
+        self._scheduler = _make_scheduler(self._test_root, [("a",), ("b",), ("c",)], {"a" : 0, "b" : 1, "c" : 2}, 3, 16)
+        self._scheduler._cime_model = "cesm"
+
+    def tearDown(self):
+        shutil.rmtree(self._test_root)
+
+    def _set_dirs(self, **dirs):
+        self._scheduler._sharedlib_build_dirs.update(dirs)
+
+    def _get_blocker(self, test, in_flight):
+        threads_in_flight = dict((running_test, (None, 1, phase)) for running_test, phase in in_flight.items())
+        return self._scheduler._get_blocker(test, SHAREDLIB_BUILD_PHASE, threads_in_flight)
+
+    def test_same_configuration(self):
+        """A sharedlib build waits for a running build of the same configuration"""
+        self._set_dirs(a=("gnu/mpich", None), b=("gnu/mpich", None))
+        self.assertEqual(self._get_blocker("b", {"a" : SHAREDLIB_BUILD_PHASE}), "a")
+
+    def test_other_configuration(self):
+        """Sharedlib builds of different configurations, or other phases, do not wait"""
+        self._set_dirs(a=("gnu/mpich", None), b=("intel/mpich", None), c=("gnu/mpich", None))
+        self.assertIsNone(self._get_blocker("b", {"a" : SHAREDLIB_BUILD_PHASE}))
+        self.assertIsNone(self._get_blocker("c", {"a" : MODEL_BUILD_PHASE}))
+        self._scheduler._cime_model = "e3sm"
+        self.assertIsNone(self._get_blocker("c", {"a" : SHAREDLIB_BUILD_PHASE}))
+
+    def test_cprnc(self):
+        """Builds of different configurations wait for each other while they would both build cprnc"""
+        cprnc_dir = os.path.join(self._test_root, "gnu", "cprnc")
+        self._set_dirs(a=("gnu/mpich", cprnc_dir), b=("gnu/openmpi", cprnc_dir))
+        self.assertEqual(self._get_blocker("b", {"a" : SHAREDLIB_BUILD_PHASE}), "a")
+        os.makedirs(cprnc_dir)
+        self.assertIsNone(self._get_blocker("b", {"a" : SHAREDLIB_BUILD_PHASE}))
+
+    def test_unknown_configuration(self):
+        """A test whose configuration could not be read conflicts with every sharedlib build"""
+        self._set_dirs(a=(None, None), b=("gnu/mpich", None))
+        self.assertEqual(self._get_blocker("b", {"a" : SHAREDLIB_BUILD_PHASE}), "a")
+        self.assertEqual(self._get_blocker("a", {"b" : SHAREDLIB_BUILD_PHASE}), "b")
+
+    def test_serialized(self):
+        """The producer never runs two sharedlib builds of the same configuration at once"""
+        self._set_dirs(a=("gnu/mpich", None), b=("gnu/mpich", None), c=("intel/mpich", None))
+        phases = _StubPhases(self._scheduler, duration=0.05)
+        self._scheduler._producer()
+
+        intervals = dict((test, phases.intervals[(test, SHAREDLIB_BUILD_PHASE)]) for test in "ab")
+        self.assertTrue(intervals["b"][0] >= intervals["a"][1] or intervals["a"][0] >= intervals["b"][1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,6 +2,8 @@
 
 import unittest
 import os
+import shutil
+import tempfile
 from CIME import test_status
 from CIME import expected_fails
 from CIME.tests.custom_assertions_test_status import CustomAssertionsTestStatus
@@ -134,5 +136,96 @@ class TestTestStatus(CustomAssertionsTestStatus):
             if phase != xfail_phase:
                 self.assert_phase_absent(output, phase, self._TESTNAME)
 
+class TestTestStatusJournal(unittest.TestCase):
+
+    _TESTNAME = 'fake_test'
+
+    def setUp(self):
+        self._test_dir = tempfile.mkdtemp()
+        self._filename = os.path.join(self._test_dir, test_status.TEST_STATUS_FILENAME)
+
+    def tearDown(self):
+        shutil.rmtree(self._test_dir)
+
+    def _read(self):
+        return test_status.TestStatus(test_dir=self._test_dir)
+
+    def test_journal_visible_before_exit(self):
+        """Changes are seen by readers as they are made, and compacted on exit"""
+        with test_status.TestStatus(test_dir=self._test_dir, test_name=self._TESTNAME) as ts:
+            ts.set_status(test_status.CREATE_NEWCASE_PHASE, test_status.TEST_PASS_STATUS)
+            self.assertFalse(os.path.exists(self._filename))
+            self.assertEqual(self._read().get_status(test_status.XML_PHASE), test_status.TEST_PEND_STATUS)
+            ts.set_status(test_status.XML_PHASE, test_status.TEST_PASS_STATUS)
+
+        self.assertEqual(test_status.get_test_status_sequence_number(self._test_dir), 2)
+        with open(self._filename, "r") as fd:
+            self.assertEqual(fd.read(), ts.phase_statuses_dump())
+        self.assertEqual(self._read().get_status(test_status.SETUP_PHASE), test_status.TEST_PEND_STATUS)
+
+    def test_concurrent_writers(self):
+        """A writer holding an old copy of the status does not undo another writer's change"""
+        with test_status.TestStatus(test_dir=self._test_dir, test_name=self._TESTNAME) as ts:
+            ts.set_status(test_status.CREATE_NEWCASE_PHASE, test_status.TEST_PASS_STATUS)
+
+        stale = self._read()
+        with self._read() as other:
+            other.set_status(test_status.XML_PHASE, test_status.TEST_PASS_STATUS)
+        with stale:
+            stale.set_status(test_status.MEMLEAK_PHASE, test_status.TEST_FAIL_STATUS)
+
+        result = self._read()
+        self.assertEqual(result.get_status(test_status.XML_PHASE), test_status.TEST_PASS_STATUS)
+        self.assertEqual(result.get_status(test_status.MEMLEAK_PHASE), test_status.TEST_FAIL_STATUS)
+        self.assertEqual(result.get_sequence_number(), 3)
+
+    def test_exit_without_changes(self):
+        """Exiting without changes does not rewrite the TestStatus file"""
+        with test_status.TestStatus(test_dir=self._test_dir, test_name=self._TESTNAME) as ts:
+            ts.set_status(test_status.CREATE_NEWCASE_PHASE, test_status.TEST_PASS_STATUS)
+
+        os.utime(self._filename, (0, 0))
+        with self._read():
+            pass
+        self.assertEqual(os.stat(self._filename).st_mtime, 0)
+
+class TestTestStatusIndex(unittest.TestCase):
+
+    _TESTNAME = 'fake_test'
+
+    def setUp(self):
+        self._test_root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._test_root)
+
+    def _make_test(self, case_dir, status):
+        test_dir = os.path.join(self._test_root, case_dir)
+        os.makedirs(test_dir)
+        with test_status.TestStatus(test_dir=test_dir, test_name=self._TESTNAME) as ts:
+            ts.set_status(test_status.CREATE_NEWCASE_PHASE, status)
+        return test_dir
+
+    def test_index_mirrors_teststatus(self):
+        """Once there is an index, statuses are read from it rather than from the TestStatus files"""
+        before_index = self._make_test("before", test_status.TEST_PASS_STATUS)
+        test_status.create_test_status_index(self._test_root)
+        after_index = self._make_test("after", test_status.TEST_FAIL_STATUS)
+
+        self.assertEqual(sorted(test_status.read_test_status_index(self._test_root)), ["after"])
+        os.remove(os.path.join(after_index, test_status.TEST_STATUS_FILENAME))
+        statuses = test_status.get_test_statuses([after_index, before_index])
+        self.assertEqual([ts.get_status(test_status.CREATE_NEWCASE_PHASE) for ts in statuses],
+                         [test_status.TEST_FAIL_STATUS, test_status.TEST_PASS_STATUS])
+
+    def test_broken_index_removed(self):
+        """An index that cannot be updated is removed rather than left stale"""
+        index_path = os.path.join(self._test_root, test_status.TEST_STATUS_INDEX_FILENAME)
+        with open(index_path, "w") as fd:
+            fd.write("not a database")
+
+        self._make_test("test", test_status.TEST_PASS_STATUS)
+        self.assertFalse(os.path.exists(index_path))
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,7 +1,11 @@
 #!/usr/bin/env python
 
+import os
+import shutil
+import tempfile
 import unittest
-from CIME.utils import indent_string
+from CIME import utils
+from CIME.utils import indent_string, EnvironmentContext
 
 class TestIndentStr(unittest.TestCase):
     """Test the indent_string function.
@@ -32,6 +36,31 @@ goodbye
 """
         self.assertEqual(expected, result)
 
+class TestCimeConfig(unittest.TestCase):
+
+    def setUp(self):
+        self._home = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self._home, ".cime"))
+
+    def tearDown(self):
+        shutil.rmtree(self._home)
+
+    def _read_config(self, text):
+        with open(os.path.join(self._home, ".cime", "config"), "w") as fd:
+            fd.write(text)
+
+        with EnvironmentContext(HOME=self._home):
+            return utils._read_cime_config_file() # pylint: disable=protected-access
+
+    def test_documented_options(self):
+        """Options the documentation tells users to set in ~/.cime/config are accepted"""
+        config = self._read_config("[main]\nPERF_HISTORY_DB=/perf.db\nCIME_CPRNC_WORKERS=4\n")
+        self.assertEqual(config.get("main", "PERF_HISTORY_DB"), "/perf.db")
+        self.assertEqual(config.get("main", "CIME_CPRNC_WORKERS"), "4")
+
+        config = self._read_config("[create_test]\nSCHEDULING_POLICY=in_order\n")
+        self.assertEqual(config.get("create_test", "SCHEDULING_POLICY"), "in_order")
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+import time
+from CIME import wait_for_tests
+from CIME import test_status
+from CIME.test_status import *
+
+def _make_teststatus(test_dir, test_name, status):
+    with TestStatus(test_dir=test_dir, test_name=test_name) as ts:
+        for phase in CORE_PHASES:
+            ts.set_status(phase, status if phase == RUN_PHASE else TEST_PASS_STATUS,
+                          comments=("time=42" if phase == RUN_PHASE else ""))
+
+class TestWatchTests(unittest.TestCase):
+
+    def setUp(self):
+        self._testroot = tempfile.mkdtemp()
+        self._test_dirs = []
+        for idx in range(3):
+            test_dir = os.path.join(self._testroot, str(idx))
+            os.makedirs(test_dir)
+            _make_teststatus(test_dir, "Test_{:d}".format(idx), TEST_PEND_STATUS)
+            self._test_dirs.append(test_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self._testroot)
+
+    def _finish_later(self, updates):
+        def update():
+            for idx, status in updates:
+                time.sleep(0.5)
+                _make_teststatus(self._test_dirs[idx], "Test_{:d}".format(idx), status)
+
+        thread = threading.Thread(target=update)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def _check_results_in_completion_order(self, use_inotify):
+        missing_dir = os.path.join(self._testroot, "missing")
+        thread = self._finish_later([(2, TEST_PASS_STATUS), (0, TEST_FAIL_STATUS), (1, TEST_PASS_STATUS)])
+        results = []
+        for result in wait_for_tests.watch_tests(self._test_dirs, use_inotify=use_inotify):
+            results.append(result[:3])
+            if len(results) == 2:
+                # A test that never gets a TestStatus file is reported once waiting stops
+                missing = list(wait_for_tests.watch_tests([missing_dir], wait=False, use_inotify=use_inotify))
+                self.assertEqual(missing[0][2], "File '{}' doesn't exist".format(missing_dir))
+
+        thread.join()
+        self.assertEqual(results, [("Test_2", self._test_dirs[2], TEST_PASS_STATUS),
+                                   ("Test_0", self._test_dirs[0], TEST_FAIL_STATUS),
+                                   ("Test_1", self._test_dirs[1], TEST_PASS_STATUS)])
+
+    def test_watch_tests_inotify(self):
+        """Results are yielded as the tests complete"""
+        self._check_results_in_completion_order(True)
+
+    def test_watch_tests_scan(self):
+        """The mtime scan finds the same results without inotify"""
+        self._check_results_in_completion_order(False)
+
+    def test_watch_tests_index(self):
+        """Tests recorded in the test status index are followed through it"""
+        test_status.create_test_status_index(self._testroot)
+        self._check_results_in_completion_order(False)
+
+    def test_no_wait(self):
+        """Without waiting, pending tests are reported as pending"""
+        results = sorted(result[:3] for result in wait_for_tests.watch_tests(self._test_dirs, wait=False))
+        self.assertEqual(results, [("Test_{:d}".format(idx), self._test_dirs[idx], TEST_PEND_STATUS) for idx in range(3)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -187,13 +187,14 @@ def _read_cime_config_file():
     allowed_sections = ("main", "create_test")
 
     allowed_in_main = ("cime_model", "project", "charge_account", "srcroot", "mail_type",
-                       "mail_user", "machine", "mpilib", "compiler", "input_dir", "cime_driver")
+                       "mail_user", "machine", "mpilib", "compiler", "input_dir", "cime_driver",
+                       "perf_history_db", "cime_cprnc_workers")
     allowed_in_create_test = ("mail_type", "mail_user", "save_timing", "single_submit",
                               "test_root", "output_root", "baseline_root", "clean",
                               "machine", "mpilib", "compiler", "parallel_jobs", "proc_pool",
-                              "walltime", "job_queue", "allow_baseline_overwrite", "wait",
+                              "walltime", "job_queue", "allow_baseline_overwrite", "wait", "phase_backend",
                               "force_procs", "force_threads", "input_dir", "pesfile", "retry",
-                              "walltime")
+                              "walltime", "scheduling_policy")
 
     cime_config_file = os.path.abspath(os.path.join(os.path.expanduser("~"),
                                                   ".cime","config"))
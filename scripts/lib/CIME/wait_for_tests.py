@@ -1,6 +1,4 @@
-#pylint: disable=import-error
-from six.moves import queue
-import os, time, threading, socket, signal, shutil, glob
+import os, sys, time, socket, signal, shutil, glob, select, struct, errno
 #pylint: disable=import-error
 from distutils.spawn import find_executable
 import logging
@@ -16,7 +14,9 @@ from CIME.case.case import Case
 SIGNAL_RECEIVED           = False
 E3SM_MAIN_CDASH           = "E3SM"
 CDASH_DEFAULT_BUILD_GROUP = "ACME_Latest"
-SLEEP_INTERVAL_SEC        = .1
+SCAN_INTERVAL_SEC         = 1  # How often TestStatus files are checked without inotify
+INOTIFY_SCAN_INTERVAL_SEC = 10 # inotify does not see changes made on other hosts of a network file system
+MTIME_RESOLUTION_SEC      = 2  # Rewrites this close together may leave mtime and size unchanged
 
 ###############################################################################
 def signal_handler(*_):
@@ -376,75 +376,281 @@ NightlyStartTime: {5} UTC
     run_cmd_no_fail("ctest -VV -D NightlySubmit", verbose=True)
 
 ###############################################################################
-def wait_for_test(test_path, results, wait, check_throughput, check_memory, ignore_namelists, ignore_memleak, no_run):
-###############################################################################
-    if (os.path.isdir(test_path)):
-        test_status_filepath = os.path.join(test_path, TEST_STATUS_FILENAME)
-    else:
-        test_status_filepath = test_path
-
-    logging.debug("Watching file: '{}'".format(test_status_filepath))
-    test_log_path = os.path.join(os.path.dirname(test_status_filepath), ".internal_test_status.log")
-
-    # We don't want to make it a requirement that wait_for_tests has write access
-    # to all case directories
-    try:
-        fd = open(test_log_path, "w")
-        fd.close()
-    except (IOError, OSError):
-        test_log_path = "/dev/null"
-
-    prior_ts = None
-    with open(test_log_path, "w") as log_fd:
-        while (True):
-            if (os.path.exists(test_status_filepath)):
-                ts = TestStatus(test_dir=os.path.dirname(test_status_filepath))
-                test_name = ts.get_name()
-                test_status, test_phase = ts.get_overall_test_status(wait_for_run=not no_run, # Important
-                                                                     no_run=no_run,
-                                                                     check_throughput=check_throughput,
-                                                                     check_memory=check_memory, ignore_namelists=ignore_namelists,
-                                                                     ignore_memleak=ignore_memleak)
-
-                if prior_ts is not None and prior_ts != ts:
-                    log_fd.write(ts.phase_statuses_dump())
-                    log_fd.write("OVERALL: {}\n\n".format(test_status))
-
-                prior_ts = ts
-
-                if (test_status == TEST_PEND_STATUS and (wait and not SIGNAL_RECEIVED)):
-                    time.sleep(SLEEP_INTERVAL_SEC)
-                    logging.debug("Waiting for test to finish")
-                else:
-                    results.put( (test_name, test_path, test_status, test_phase) )
-                    break
-
+class Inotify(object):
+###############################################################################
+    """
+    Minimal wrapper around Linux inotify, for watching directories for files
+    that are written or moved into place. Raises CIMEError if inotify is not
+    available.
+    """
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO    = 0x00000080
+    IN_CREATE      = 0x00000100
+    IN_Q_OVERFLOW  = 0x00004000
+
+    _EVENT = struct.Struct("iIII") # wd, mask, cookie, len, followed by the name
+
+    def __init__(self):
+        import ctypes, ctypes.util
+        expect(sys.platform.startswith("linux"), "inotify requires Linux")
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        expect(hasattr(self._libc, "inotify_init1"), "inotify is not available")
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | getattr(os, "O_CLOEXEC", 0o2000000))
+        expect(self._fd >= 0, "inotify_init1 failed: {}".format(os.strerror(ctypes.get_errno())))
+        self._dirs = {} # watch descriptor -> directory
+
+    def add_watch(self, dirpath):
+        """
+        Watch dirpath, returns False if the watch could not be added (e.g. the
+        directory does not exist or the user's watch limit was reached)
+        """
+        wd = self._libc.inotify_add_watch(self._fd, dirpath.encode("utf-8"),
+                                          self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE)
+        if wd >= 0:
+            self._dirs[wd] = dirpath
+
+        return wd >= 0
+
+    def read_events(self, timeout):
+        """
+        Wait up to timeout seconds for events. Returns the set of (directory, filename)
+        that changed, or None if events were lost and everything should be checked.
+        """
+        try:
+            if not select.select([self._fd], [], [], timeout)[0]:
+                return set()
+        except (select.error, OSError, IOError):
+            # Interrupted by a signal
+            return set()
+
+        changed = set()
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except OSError as e:
+                if e.errno in [errno.EAGAIN, errno.EINTR]:
+                    return changed
+                raise
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, name_len = self._EVENT.unpack_from(data, offset)
+                offset += self._EVENT.size
+                name = data[offset:offset + name_len].rstrip(b"\0").decode("utf-8", "replace")
+                offset += name_len
+                if mask & self.IN_Q_OVERFLOW:
+                    return None
+                elif wd in self._dirs:
+                    changed.add((self._dirs[wd], name))
+
+    def close(self):
+        os.close(self._fd)
+
+###############################################################################
+class _WatchedTest(object):
+###############################################################################
+    """
+    What watch_tests knows about a single test_path
+    """
+
+    def __init__(self, test_path):
+        if (os.path.isdir(test_path)):
+            self.status_filepath = os.path.join(test_path, TEST_STATUS_FILENAME)
+        else:
+            self.status_filepath = test_path
+
+        logging.debug("Watching file: '{}'".format(self.status_filepath))
+        self.test_path = test_path
+        self.test_dir = os.path.dirname(self.status_filepath)
+        self.journal_filepath = os.path.join(self.test_dir, TEST_STATUS_JOURNAL_FILENAME)
+        self.signature = None
+        self.parse_time = None
+        self.prior_ts = None
+        self.index_row = None
+        if os.path.basename(self.status_filepath) == TEST_STATUS_FILENAME:
+            self.index_key = os.path.split(os.path.abspath(self.test_dir))
+        else:
+            self.index_key = None
+
+        # We don't want to make it a requirement that wait_for_tests has write access
+        # to all case directories
+        self.log_path = os.path.join(self.test_dir, ".internal_test_status.log")
+        try:
+            fd = open(self.log_path, "w")
+            fd.close()
+        except (IOError, OSError):
+            self.log_path = "/dev/null"
+
+    def get_signature(self):
+        """
+        Return the mtime, size and inode of the TestStatus file and its journal,
+        None if there is no TestStatus file
+        """
+        signature = []
+        for filepath in [self.status_filepath, self.journal_filepath]:
+            try:
+                st = os.stat(filepath)
+                signature.append((st.st_mtime, st.st_size, st.st_ino))
+            except OSError:
+                if filepath == self.status_filepath:
+                    return None
+                signature.append(None)
+
+        return tuple(signature)
+
+    def get_index_row(self, indexes):
+        """
+        Return the (sequence number, contents) of this test in the test status
+        index of its test root, None if it is not there. indexes is
+        {test root -> index rows}, filled in as needed.
+        """
+        if self.index_key is None:
+            return None
+
+        test_root, case_dir = self.index_key
+        if test_root not in indexes:
+            indexes[test_root] = read_test_status_index(test_root)
+
+        return indexes[test_root].get(case_dir)
+
+    def is_stale(self):
+        """
+        Return True if the TestStatus file may have changed since it was last parsed
+        """
+        signature = self.get_signature()
+        if signature is None:
+            return self.signature is not None
+
+        last_mtime = max(item[0] for item in signature if item is not None)
+        return (signature != self.signature or
+                self.parse_time is None or last_mtime + MTIME_RESOLUTION_SEC >= self.parse_time)
+
+    def check(self, finish, check_throughput, check_memory, ignore_namelists, ignore_memleak, no_run, contents=None):
+        """
+        Parse the TestStatus file, or contents from the test status index if given.
+        Returns (test_name, test_path, test_status, test_phase) if the test is done,
+        or if finish is True, otherwise None
+        """
+        self.parse_time = time.time()
+        self.signature = None if contents is not None else self.get_signature()
+        if contents is None and self.signature is None:
+            if finish:
+                test_name = os.path.abspath(self.status_filepath).split("/")[-2]
+                return (test_name, self.test_path, "File '{}' doesn't exist".format(self.status_filepath), CREATE_NEWCASE_PHASE)
             else:
-                if (wait and not SIGNAL_RECEIVED):
-                    logging.debug("File '{}' does not yet exist".format(test_status_filepath))
-                    time.sleep(SLEEP_INTERVAL_SEC)
+                logging.debug("File '{}' does not yet exist".format(self.status_filepath))
+                return None
+
+        ts = TestStatus(test_dir=self.test_dir, contents=contents)
+        test_name = ts.get_name()
+        test_status, test_phase = ts.get_overall_test_status(wait_for_run=not no_run, # Important
+                                                             no_run=no_run,
+                                                             check_throughput=check_throughput,
+                                                             check_memory=check_memory, ignore_namelists=ignore_namelists,
+                                                             ignore_memleak=ignore_memleak)
+
+        if self.prior_ts is not None and self.prior_ts != ts:
+            with open(self.log_path, "a") as log_fd:
+                log_fd.write(ts.phase_statuses_dump())
+                log_fd.write("OVERALL: {}\n\n".format(test_status))
+
+        self.prior_ts = ts
+
+        if test_status == TEST_PEND_STATUS and not finish:
+            return None
+        else:
+            return (test_name, self.test_path, test_status, test_phase)
+
+###############################################################################
+def watch_tests(test_paths, wait=True, check_throughput=False, check_memory=False, ignore_namelists=False,
+                ignore_memleak=False, no_run=False, use_inotify=True):
+###############################################################################
+    """
+    Follow the TestStatus files of test_paths from a single thread and yield
+    (test_name, test_path, test_status, test_phase) for each test as soon as it
+    completes. Once waiting stops (wait is False or a signal was received), the
+    remaining tests are yielded with their current status.
+
+    A TestStatus file is only re-parsed when it changed. Changes are found with
+    inotify on Linux, backed up by periodic scans. A scan reads the test status
+    index of each test root once, and compares mtime and size of the TestStatus
+    files of tests that are not in an index.
+    """
+    watched = dict((test_path, _WatchedTest(test_path)) for test_path in set(test_paths))
+
+    inotify = None
+    if use_inotify:
+        try:
+            inotify = Inotify()
+        except CIMEError as e:
+            logging.debug("Not using inotify: {}".format(e))
+
+    watched_dirs = {} # test dir -> test_paths whose TestStatus file lives there
+    scan_interval = SCAN_INTERVAL_SEC if inotify is None else INOTIFY_SCAN_INTERVAL_SEC
+    next_scan = 0
+    dirty = set() # Tests to re-parse from their TestStatus files
+    try:
+        while watched:
+            finish = not wait or SIGNAL_RECEIVED
+            from_index = {} # Tests to re-parse from the index -> index row
+            if finish or time.time() >= next_scan:
+                indexes = {}
+                for test_path, test in watched.items():
+                    if inotify is not None and test.test_dir not in watched_dirs and inotify.add_watch(test.test_dir):
+                        watched_dirs[test.test_dir] = [other for other, item in watched.items() if item.test_dir == test.test_dir]
+
+                    index_row = None if test_path in dirty else test.get_index_row(indexes)
+                    if index_row is not None:
+                        if finish or index_row != test.index_row:
+                            from_index[test_path] = index_row
+                    elif finish or test.is_stale():
+                        dirty.add(test_path)
+
+                next_scan = time.time() + scan_interval
+
+            for test_path in sorted(dirty | set(from_index)):
+                test = watched[test_path]
+                contents = None
+                if test_path in from_index:
+                    test.index_row = from_index[test_path]
+                    contents = test.index_row[1]
+
+                result = test.check(finish, check_throughput, check_memory, ignore_namelists, ignore_memleak, no_run,
+                                    contents=contents)
+                if result is not None:
+                    del watched[test_path]
+                    yield result
+
+            dirty = set()
+            if watched and not finish:
+                timeout = max(min(next_scan - time.time(), 1), 0)
+                if inotify is None:
+                    time.sleep(timeout)
                 else:
-                    test_name = os.path.abspath(test_status_filepath).split("/")[-2]
-                    results.put( (test_name, test_path, "File '{}' doesn't exist".format(test_status_filepath), CREATE_NEWCASE_PHASE) )
-                    break
+                    changed = inotify.read_events(timeout)
+                    if changed is None:
+                        next_scan = 0
+                    else:
+                        for test_dir, filename in changed:
+                            dirty.update(test_path for test_path in watched_dirs.get(test_dir, [])
+                                         if test_path in watched and
+                                         filename in [os.path.basename(watched[test_path].status_filepath),
+                                                      TEST_STATUS_JOURNAL_FILENAME])
+
+                logging.debug("Waiting for {:d} tests to finish".format(len(watched)))
+    finally:
+        if inotify is not None:
+            inotify.close()
 
 ###############################################################################
 def wait_for_tests_impl(test_paths, no_wait=False, check_throughput=False, check_memory=False, ignore_namelists=False, ignore_memleak=False, no_run=False):
 ###############################################################################
-    results = queue.Queue()
-
-    for test_path in test_paths:
-        t = threading.Thread(target=wait_for_test, args=(test_path, results, not no_wait, check_throughput, check_memory, ignore_namelists, ignore_memleak, no_run))
-        t.daemon = True
-        t.start()
-
-    while threading.active_count() > 1:
-        time.sleep(1)
-
     test_results = {}
     completed_test_paths = []
-    while (not results.empty()):
-        test_name, test_path, test_status, test_phase = results.get()
+    for test_name, test_path, test_status, test_phase in watch_tests(test_paths, not no_wait, check_throughput, check_memory,
+                                                                     ignore_namelists, ignore_memleak, no_run):
+        logging.debug("Test '{}' finished with status {}".format(test_name, test_status))
         if (test_name in test_results):
             prior_path, prior_status, _ = test_results[test_name]
             if (test_status == prior_status):
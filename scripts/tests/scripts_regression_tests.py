@@ -1688,6 +1688,18 @@ class M_TestCimePerformance(TestCreateTestCommon):
 
         print("Perf test result: {:0.2f}".format(elapsed))
 
+    ###########################################################################
+    def test_phase_backend_performance(self):
+    ###########################################################################
+        # create_test logs the per-phase throughput at the end of each run
+        for backend in ["threads", "processes"]:
+            ts = time.time()
+            self._create_test(["cime_developer", "--no-setup", "--phase-backend={}".format(backend)],
+                              test_id="{}-{}".format(self._baseline_name, backend))
+            elapsed = time.time() - ts
+
+            print("Perf test result for {} backend: {:0.2f}".format(backend, elapsed))
+
 ###############################################################################
 class T_TestRunRestart(TestCreateTestCommon):
 ###############################################################################